@@ -0,0 +1,219 @@
+""" Reproducible read/write benchmarks over synthetic recordings (see synthetic.py) of every RavfImageFormat / RavfColorType
+
+    python benchmarks/benchmark_suite.py [--quick] [--output results.json] [--compare baseline.json]
+                                         [--formats FORMAT_PACKED_10BIT ...] [--colors MONO BAYER_BGGR ...] [--directory dir]
+
+For each configuration, at a realistic sensor size for the format, it measures:
+    write_fps                RavfWriter.write_frame frames/sec (through the page cache, as writer_benchmark.py)
+    open_ms                  RavfReader construction (header + RavfIndex.deserialize), best of 5
+    decode_ms                RavfDecodePlan.decode of a frame already in memory (the RavfImageUtils.unpack_* path)
+    sequential_ms            getPymovieMainImageAndStatusData latency reading frames in order
+    random_ms                the same in a seeded random order
+    peak_rss_mb              peak resident memory of the process
+Latencies are {p50, p90, p99, max} in ms. Every configuration runs in a new Python process, so peak RSS is its own.
+
+Results are written as JSON with the environment they were measured in. --compare prints the change of every metric
+from an earlier results file and exits with 1 if any regressed by more than --threshold.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ravf import RavfReader, RavfWriter, RavfDecodeRegistry, RavfColorType, RavfImageEndianess, RavfImageFormat
+from ravf.ravf_frame import RavfFrameType
+import synthetic
+
+# Sensor sizes recordings of each format typically come from
+SENSORS = {
+    RavfImageFormat.FORMAT_PACKED_10BIT:   (1456, 1088),	# Pi Global Shutter Camera (IMX296)
+    RavfImageFormat.FORMAT_PACKED_12BIT:   (4056, 3040),	# Pi HQ Camera (IMX477)
+    RavfImageFormat.FORMAT_UNPACKED_10BIT: (1456, 1088),
+    RavfImageFormat.FORMAT_UNPACKED_12BIT: (2028, 1520),	# Pi HQ Camera 2x2 binned
+    RavfImageFormat.FORMAT_16BIT:          (1936, 1096),	# IMX174 astro camera
+    RavfImageFormat.FORMAT_8BIT:           (1920, 1080),
+}
+
+RECORDING_BYTES = 512 * 1024 * 1024		# Recordings are about this size, within the frame limits below
+(MIN_FRAMES, MAX_FRAMES) = (32, 500)
+LATENCY_FRAMES = 100			# Frames read for each of the latency measurements
+QUICK_SCALE = 8					# --quick divides the sensor sizes by this
+QUICK_FRAMES = 64
+
+# Metrics where larger is better, for --compare, all others are smaller is better
+HIGHER_IS_BETTER = ('write_fps',)
+
+
+def configurations(formats: list, colors: list, quick: bool) -> list:
+    configs = []
+    for format in formats:
+        for color_type in colors:
+            if not RavfDecodeRegistry.is_supported(format, color_type, RavfImageEndianess.LITTLE_ENDIAN, 'gray'):
+                continue
+            (width, height) = SENSORS[format]
+            if quick:
+                (width, height) = (width // QUICK_SCALE // 4 * 4, height // QUICK_SCALE // 2 * 2)
+            frame_bytes = synthetic.stride_for(format, width, color_type) * height
+            frames = QUICK_FRAMES if quick else int(np.clip(RECORDING_BYTES // frame_bytes, MIN_FRAMES, MAX_FRAMES))
+            configs.append({'format': format.name, 'color_type': color_type.name, 'width': width, 'height': height, 'frames': frames})
+    return configs
+
+
+def percentiles(seconds: list) -> dict:
+    ms = np.array(seconds) * 1000.0
+    return {'p50': float(np.percentile(ms, 50)), 'p90': float(np.percentile(ms, 90)), 'p99': float(np.percentile(ms, 99)), 'max': float(ms.max())}
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return None		# Not available on Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024	# bytes on macOS, KB elsewhere
+
+
+def run_configuration(config: dict, directory: str) -> dict:
+    """Runs the benchmarks of one configuration in this process"""
+    (format, color_type) = (RavfImageFormat[config['format']], RavfColorType[config['color_type']])
+    (width, height, frames) = (config['width'], config['height'], config['frames'])
+    pool = synthetic.frame_pool(format, color_type, width, height)
+    file_name = os.path.join(directory, f'benchmark_{format.name}_{color_type.name}.ravf')
+    result = dict(config)
+
+    try:
+        with open(file_name, 'wb+') as file_handle:
+            with contextlib.redirect_stdout(io.StringIO()):
+                writer = RavfWriter(file_handle, synthetic.required_entries(format, color_type, width, height), [])
+            started = time.perf_counter()
+            for i in range(frames):
+                writer.write_frame(file_handle, RavfFrameType.LIGHT, pool[i % len(pool)], synthetic.EPOCH_OFFSET + i * synthetic.FRAME_INTERVAL, synthetic.FRAME_INTERVAL, 10, 0, 0, 3, i)
+            file_handle.flush()
+            result['write_fps'] = frames / (time.perf_counter() - started)
+            with contextlib.redirect_stdout(io.StringIO()):
+                writer.finish(file_handle)
+        result['frame_bytes'] = int(pool[0].nbytes)
+        result['file_bytes'] = os.path.getsize(file_name)
+
+        with open(file_name, 'rb') as file_handle:
+            times = []
+            for i in range(5):
+                started = time.perf_counter()
+                reader = RavfReader(file_handle)
+                times.append(time.perf_counter() - started)
+            result['open_ms'] = min(times) * 1000.0
+
+            plan = reader.decode_plan
+            out = np.empty(plan.output_shape, np.uint16)
+            times = []
+            for i in range(min(LATENCY_FRAMES, 3 * len(pool))):
+                started = time.perf_counter()
+                plan.decode(pool[i % len(pool)], out)
+                times.append(time.perf_counter() - started)
+            result['decode_ms'] = percentiles(times)
+
+            count = min(LATENCY_FRAMES, frames)
+            orders = (('sequential_ms', np.arange(count)), ('random_ms', np.random.default_rng(0).permutation(frames)[:count]))
+            for (name, order) in orders:
+                times = []
+                for index in order:
+                    started = time.perf_counter()
+                    reader.getPymovieMainImageAndStatusData(file_handle, int(index))
+                    times.append(time.perf_counter() - started)
+                result[name] = percentiles(times)
+            reader.close()
+    finally:
+        os.remove(file_name)
+
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def environment() -> dict:
+    import cv2
+    try:
+        from importlib.metadata import version
+        ravf_version = version('ravf')
+    except Exception:
+        ravf_version = None		# Run from the source tree without being installed
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__, 'ravf': ravf_version,
+            'platform': platform.platform(), 'machine': platform.machine(), 'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def metrics(result: dict) -> dict:
+    """Flattens a result's metrics to {name: value}, e.g. random_ms.p99"""
+    flat = {}
+    for (name, value) in result.items():
+        if isinstance(value, dict):
+            flat.update({f'{name}.{key}': v for (key, v) in value.items()})
+        elif name in HIGHER_IS_BETTER or name in ('open_ms', 'peak_rss_mb'):
+            flat[name] = value
+    return flat
+
+
+def compare(results: list, baseline_file: str, threshold: float) -> bool:
+    """Prints the change of every metric from baseline_file, returns True if none regressed by more than threshold"""
+    with open(baseline_file) as f:
+        baseline = {(r['format'], r['color_type']): r for r in json.load(f)['results']}
+    ok = True
+    for result in results:
+        old = baseline.get((result['format'], result['color_type']))
+        if old is None:
+            continue
+        old_metrics = metrics(old)
+        for (name, value) in metrics(result).items():
+            previous = old_metrics.get(name)
+            if value is None or not previous:
+                continue
+            change = value / previous - 1
+            regressed = -change > threshold if name in HIGHER_IS_BETTER else change > threshold
+            ok &= not regressed
+            print(f'{result["format"]} {result["color_type"]} {name}: {previous:.3f} -> {value:.3f} ({change:+.1%}){"  REGRESSION" if regressed else ""}')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'RAVF read/write benchmark suite')
+    parser.add_argument('--quick', action = 'store_true', help = f'sensor sizes / {QUICK_SCALE}, {QUICK_FRAMES} frames')
+    parser.add_argument('--formats', nargs = '+', default = [f.name for f in RavfImageFormat], choices = [f.name for f in RavfImageFormat])
+    parser.add_argument('--colors', nargs = '+', default = [c.name for c in RavfColorType], choices = [c.name for c in RavfColorType])
+    parser.add_argument('--directory', default = tempfile.gettempdir(), help = 'where the recordings are written')
+    parser.add_argument('--output', help = 'JSON results file')
+    parser.add_argument('--compare', help = 'earlier JSON results file to compare with')
+    parser.add_argument('--threshold', type = float, default = 0.1, help = 'regression threshold for --compare (fraction)')
+    parser.add_argument('--run', help = argparse.SUPPRESS)	# Internal, one configuration as JSON
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_configuration(json.loads(args.run), args.directory)))
+        return
+
+    configs = configurations([RavfImageFormat[f] for f in args.formats], [RavfColorType[c] for c in args.colors], args.quick)
+    results = []
+    for config in configs:
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), '--directory', args.directory, '--run', json.dumps(config)], capture_output = True, text = True, check = True)
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f'{result["format"]} {result["color_type"]} {result["width"]}x{result["height"]}: write {result["write_fps"]:.0f} frames/sec, open {result["open_ms"]:.2f} ms, '
+              f'decode p50 {result["decode_ms"]["p50"]:.2f} ms, sequential p50/p99 {result["sequential_ms"]["p50"]:.2f}/{result["sequential_ms"]["p99"]:.2f} ms, '
+              f'random p50/p99 {result["random_ms"]["p50"]:.2f}/{result["random_ms"]["p99"]:.2f} ms, peak RSS {result["peak_rss_mb"]:.0f} MB', flush = True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'settings': {'quick': args.quick, 'recording_bytes': RECORDING_BYTES, 'latency_frames': LATENCY_FRAMES}, 'results': results}, f, indent = 2)
+
+    if args.compare and not compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+""" Synthetic RAVF recordings for benchmarking: a star field (sky background, gaussian stars, read noise) in any
+    RavfImageFormat / RavfColorType, packed exactly as the camera would write it
+
+    python benchmarks/synthetic.py output.ravf [format] [color type] [width] [height] [frames]
+
+e.g. python benchmarks/synthetic.py imx477.ravf FORMAT_PACKED_12BIT BAYER_BGGR 4056 3040 100
+
+Generating noise for every frame would take longer than writing it, so a pool of distinct frames is generated
+once (seeded, so recordings are reproducible) and written in turn.
+"""
+import contextlib
+import io
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from ravf import RavfWriter, RavfColorType, RavfImageEndianess, RavfImageFormat
+from ravf.ravf_frame import RavfFrameType
+
+BITS = {
+    RavfImageFormat.FORMAT_8BIT:           8,
+    RavfImageFormat.FORMAT_16BIT:          16,
+    RavfImageFormat.FORMAT_PACKED_10BIT:   10,
+    RavfImageFormat.FORMAT_PACKED_12BIT:   12,
+    RavfImageFormat.FORMAT_UNPACKED_10BIT: 10,
+    RavfImageFormat.FORMAT_UNPACKED_12BIT: 12,
+}
+
+POOL_FRAMES = 8
+FRAME_INTERVAL = 40_000_000		# 25 frames/sec in ns
+EPOCH_OFFSET = 500_000_000 * 1_000_000_000	# Frame timestamps start in 2025
+
+
+def channels(color_type: RavfColorType) -> int:
+    return 3 if color_type in (RavfColorType.RGB, RavfColorType.BGR) else 1
+
+
+def row_bytes(format: RavfImageFormat, width: int, color_type: RavfColorType) -> int:
+    samples = width * channels(color_type)
+    if format == RavfImageFormat.FORMAT_PACKED_10BIT:
+        return samples * 5 // 4
+    if format == RavfImageFormat.FORMAT_PACKED_12BIT:
+        return samples * 3 // 2
+    if format == RavfImageFormat.FORMAT_8BIT:
+        return samples
+    return samples * 2
+
+
+def stride_for(format: RavfImageFormat, width: int, color_type: RavfColorType) -> int:
+    """Rows padded to 32 bytes, as the Pi cameras do"""
+    return (row_bytes(format, width, color_type) + 31) // 32 * 32
+
+
+def required_entries(format: RavfImageFormat, color_type: RavfColorType, width: int, height: int, endianess: RavfImageEndianess = RavfImageEndianess.LITTLE_ENDIAN) -> list:
+    return [
+        ('COLOR-TYPE',            color_type.value),
+        ('IMAGE-ENDIANESS',       endianess.value),
+        ('IMAGE-WIDTH',           width),
+        ('IMAGE-HEIGHT',          height),
+        ('IMAGE-ROW-STRIDE',      stride_for(format, width, color_type)),
+        ('IMAGE-FORMAT',          format.value),
+        ('FRAME-TIMING-ACCURACY', 1000),
+    ]
+
+
+def star_field(width: int, height: int, bits: int, rng: np.random.Generator, stars: int = 200) -> np.ndarray:
+    """Returns a float32 (height, width) noiseless image of a sky background with gaussian stars, in ADU of a bits deep sensor"""
+    full_scale = (1 << bits) - 1
+    image = np.full((height, width), 0.05 * full_scale, np.float32)
+    (ys, xs) = (np.arange(height, dtype=np.float32)[:, None], np.arange(width, dtype=np.float32)[None, :])
+    for (x, y, peak, sigma) in zip(rng.uniform(0, width, stars), rng.uniform(0, height, stars), full_scale * rng.uniform(0.02, 1.0, stars) ** 2, rng.uniform(0.8, 2.5, stars)):
+        (x0, x1, y0, y1) = (max(0, int(x - 4 * sigma)), min(width, int(x + 4 * sigma) + 1), max(0, int(y - 4 * sigma)), min(height, int(y + 4 * sigma) + 1))
+        image[y0:y1, x0:x1] += peak * np.exp(-((xs[:, x0:x1] - x) ** 2 + (ys[y0:y1] - y) ** 2) / (2 * sigma * sigma))
+    return image
+
+
+def pack(samples: np.ndarray, format: RavfImageFormat, stride: int, endianess: RavfImageEndianess = RavfImageEndianess.LITTLE_ENDIAN) -> np.ndarray:
+    """Packs (height, samples per row) uint16 samples of BITS[format] bits into (height, stride) uint8 image data"""
+    (height, count) = samples.shape
+    data = np.zeros((height, stride), np.uint8)
+    if format == RavfImageFormat.FORMAT_8BIT:
+        data[:, :count] = samples
+    elif format == RavfImageFormat.FORMAT_PACKED_10BIT:
+        # AAAAAAAA BBBBBBBB CCCCCCCC DDDDDDDD AABBCCDD
+        groups = samples.reshape(height, -1, 4)
+        packed = data[:, :count * 5 // 4].reshape(height, -1, 5)
+        packed[..., :4] = groups >> 2
+        packed[..., 4] = ((groups[..., 0] & 3) << 6) | ((groups[..., 1] & 3) << 4) | ((groups[..., 2] & 3) << 2) | (groups[..., 3] & 3)
+    elif format == RavfImageFormat.FORMAT_PACKED_12BIT:
+        # aaaabbbb AAAAAAAA BBBBBBBB
+        pairs = samples.reshape(height, -1, 2)
+        packed = data[:, :count * 3 // 2].reshape(height, -1, 3)
+        packed[..., 0] = ((pairs[..., 0] & 0xF) << 4) | (pairs[..., 1] & 0xF)
+        packed[..., 1:] = pairs >> 4
+    else:
+        dtype = '>u2' if endianess == RavfImageEndianess.BIG_ENDIAN else '<u2'
+        data[:, :count * 2].view(dtype)[:] = samples
+    return data
+
+
+def frame_pool(format: RavfImageFormat, color_type: RavfColorType, width: int, height: int, endianess: RavfImageEndianess = RavfImageEndianess.LITTLE_ENDIAN, count: int = POOL_FRAMES, seed: int = 0) -> list:
+    """Returns count distinct (height, stride) uint8 frames of the same star field with different noise"""
+    rng = np.random.default_rng(seed)
+    bits = BITS[format]
+    full_scale = (1 << bits) - 1
+    field = star_field(width, height, bits, rng)
+    if channels(color_type) == 3:
+        field = np.repeat(field, 3, axis=1) * np.tile(np.float32([1.0, 0.8, 0.6]), width)	# Interleaved, slightly colored
+    stride = stride_for(format, width, color_type)
+
+    pool = []
+    for i in range(count):
+        noisy = field + rng.normal(0, 0.002 * full_scale + 1, field.shape).astype(np.float32)
+        pool.append(pack(np.clip(noisy, 0, full_scale).astype(np.uint16), format, stride, endianess))
+    return pool
+
+
+def write(file_name: str, format: RavfImageFormat, color_type: RavfColorType, width: int, height: int, frames: int, endianess: RavfImageEndianess = RavfImageEndianess.LITTLE_ENDIAN, seed: int = 0, pool: list = None):
+    """Writes a synthetic recording of frames frames at 25 frames/sec, pool is an optional frame_pool to use"""
+    if pool is None:
+        pool = frame_pool(format, color_type, width, height, endianess, seed = seed)
+    with open(file_name, 'wb+') as file_handle:
+        with contextlib.redirect_stdout(io.StringIO()):
+            writer = RavfWriter(file_handle, required_entries(format, color_type, width, height, endianess), [])
+        for i in range(frames):
+            writer.write_frame(file_handle, RavfFrameType.LIGHT, pool[i % len(pool)], EPOCH_OFFSET + i * FRAME_INTERVAL, FRAME_INTERVAL, 10, 0, 0, 3, i)
+        with contextlib.redirect_stdout(io.StringIO()):
+            writer.finish(file_handle)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    args = sys.argv[1:] + [None] * 5
+    format = RavfImageFormat[args[1] or 'FORMAT_PACKED_12BIT']
+    color_type = RavfColorType[args[2] or 'BAYER_BGGR']
+    (width, height, frames) = (int(args[3] or 4056), int(args[4] or 3040), int(args[5] or 100))
+    write(args[0], format, color_type, width, height, frames)
+    print(f'{args[0]}: {width}x{height} {format.name} {color_type.name}, {frames} frames, {os.path.getsize(args[0])} bytes')
+
+
+if __name__ == '__main__':
+    main()
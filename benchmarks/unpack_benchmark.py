@@ -0,0 +1,63 @@
+""" Per-frame decode time of packed 10/12-bit frames at Pi HQ (IMX477) full resolution
+
+    python benchmarks/unpack_benchmark.py
+"""
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from ravf import RavfImageUtils
+
+WIDTH  = 4056
+HEIGHT = 3040
+REPEATS = 20
+
+
+def stride_for(row_length: int) -> int:
+    return (row_length + 31) // 32 * 32
+
+
+def best_ms(fn, *args) -> float:
+    fn(*args)
+    times = []
+    for i in range(REPEATS):
+        t = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - t)
+    return min(times) * 1000.0
+
+
+def reference_10bit(image, stride):
+    image = RavfImageUtils.unstride_10bit(image, WIDTH, HEIGHT)
+    image = RavfImageUtils.unpack_10bit_pigsc(image, WIDTH, HEIGHT, stride)
+    return RavfImageUtils.scale_10_to_16bit(image)
+
+
+def reference_12bit(image, stride):
+    image = RavfImageUtils.unstride_12bit(image, WIDTH, HEIGHT)
+    image = RavfImageUtils.unpack_12bit_pihq(image, WIDTH, HEIGHT, stride)
+    return RavfImageUtils.scale_12_to_16bit(image)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    out = np.empty((HEIGHT, WIDTH), np.uint16)
+
+    print(f'{WIDTH}x{HEIGHT}, best of {REPEATS}')
+    for (name, row_length, reference, fused) in (
+        ('10-bit packed', WIDTH * 5 // 4, reference_10bit, RavfImageUtils.unpack_10bit_pigsc_to_16bit),
+        ('12-bit packed', WIDTH * 3 // 2, reference_12bit, RavfImageUtils.unpack_12bit_pihq_to_16bit),
+    ):
+        stride = stride_for(row_length)
+        image = RavfImageUtils.bytes_to_np_array(rng.integers(0, 256, stride * HEIGHT, dtype=np.uint8).tobytes(), stride, HEIGHT)
+        assert np.array_equal(fused(image, WIDTH, HEIGHT, out), reference(image, stride))
+
+        ms_reference = best_ms(reference, image, stride)
+        ms_fused = best_ms(fused, image, WIDTH, HEIGHT, out)
+        print(f'{name}: unstride+unpack+scale {ms_reference:.1f} ms, fused {ms_fused:.1f} ms ({ms_reference / ms_fused:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+""" Frames/sec of RavfWriter.write_frame for 1080p 10-bit packed frames
+
+    python benchmarks/writer_benchmark.py [output directory]
+
+Runs each writer path unconstrained and, where the OS supports CPU affinity, pinned to a single core to
+approximate CPU constrained hardware such as a Raspberry Pi. Writes go through the page cache, so this measures
+the CPU cost of the writer rather than the storage. Writing to /dev/null as well removes the page cache copy,
+leaving only the per-frame overhead of the writer itself.
+"""
+import contextlib
+import io
+import os
+import struct
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from ravf import RavfWriter, RavfColorType, RavfImageFormat
+from ravf.ravf_frame import RavfFrame, RavfFrameType
+
+WIDTH  = 1920
+HEIGHT = 1080
+STRIDE = WIDTH * 5 // 4
+FRAMES = 300
+
+
+def required_entries():
+    return [
+        ('COLOR-TYPE',            RavfColorType.BAYER_BGGR.value),
+        ('IMAGE-ENDIANESS',       1),
+        ('IMAGE-WIDTH',           WIDTH),
+        ('IMAGE-HEIGHT',          HEIGHT),
+        ('IMAGE-ROW-STRIDE',      STRIDE),
+        ('IMAGE-FORMAT',          RavfImageFormat.FORMAT_PACKED_10BIT.value),
+        ('FRAME-TIMING-ACCURACY', 0),
+    ]
+
+
+def legacy_write_frame(writer, file_handle, data, i):
+    """The original write_frame: tell(), a RavfFrame per frame, struct.pack + padding concatenation and 2 writes"""
+    offset_frame = file_handle.tell()
+    ser = struct.pack('<QIIBQQBBbBI', RavfFrame.RAVF_MAGIC, RavfFrame.RAVF_HEADER_LENGTH, len(data), RavfFrameType.LIGHT.value, i, 1000, 8, 0, 0, 3, i)
+    ser += bytearray(60)
+    file_handle.write(ser)
+    file_handle.write(data)
+    writer.index.add_frame(offset_frame, i)
+    writer.header.increment_frame_count()
+
+
+def fast_write_frame(writer, file_handle, data, i):
+    writer.write_frame(file_handle, RavfFrameType.LIGHT, data, i, 1000, 8, 0, 0, 3, i)
+
+
+def frames_per_second(path, write, data) -> float:
+    """Best of 3 runs"""
+    return max(frames_per_second_once(path, write, data) for i in range(3))
+
+
+def frames_per_second_once(path, write, data) -> float:
+    try:
+        with open(path, 'wb+') as file_handle:
+            with contextlib.redirect_stdout(io.StringIO()):
+                writer = RavfWriter(file_handle, required_entries(), [])
+            t = time.perf_counter()
+            for i in range(FRAMES):
+                write(writer, file_handle, data, i)
+            file_handle.flush()
+            elapsed = time.perf_counter() - t
+            with contextlib.redirect_stdout(io.StringIO()):
+                writer.finish(file_handle)
+    finally:
+        if path != os.devnull:
+            os.remove(path)
+    return FRAMES / elapsed
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else tempfile.gettempdir()
+    # A numpy array as a camera buffer would be, the fast path writes it without converting to bytes
+    data = np.random.default_rng(0).integers(0, 256, (HEIGHT, STRIDE), dtype=np.uint8)
+
+    profiles = [('all cores', None)]
+    if hasattr(os, 'sched_setaffinity'):
+        profiles.append(('single core', {min(os.sched_getaffinity(0))}))
+
+    paths = [os.path.join(directory, 'writer_benchmark.ravf')]
+    if os.path.exists(os.devnull):
+        paths.append(os.devnull)
+
+    print(f'{WIDTH}x{HEIGHT} 10-bit packed ({STRIDE * HEIGHT} bytes/frame), {FRAMES} frames, best of 3')
+    original_affinity = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else None
+    for (profile, cpus) in profiles:
+        if cpus is not None:
+            os.sched_setaffinity(0, cpus)
+        for path in paths:
+            # The legacy path needs bytes, so gets the conversion from the camera buffer it would have needed
+            legacy = frames_per_second(path, lambda writer, file_handle, data, i: legacy_write_frame(writer, file_handle, data.tobytes(), i), data)
+            fast = frames_per_second(path, fast_write_frame, data)
+            print(f'{profile}, {path}: legacy {legacy:.0f} frames/sec, write_frame {fast:.0f} frames/sec')
+        if original_affinity is not None:
+            os.sched_setaffinity(0, original_affinity)
+
+
+if __name__ == '__main__':
+    main()
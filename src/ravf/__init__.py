@@ -2,4 +2,17 @@ from .metadata_entry import RavfMetadataType, RavfColorType, RavfImageEndianess,
 from .ravf_frame import RavfFrameType
 from .ravf_reader import RavfReader
 from .ravf_writer import RavfWriter
+from .ravf_async_writer import RavfAsyncWriter
+from .ravf_frame_cache import RavfFrameCache
+from .ravf_decode_plan import RavfDecodePlan, RavfDecodeRegistry
+from .ravf_photometry import RavfAperture, RavfPhotometry
+from .ravf_calibration import RavfCalibration, RavfMeanAccumulator, RavfSigmaClipAccumulator, RavfMedianAccumulator
+from .ravf_frame_stats import RavfFrameStats
+from .ravf_timing import RavfTimingAnalyzer
+from .ravf_compression import RavfCompression, RavfCompressionType
+from .ravf_transcoder import RavfTranscoder
+from .ravf_exporter import RavfExporter
+from .ravf_segmented import RavfSegmentedWriter, RavfSegmentedReader
+from .ravf_editor import RavfEditor
+from .ravf_instrumentation import RavfInstrumentation, RavfHistogram
 from .ravf_image_utils import *
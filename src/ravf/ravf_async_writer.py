@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+from .metadata_entry import UTF8String, RavfMetadataType
+from .ravf_frame import RavfFrameType
+from .ravf_writer import RavfWriter
+from .ravf_instrumentation import RavfInstrumentation
+
+class RavfAsyncWriter(RavfWriter):
+    """RavfWriter that hands frames to a dedicated writer thread, so the capture loop never blocks on storage.
+
+    Frame data is copied into one of buffer_count preallocated buffers of buffer_size bytes (if None, sized from
+    the first frame) and queued. If all buffers are in use, write_frame either waits for one (block_when_full = True)
+    or drops the frame and returns False. finish() drains the queue before the index is written.
+    checkpoint() is queued too, it runs on the writer thread after the frames queued before it."""
+
+    def __init__(self, file_handle, required_metadata_entries: list((UTF8String, object)), user_metadata_entries: list((UTF8String, RavfMetadataType, object)), buffer_count: int = 8, buffer_size: int = None, block_when_full: bool = False, checkpoint_frames: int = 0, checkpoint_seconds: float = 0, frame_stats: bool = False, stats_row_step: int = 4, quiet: bool = False):
+        super().__init__(file_handle, required_metadata_entries, user_metadata_entries, checkpoint_frames, checkpoint_seconds, frame_stats, stats_row_step, quiet)
+
+        assert buffer_count > 0, 'buffer_count must be > 0'
+        self.__buffer_count = buffer_count
+        self.__buffers = None
+        if buffer_size is not None:
+            self.__allocate_buffers(buffer_size)
+        self.__block_when_full = block_when_full
+
+        self.__free = queue.Queue()		# Indices of buffers available to the capture thread
+        for i in range(buffer_count):
+            self.__free.put(i)
+        self.__pending = queue.Queue()	# Frames waiting to be written (buffer index None for a checkpoint), None stops the writer thread
+        self.__error = None
+
+        self.frames_queued = 0
+        self.frames_written = 0
+        self.dropped_frames = 0
+        self.backpressure_events = 0	# Number of times write_frame found no free buffer
+        self.max_queue_depth = 0
+
+        self.__thread = threading.Thread(target = self.__run, name = 'RavfAsyncWriter', daemon = True)
+        self.__thread.start()
+
+    def __allocate_buffers(self, buffer_size: int):
+        self.__buffers = [bytearray(buffer_size) for i in range(self.__buffer_count)]
+
+    def __run(self):
+        while True:
+            item = self.__pending.get()
+            if item is None:
+                return
+
+            (file_handle, buffer_index, length, args) = item
+            try:
+                if self.__error is None:
+                    if buffer_index is None:
+                        super().checkpoint(file_handle)
+                    else:
+                        super().write_frame(file_handle, args[0], memoryview(self.__buffers[buffer_index])[:length], *args[1:])
+                        self.frames_written += 1
+            except Exception as e:
+                self.__error = e	# Reported to the capture thread on the next write_frame or finish
+            finally:
+                if buffer_index is not None:
+                    self.__free.put(buffer_index)
+
+    def __raise_error(self):
+        if self.__error is not None:
+            raise RuntimeError('RavfAsyncWriter writer thread failed') from self.__error
+
+    def write_frame(self, file_handle, frame_type: RavfFrameType, data: bytes, start_timestamp: int, exposure_duration: int, satellites: int, almanac_status: int, almanac_offset: int, satellite_fix_status: int, sequence: int) -> bool:
+        """Queues the frame for writing, returns False if it was dropped because no buffer was free"""
+        self.__raise_error()
+
+        data = memoryview(data).cast('B')
+        if self.__buffers is None:
+            self.__allocate_buffers(len(data))
+        if len(data) > len(self.__buffers[0]):
+            raise ValueError(f'Frame data length {len(data)} exceeds buffer size {len(self.__buffers[0])}')
+
+        try:
+            buffer_index = self.__free.get_nowait()
+        except queue.Empty:
+            self.backpressure_events += 1
+            if not self.__block_when_full:
+                self.dropped_frames += 1
+                return False
+            started = time.perf_counter()
+            buffer_index = self.__free.get()
+            instrumentation = RavfInstrumentation.active
+            if instrumentation is not None:
+                instrumentation.record('async.buffer_wait', time.perf_counter() - started)
+
+        instrumentation = RavfInstrumentation.active
+        if instrumentation is not None:
+            started = time.perf_counter()
+        self.__buffers[buffer_index][:len(data)] = data
+        if instrumentation is not None:
+            instrumentation.record('async.copy', time.perf_counter() - started, len(data))
+
+        self.__pending.put((file_handle, buffer_index, len(data), (frame_type, start_timestamp, exposure_duration, satellites, almanac_status, almanac_offset, satellite_fix_status, sequence)))
+        self.frames_queued += 1
+        queue_depth = self.__pending.qsize()
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+        if instrumentation is not None:
+            instrumentation.gauge('async.queue_depth', queue_depth)
+
+        return True
+
+    def checkpoint(self, file_handle):
+        """Queues a checkpoint (see RavfWriter.checkpoint) for the writer thread, so the header isn't written while a frame is"""
+        if threading.current_thread() is self.__thread:
+            super().checkpoint(file_handle)		# checkpoint_frames / checkpoint_seconds, from RavfWriter.write_frame
+            return
+        self.__raise_error()
+        self.__pending.put((file_handle, None, 0, None))
+
+    def queue_depth(self) -> int:
+        return self.__pending.qsize()
+
+    def stats(self) -> dict:
+        return {
+            'frames_queued': self.frames_queued,
+            'frames_written': self.frames_written,
+            'dropped_frames': self.dropped_frames,
+            'backpressure_events': self.backpressure_events,
+            'queue_depth': self.queue_depth(),
+            'max_queue_depth': self.max_queue_depth,
+            'buffer_count': self.__buffer_count,
+        }
+
+    def finish(self, file_handle):
+        """Waits for all queued frames to be written, then writes the index and final header"""
+        self.__pending.put(None)
+        self.__thread.join()
+        self.__raise_error()
+        super().finish(file_handle)
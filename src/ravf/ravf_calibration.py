@@ -0,0 +1,232 @@
+import numpy as np
+from dataclasses import replace
+from functools import partial
+from .metadata_entry import RavfColorType
+from .ravf_frame import RavfFrameType
+from .ravf_decode_plan import RavfDecodePlan, RavfDecodeStage
+
+class RavfMeanAccumulator:
+    """Running per pixel mean of a stream of frames, memory is one float64 frame"""
+    passes = 1
+
+    def __init__(self):
+        self.__sum = None
+        self.count = 0
+
+    def add(self, images: np.ndarray):
+        """Adds a stack of frames (N, height, width)"""
+        if self.__sum is None:
+            self.__sum = np.zeros(images.shape[1:], np.float64)
+        self.__sum += images.sum(axis = 0, dtype = np.float64)
+        self.count += len(images)
+
+    def next_pass(self):
+        pass
+
+    def result(self) -> np.ndarray:
+        assert self.count > 0, 'No frames added'
+        return (self.__sum / self.count).astype(np.float32)
+
+
+class RavfSigmaClipAccumulator:
+    """Per pixel sigma clipped mean of a stream of frames in 2 passes over the frames, the first finds the mean and
+    standard deviation, the second averages only values within sigma standard deviations of the mean. Memory is 3 float64 frames"""
+    passes = 2
+
+    def __init__(self, sigma: float = 3.0):
+        self.sigma = sigma
+        self.__pass = 0
+        (self.__sum, self.__sum_squares, self.__count) = (None, None, None)
+        (self.__mean, self.__limit) = (None, None)
+        self.count = 0
+
+    def add(self, images: np.ndarray):
+        """Adds a stack of frames (N, height, width), the same frames must be added in each pass"""
+        if self.__pass == 0:
+            if self.__sum is None:
+                self.__sum = np.zeros(images.shape[1:], np.float64)
+                self.__sum_squares = np.zeros(images.shape[1:], np.float64)
+            images = images.astype(np.float64)
+            self.__sum += images.sum(axis = 0)
+            self.__sum_squares += np.square(images).sum(axis = 0)
+            self.count += len(images)
+        else:
+            keep = np.abs(images - self.__mean) <= self.__limit
+            self.__sum += np.sum(images, axis = 0, where = keep, dtype = np.float64)
+            self.__count += np.count_nonzero(keep, axis = 0)
+
+    def next_pass(self):
+        if self.__pass == 0:
+            assert self.count > 0, 'No frames added'
+            self.__mean = self.__sum / self.count
+            variance = np.maximum(self.__sum_squares / self.count - np.square(self.__mean), 0)
+            self.__limit = self.sigma * np.sqrt(variance)
+            self.__sum[...] = 0
+            self.__sum_squares = None
+            self.__count = np.zeros(self.__sum.shape, np.int64)
+        self.__pass += 1
+
+    def result(self) -> np.ndarray:
+        assert self.__pass >= self.passes, 'Frames must be added in both passes'
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            clipped = self.__sum / self.__count
+        return np.where(self.__count > 0, clipped, self.__mean).astype(np.float32)
+
+
+class RavfMedianAccumulator:
+    """Approximate per pixel median of a stream of frames, a remedian (Rousseeuw & Bassett 1990), frames are buffered
+    base at a time and replaced by their median in the next level up. Memory is at most base frames per level,
+    i.e. base * log_base(frames) frames, the result is the weighted median of what remains in all levels"""
+    passes = 1
+
+    def __init__(self, base: int = 15):
+        assert base >= 3 and base % 2, 'base must be an odd number >= 3'
+        self.base = base
+        self.__levels = []	# Level n holds up to base medians of base ** n frames
+        self.count = 0
+
+    def add(self, images: np.ndarray):
+        """Adds a stack of frames (N, height, width)"""
+        for image in images:
+            self.__add(0, np.asarray(image, np.float32))
+        self.count += len(images)
+
+    def __add(self, level: int, image: np.ndarray):
+        if level == len(self.__levels):
+            self.__levels.append([])
+        self.__levels[level].append(image)
+        if len(self.__levels[level]) == self.base:
+            median = np.median(np.stack(self.__levels[level]), axis = 0).astype(np.float32)
+            self.__levels[level].clear()
+            self.__add(level + 1, median)
+
+    def next_pass(self):
+        pass
+
+    def result(self) -> np.ndarray:
+        assert self.count > 0, 'No frames added'
+        values = np.stack([image for level in self.__levels for image in level])
+        weights = np.array([float(self.base ** n) for (n, level) in enumerate(self.__levels) for image in level])
+
+        order = np.argsort(values, axis = 0)
+        cumulative = np.cumsum(weights[order], axis = 0)
+        median = np.argmax(cumulative >= cumulative[-1] / 2, axis = 0)
+        return np.take_along_axis(values, np.take_along_axis(order, median[None], axis = 0), axis = 0)[0]
+
+
+class RavfCalibration:
+    """Master bias, dark and flat frames and the correction applied with them, (image - dark) / normalized flat,
+    with the bias used in place of the dark if there isn't one. Masters are float32 (height, width) raw (not debayered)
+    images, scaled to 16 bit as decoded in 'raw' mode.
+
+    The correction runs as a stage of the decode pipeline straight after unpacking (see stage() and RavfReader.set_calibration),
+    a block of rows at a time, so there's no full frame float copy. The stage corrects the unpacked image in place when it's
+    a temporary of the decode, otherwise (a read-only view of the file or mmap, or a view of the caller's frame data for
+    little endian 16 bit formats) the result goes to a new array and the unpacked image isn't modified"""
+
+    ACCUMULATORS = {'mean': RavfMeanAccumulator, 'sigma_clip': RavfSigmaClipAccumulator, 'median': RavfMedianAccumulator}
+    BLOCK_ROWS = 64	# Rows corrected at a time, keeps the float32 scratch small enough to stay in cache
+
+    def __init__(self, bias: np.ndarray = None, dark: np.ndarray = None, flat: np.ndarray = None, pedestal: float = 0.0):
+        self.bias = bias
+        self.dark = dark
+        self.flat = flat
+        self.pedestal = pedestal	# Added after subtracting the dark/bias, so noise below it isn't clipped at 0
+        self.__gain = None
+
+    @classmethod
+    def build_master(cls, reader, file_handle, frame_type: RavfFrameType, method: str = 'sigma_clip', subtract: np.ndarray = None, batch_frames: int = 16, **kwargs) -> np.ndarray:
+        """Combines all the frames of frame_type in a file into a master with method 'mean', 'sigma_clip' or 'median'
+        streaming batch_frames frames at a time, subtract is an optional master subtracted from every frame first (e.g. bias from flats).
+        kwargs are passed to the accumulator, e.g. sigma = 2.5. Frames are read without the reader's calibration, if it has one.
+        Returns None if the file has no frames of frame_type"""
+        if method not in cls.ACCUMULATORS:
+            raise ValueError(f'Unrecognized method: {method}')
+        frames = reader.frames_of_type(file_handle, frame_type)
+        if len(frames) == 0:
+            return None
+
+        accumulator = cls.ACCUMULATORS[method](**kwargs)
+        for _ in range(accumulator.passes):
+            for start in range(0, len(frames), batch_frames):
+                images = reader.read_frames(file_handle, frames[start:start + batch_frames], mode = 'raw', calibrated = False)
+                if images.ndim != 3:
+                    raise ValueError('Calibration is only supported for single channel images')
+                images = images.astype(np.float32)
+                if subtract is not None:
+                    images -= subtract
+                accumulator.add(images)
+            accumulator.next_pass()
+        return accumulator.result()
+
+    @classmethod
+    def from_file(cls, reader, file_handle, method: str = 'sigma_clip', pedestal: float = 0.0, **kwargs) -> object:
+        """Builds masters from the BIAS, DARK and FLAT frames of a file, flats have the bias subtracted if there are bias frames"""
+        bias = cls.build_master(reader, file_handle, RavfFrameType.BIAS, method, **kwargs)
+        dark = cls.build_master(reader, file_handle, RavfFrameType.DARK, method, **kwargs)
+        flat = cls.build_master(reader, file_handle, RavfFrameType.FLAT, method, subtract = bias, **kwargs)
+        return cls(bias, dark, flat, pedestal)
+
+    def save(self, file_name: str):
+        masters = {name: master for (name, master) in (('bias', self.bias), ('dark', self.dark), ('flat', self.flat)) if master is not None}
+        np.savez(file_name, pedestal = self.pedestal, **masters)
+
+    @classmethod
+    def load(cls, file_name: str) -> object:
+        with np.load(file_name) as masters:
+            return cls(masters.get('bias'), masters.get('dark'), masters.get('flat'), float(masters['pedestal']))
+
+    def __offset(self) -> np.ndarray:
+        return self.dark if self.dark is not None else self.bias
+
+    def gain(self) -> np.ndarray:
+        """Returns the flat correction, mean(flat) / flat, 1 where the flat is <= 0, or None if there's no flat"""
+        if self.flat is not None and self.__gain is None:
+            mean = self.flat[self.flat > 0].mean() if np.any(self.flat > 0) else 1.0
+            with np.errstate(divide = 'ignore'):
+                self.__gain = np.where(self.flat > 0, mean / self.flat, 1.0).astype(np.float32)
+        return self.__gain
+
+    def correct(self, image: np.ndarray, out: np.ndarray = None, rows: slice = slice(None), columns: slice = slice(None)) -> np.ndarray:
+        """Calibrates a uint16 image (..., height, width) into out (a new array if None, out can be image to correct in place),
+        rows and columns select the part of the masters the image covers for a region of interest"""
+        if out is None:
+            out = np.empty(image.shape, np.uint16)
+        offset = self.__offset()
+        offset = None if offset is None else offset[rows, columns]
+        gain = self.gain()
+        gain = None if gain is None else gain[rows, columns]
+
+        height = image.shape[-2]
+        for start in range(0, height, self.BLOCK_ROWS):
+            block_rows = slice(start, min(start + self.BLOCK_ROWS, height))
+            block = image[..., block_rows, :].astype(np.float32)
+            if offset is not None:
+                block -= offset[block_rows]
+            if gain is not None:
+                block *= gain[block_rows]
+            if self.pedestal:
+                block += self.pedestal
+            np.clip(np.rint(block, out = block), 0, 65535, out = block)
+            np.copyto(out[..., block_rows, :], block, casting = 'unsafe')
+        return out
+
+    def __correct_stage(self, image: np.ndarray, out: np.ndarray = None, rows: slice = slice(None), columns: slice = slice(None)) -> np.ndarray:
+        if out is None and image.dtype == np.uint16 and image.flags.writeable and image.flags.owndata:
+            out = image		# Allocated by the unpack stage, nothing else refers to it
+        return self.correct(image, out, rows, columns)
+
+    def stage(self, rows: slice = slice(None), columns: slice = slice(None)) -> RavfDecodeStage:
+        return RavfDecodeStage('calibrate', partial(self.__correct_stage, rows = rows, columns = columns))
+
+    def apply_to_plan(self, plan: RavfDecodePlan, rows: slice = slice(None), columns: slice = slice(None)) -> RavfDecodePlan:
+        """Returns a copy of plan with the calibration stage inserted after the unpack stage"""
+        if plan.color_type in (RavfColorType.RGB, RavfColorType.BGR):
+            raise ValueError('Calibration is only supported for single channel images')
+        stages = list(plan.stages)
+        position = next((i + 1 for (i, stage) in enumerate(stages) if stage.name == 'unpack'), 0)
+        stages.insert(position, self.stage(rows, columns))
+        return replace(plan, stages = tuple(stages))
+
+    def __repr__(self):
+        return f'RavfCalibration(bias = {self.bias is not None}, dark = {self.dark is not None}, flat = {self.flat is not None}, pedestal = {self.pedestal})'
@@ -0,0 +1,71 @@
+import lzma
+import zlib
+import numpy as np
+from enum import Enum
+from .metadata_entry import RavfMetadataType
+
+class RavfCompressionType(Enum):
+    NONE = 0
+    ZLIB = 1
+    LZMA = 2
+
+class RavfCompression:
+    """Per frame lossless compression of image data for archiving. Each frame's image data is compressed on its own, the
+    frame header's image data length is the compressed length, so the index still gives random access to every frame.
+
+    Compressed files are marked by the IMAGE-COMPRESSION user metadata entry (a RavfCompressionType value), with
+    IMAGE-SHUFFLE the size in bytes of the elements that were byte-plane shuffled before compression (0 for none).
+    Shuffling groups the same byte of every element together, e.g. all the high bytes of 16-bit pixels, or for packed
+    formats, all the bytes at each position of a packing group, which usually compresses much better"""
+
+    def __init__(self, compression_type: RavfCompressionType, shuffle: int = 0, level: int = None):
+        self.compression_type = compression_type
+        self.shuffle = shuffle
+        self.level = level
+
+    @classmethod
+    def for_header(cls, header) -> object:
+        """Returns the compression of a file, or None if it isn't compressed"""
+        compression_type = header.metadata_value('IMAGE-COMPRESSION')
+        if compression_type is None or compression_type == RavfCompressionType.NONE.value:
+            return None
+        return cls(RavfCompressionType(compression_type), header.metadata_value('IMAGE-SHUFFLE') or 0)
+
+    def metadata_entries(self) -> list:
+        """Returns the user metadata entries marking a file as compressed with this compression"""
+        return [('IMAGE-COMPRESSION', RavfMetadataType.UINT8, int(self.compression_type.value)),
+                ('IMAGE-SHUFFLE',     RavfMetadataType.UINT8, int(self.shuffle))]
+
+    @classmethod
+    def shuffle_bytes(cls, data, element_size: int) -> bytes:
+        """Byte-plane shuffles data of elements of element_size bytes, trailing bytes that don't make a whole element are left at the end"""
+        data = np.frombuffer(data, np.uint8)
+        whole = len(data) // element_size * element_size
+        return data[:whole].reshape(-1, element_size).T.tobytes() + data[whole:].tobytes()
+
+    @classmethod
+    def unshuffle_bytes(cls, data, element_size: int) -> bytes:
+        data = np.frombuffer(data, np.uint8)
+        whole = len(data) // element_size * element_size
+        return data[:whole].reshape(element_size, -1).T.tobytes() + data[whole:].tobytes()
+
+    def compress(self, data) -> bytes:
+        if self.shuffle > 1:
+            data = self.shuffle_bytes(data, self.shuffle)
+        if self.compression_type == RavfCompressionType.ZLIB:
+            return zlib.compress(data, 6 if self.level is None else self.level)
+        if self.compression_type == RavfCompressionType.LZMA:
+            return lzma.compress(data, preset = 6 if self.level is None else self.level)
+        return bytes(data)
+
+    def decompress(self, data) -> bytes:
+        if self.compression_type == RavfCompressionType.ZLIB:
+            data = zlib.decompress(data)
+        elif self.compression_type == RavfCompressionType.LZMA:
+            data = lzma.decompress(data)
+        if self.shuffle > 1:
+            data = self.unshuffle_bytes(data, self.shuffle)
+        return data
+
+    def __repr__(self):
+        return f'RavfCompression(compression_type = {self.compression_type}, shuffle = {self.shuffle}, level = {self.level})'
@@ -0,0 +1,271 @@
+import time
+import cv2
+import numpy as np
+from dataclasses import dataclass
+from functools import partial
+from .metadata_entry import RavfColorType, RavfImageEndianess, RavfImageFormat
+from .ravf_image_utils import RavfImageUtils
+from .ravf_instrumentation import RavfInstrumentation
+
+@dataclass(frozen = True)
+class RavfDecodeStage:
+    """One step of a decode pipeline, fn(image, out = None) -> image, out is passed by keyword.
+    frame_ndim is the number of dimensions of a single frame the stage works on if it can't operate on a stack
+    of frames (e.g. opencv functions), or None if it's vectorized over any leading dimensions"""
+    name: str
+    fn: object
+    frame_ndim: int = None
+
+
+@dataclass(frozen = True)
+class RavfDecodePlan:
+    """Everything needed to decode a frame's image data, worked out once when a file is opened so that decoding
+    a frame involves no metadata lookups or format dispatch. Plans are created by RavfDecodeRegistry.
+
+    Stages take uint8 image data of shape (..., height, stride) through to uint16 images of output_shape"""
+    width: int
+    height: int
+    stride: int
+    format: RavfImageFormat
+    color_type: RavfColorType
+    endianess: RavfImageEndianess
+    mode: str
+    stages: tuple
+    output_shape: tuple
+
+    def decode(self, image: np.array, out: np.array = None) -> np.array:
+        """Decodes uint8 image data of shape (height, stride), or a stack of frames (N, height, stride), into uint16 images
+        Stages are applied to the whole stack at once where possible, if out is supplied the result is written to it"""
+        instrumentation = RavfInstrumentation.active
+        last = len(self.stages) - 1
+        for (i, stage) in enumerate(self.stages):
+            stage_out = out if i == last else None
+            if instrumentation is not None:
+                start = time.perf_counter()
+
+            if stage.frame_ndim is not None and image.ndim > stage.frame_ndim:
+                image = self.__apply_per_frame(stage, image, stage_out)
+            else:
+                image = stage.fn(image, out = stage_out)
+
+            if instrumentation is not None:
+                instrumentation.record('decode.' + stage.name, time.perf_counter() - start, image.nbytes)
+
+        if out is not None and image is not out:
+            np.copyto(out, image)
+            image = out
+
+        return image
+
+    def packing(self) -> (int, int):
+        """Returns (pixels, bytes) of the smallest whole group of pixels in a row, e.g. (4, 5) for packed 10-bit"""
+        channels = 3 if self.color_type in (RavfColorType.RGB, RavfColorType.BGR) else 1
+        if self.format == RavfImageFormat.FORMAT_PACKED_10BIT:
+            return (4, 5)
+        if self.format == RavfImageFormat.FORMAT_PACKED_12BIT:
+            return (2, 3)
+        if self.format == RavfImageFormat.FORMAT_8BIT:
+            return (1, channels)
+        return (1, 2 * channels)
+
+    def is_cfa(self) -> bool:
+        return self.color_type not in (RavfColorType.MONO, RavfColorType.RGB, RavfColorType.BGR)
+
+    PREVIEW_SCALES = (2, 4, 8)
+
+    def preview_rows(self, scale: int) -> np.ndarray:
+        """Returns the image rows read by preview_decode, the 2 rows of every scale'th row of 2x2 quads, or None if all rows are needed"""
+        if self.color_type in (RavfColorType.RGB, RavfColorType.BGR):
+            return None
+        quad_rows = np.arange(self.height // scale) * scale
+        return np.stack((quad_rows, quad_rows + 1), axis = -1).ravel()
+
+    def preview_decode(self, image: np.array, scale: int) -> np.array:
+        """Decodes a reduced resolution (height // scale, width // scale) uint16 mono preview from the rows returned
+        by preview_rows (or the full image for RGB/BGR). Each output pixel is the mean of a 2x2 quad (a bayer/CMY superpixel),
+        so there is no debayering, and only the quads that are needed are unpacked. Packed formats use just the most significant byte of each pixel"""
+        assert scale in self.PREVIEW_SCALES, f'scale must be one of {self.PREVIEW_SCALES}'
+        (out_height, out_width) = (self.height // scale, self.width // scale)
+
+        if self.color_type in (RavfColorType.RGB, RavfColorType.BGR):
+            gray = RavfDecodeRegistry.plan(self.width, self.height, self.stride, self.format, self.color_type, self.endianess, 'gray').decode(image)
+            return cv2.resize(gray, (out_width, out_height), interpolation = cv2.INTER_AREA)
+
+        (samples, shift) = self.__preview_samples(image, scale, out_width)
+
+        # Sum each 2x2 quad, mean = (sum << shift) / 4. Explicit adds are much faster than np.sum over the strided axes
+        samples = samples.reshape(out_height, 2, out_width, 2)
+        quads = samples[:, 0, :, 0].astype(np.uint32)
+        quads += samples[:, 0, :, 1]
+        quads += samples[:, 1, :, 0]
+        quads += samples[:, 1, :, 1]
+        return ((quads << shift) >> 2).astype(np.uint16)
+
+    def __preview_samples(self, image: np.array, scale: int, out_width: int) -> (np.array, int):
+        """Returns (samples, shift to 16 bit) of the 2 pixels at the left of every scale'th column as a (rows, out_width, 2) strided view
+        of the image data, avoiding a gather. Packed formats return the most significant byte of each pixel"""
+        rows = image.shape[0]
+        if self.format == RavfImageFormat.FORMAT_PACKED_10BIT:
+            groups = image[:, :(self.width // 4) * 5].reshape(rows, -1, 5)		# AAAAAAAA BBBBBBBB CCCCCCCC DDDDDDDD AABBCCDD
+            if scale == 2:
+                return (groups[:, :, :4].reshape(rows, -1, 2)[:, :out_width], 8)
+            return (groups[:, ::scale // 4, :2][:, :out_width], 8)
+        if self.format == RavfImageFormat.FORMAT_PACKED_12BIT:
+            groups = image[:, :(self.width // 2) * 3].reshape(rows, -1, 3)		# aaaabbbb AAAAAAAA BBBBBBBB
+            return (groups[:, ::scale // 2, 1:][:, :out_width], 8)
+
+        if self.format == RavfImageFormat.FORMAT_8BIT:
+            (pixels, shift) = (image, 8)
+        else:
+            pixels = image.view('>u2' if self.endianess == RavfImageEndianess.BIG_ENDIAN else '<u2')
+            shift = {RavfImageFormat.FORMAT_16BIT: 0, RavfImageFormat.FORMAT_UNPACKED_12BIT: 4, RavfImageFormat.FORMAT_UNPACKED_10BIT: 6}[self.format]
+        return (pixels[:, :out_width * scale].reshape(rows, out_width, scale)[:, :, :2], shift)
+
+    @classmethod
+    def __apply_per_frame(cls, stage: RavfDecodeStage, image: np.array, out: np.array) -> np.array:
+        leading = image.shape[:-stage.frame_ndim]
+        frames = image.reshape((-1,) + image.shape[-stage.frame_ndim:])
+        results = None if out is None else out.reshape((frames.shape[0],) + out.shape[len(leading):])
+        for i in range(frames.shape[0]):
+            if results is None:
+                result = stage.fn(frames[i])
+                results = np.empty((frames.shape[0],) + result.shape, result.dtype)
+            else:
+                result = stage.fn(frames[i], out = results[i])
+            if not np.may_share_memory(result, results[i]):
+                np.copyto(results[i], result)
+        return results.reshape(leading + results.shape[1:])
+
+
+class RavfDecodeRegistry:
+    """Decode pipelines keyed on (RavfImageFormat, RavfColorType, RavfImageEndianess, output mode).
+
+    Output modes:
+        'gray'  Mono uint16 (height, width), CFA images are debayered to luminance (what PyMovie displays)
+        'bgr'   Color uint16 (height, width, 3)
+        'raw'   uint16 (height, width) scaled to 16 bit but not debayered (height, width, 3) for RGB/BGR
+
+    A pipeline is built by a builder(width, height, stride) that returns a list of RavfDecodeStage, all supported
+    combinations are registered by default, register() can be used to replace one, e.g. with a faster implementation for a camera"""
+
+    OUTPUT_MODES = ('gray', 'bgr', 'raw')
+
+    # opencv names bayer patterns from the 2nd row, the naming convention used in RavfImageUtils.debayer_*
+    BAYER_CODES = {
+        RavfColorType.BAYER_RGGB: (cv2.COLOR_BayerBG2GRAY, cv2.COLOR_BayerBG2BGR),
+        RavfColorType.BAYER_GRBG: (cv2.COLOR_BayerGB2GRAY, cv2.COLOR_BayerGB2BGR),
+        RavfColorType.BAYER_GBRG: (cv2.COLOR_BayerGR2GRAY, cv2.COLOR_BayerGR2BGR),
+        RavfColorType.BAYER_BGGR: (cv2.COLOR_BayerRG2GRAY, cv2.COLOR_BayerRG2BGR),
+    }
+
+    CMY_LAYOUTS = {
+        RavfColorType.BAYER_CYYM: 'CYYM',
+        RavfColorType.BAYER_YCMY: 'YCMY',
+        RavfColorType.BAYER_YMCY: 'YMCY',
+        RavfColorType.BAYER_MYYC: 'MYYC',
+    }
+
+    __builders = {}
+
+    @classmethod
+    def register(cls, format: RavfImageFormat, color_type: RavfColorType, endianess: RavfImageEndianess, mode: str, builder):
+        if mode not in cls.OUTPUT_MODES:
+            raise ValueError(f'Unrecognized output mode: {mode}')
+        cls.__builders[(format, color_type, endianess, mode)] = builder
+
+    @classmethod
+    def is_supported(cls, format: RavfImageFormat, color_type: RavfColorType, endianess: RavfImageEndianess, mode: str) -> bool:
+        return (format, color_type, endianess, mode) in cls.__builders
+
+    @classmethod
+    def plan(cls, width: int, height: int, stride: int, format: RavfImageFormat, color_type: RavfColorType, endianess: RavfImageEndianess, mode: str = 'gray') -> RavfDecodePlan:
+        builder = cls.__builders.get((format, color_type, endianess, mode))
+        if builder is None:
+            raise ValueError(f'Unsupported image type: {format.name} {color_type.name} {endianess.name} {mode}')
+
+        color = mode == 'bgr' or (mode == 'raw' and color_type in (RavfColorType.RGB, RavfColorType.BGR))
+        output_shape = (height, width, 3) if color else (height, width)
+        return RavfDecodePlan(width = width, height = height, stride = stride, format = format, color_type = color_type, endianess = endianess, mode = mode, stages = tuple(builder(width, height, stride)), output_shape = output_shape)
+
+    @classmethod
+    def plan_for_header(cls, header, mode: str = 'gray') -> RavfDecodePlan:
+        return cls.plan(header.metadata_value('IMAGE-WIDTH'),
+                        header.metadata_value('IMAGE-HEIGHT'),
+                        header.metadata_value('IMAGE-ROW-STRIDE'),
+                        RavfImageFormat(header.metadata_value('IMAGE-FORMAT')),
+                        RavfColorType(header.metadata_value('COLOR-TYPE')),
+                        RavfImageEndianess(header.metadata_value('IMAGE-ENDIANESS')),
+                        mode)
+
+    @classmethod
+    def unpack_stage(cls, format: RavfImageFormat, endianess: RavfImageEndianess, width: int, height: int, channels: int) -> RavfDecodeStage:
+        """Stage converting uint8 image data to uint16 scaled to 16 bit, (..., height, width) or (..., height, width, 3)"""
+        samples = width * channels
+        big_endian = endianess == RavfImageEndianess.BIG_ENDIAN
+        if format == RavfImageFormat.FORMAT_8BIT:
+            fn = partial(RavfImageUtils.unpack_8bit_to_16bit, width = samples)
+        elif format == RavfImageFormat.FORMAT_16BIT:
+            fn = partial(RavfImageUtils.unpack_16bit_to_16bit, width = samples, shift = 0, big_endian = big_endian)
+        elif format == RavfImageFormat.FORMAT_UNPACKED_12BIT:
+            fn = partial(RavfImageUtils.unpack_16bit_to_16bit, width = samples, shift = 4, big_endian = big_endian)
+        elif format == RavfImageFormat.FORMAT_UNPACKED_10BIT:
+            fn = partial(RavfImageUtils.unpack_16bit_to_16bit, width = samples, shift = 6, big_endian = big_endian)
+        elif format == RavfImageFormat.FORMAT_PACKED_12BIT:
+            fn = partial(RavfImageUtils.unpack_12bit_pihq_to_16bit, width = samples, height = height)
+        elif format == RavfImageFormat.FORMAT_PACKED_10BIT:
+            fn = partial(RavfImageUtils.unpack_10bit_pigsc_to_16bit, width = samples, height = height)
+        else:
+            raise ValueError(f'Unrecognized image format: {format}')
+
+        if channels == 3:
+            fn = partial(cls.__unpack_interleaved, fn, width)
+        return RavfDecodeStage('unpack', fn)
+
+    @classmethod
+    def __unpack_interleaved(cls, unpack, width: int, image: np.array, out: np.array = None) -> np.array:
+        """Unpacks interleaved RGB/BGR samples and splits them into a trailing channel axis"""
+        flat_out = None if out is None else out.reshape(out.shape[:-2] + (width * 3,))
+        image = unpack(image, out = flat_out)
+        return image.reshape(image.shape[:-1] + (width, 3))
+
+    @classmethod
+    def color_stages(cls, color_type: RavfColorType, mode: str) -> list:
+        """Stages converting the unpacked uint16 image to the output mode"""
+        if mode == 'raw':
+            return []
+
+        if color_type == RavfColorType.MONO:
+            return [] if mode == 'gray' else [RavfDecodeStage('to_bgr', partial(RavfImageUtils.debayer, code = cv2.COLOR_GRAY2BGR), 2)]
+        if color_type in cls.BAYER_CODES:
+            code = cls.BAYER_CODES[color_type][0 if mode == 'gray' else 1]
+            return [RavfDecodeStage('debayer', partial(RavfImageUtils.debayer, code = code), 2)]
+        if color_type in cls.CMY_LAYOUTS:
+            if mode == 'gray':
+                return [RavfDecodeStage('debayer', RavfImageUtils.debayer_CMY_to_GRAY, 2)]
+            return [RavfDecodeStage('debayer', partial(RavfImageUtils.debayer_CMY_to_BGR, layout = cls.CMY_LAYOUTS[color_type]), 2)]
+        if color_type == RavfColorType.RGB:
+            return [RavfDecodeStage('to_' + mode, partial(RavfImageUtils.debayer, code = cv2.COLOR_RGB2GRAY if mode == 'gray' else cv2.COLOR_RGB2BGR), 3)]
+        if color_type == RavfColorType.BGR:
+            return [RavfDecodeStage('to_gray', partial(RavfImageUtils.debayer, code = cv2.COLOR_BGR2GRAY), 3)] if mode == 'gray' else []
+        raise ValueError(f'Unrecognized color type: {color_type}')
+
+    @classmethod
+    def default_builder(cls, format: RavfImageFormat, color_type: RavfColorType, endianess: RavfImageEndianess, mode: str):
+        def builder(width: int, height: int, stride: int) -> list:
+            channels = 3 if color_type in (RavfColorType.RGB, RavfColorType.BGR) else 1
+            return [cls.unpack_stage(format, endianess, width, height, channels)] + cls.color_stages(color_type, mode)
+        return builder
+
+    @classmethod
+    def register_defaults(cls):
+        packed = (RavfImageFormat.FORMAT_PACKED_10BIT, RavfImageFormat.FORMAT_PACKED_12BIT)
+        for format in RavfImageFormat:
+            for color_type in RavfColorType:
+                if format in packed and color_type in (RavfColorType.RGB, RavfColorType.BGR):
+                    continue	# Packed formats are only used for single channel sensor data
+                for endianess in RavfImageEndianess:
+                    for mode in cls.OUTPUT_MODES:
+                        cls.register(format, color_type, endianess, mode, cls.default_builder(format, color_type, endianess, mode))
+
+
+RavfDecodeRegistry.register_defaults()
@@ -0,0 +1,134 @@
+import os
+import time
+import errno
+import numpy as np
+from .ravf_header import RavfHeader
+from .ravf_index import RavfIndex
+from .ravf_reader import RavfReader
+from .ravf_segmented import RavfSegmentedReader
+from .ravf_transcoder import RavfTranscoder
+
+class RavfEditor:
+    """Trims, extracts and splices recordings without decoding them. The selected frames (frame header and image data) are
+    copied byte for byte from the source files using the index offsets, by the kernel with os.copy_file_range (or
+    os.sendfile) where available, so pixel data never passes through Python. The destination gets the header of the
+    (first) source with FRAMES-COUNT and OFFSET-INDEX updated, and a new index.
+
+    Consecutive frames are copied in a single call, so extracting a range of frames is one copy per source"""
+
+    COPY_CHUNK = 64 * 1024 * 1024	# Largest single copy, and the buffer size when falling back to pread/pwrite
+    FALLBACK_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF)
+
+    @classmethod
+    def extract(cls, source_name: str, destination_name: str, frames) -> dict:
+        """Copies frames (a slice or a sequence of frame indices, in the order given) of source_name to destination_name"""
+        return cls.splice([(source_name, frames)], destination_name)
+
+    @classmethod
+    def trim(cls, source_name: str, destination_name: str, start_timestamp, end_timestamp) -> dict:
+        """Copies the frames starting between start_timestamp and end_timestamp inclusive (ns since the RAVF epoch or datetimes)"""
+        with open(source_name, 'rb') as file_handle:
+            frames = RavfReader(file_handle, recover = True).frames_in_range(start_timestamp, end_timestamp)
+        return cls.extract(source_name, destination_name, frames)
+
+    @classmethod
+    def splice(cls, sources: list, destination_name: str) -> dict:
+        """Joins recordings into destination_name, sources is a list of file names (all frames) or (file name, frames) tuples.
+        All sources must have the same image format and compression. Returns {'frames', 'bytes', 'seconds', 'method'}"""
+        started = time.perf_counter()
+        sources = [(source, None) if isinstance(source, str) else source for source in sources]
+        if len(sources) == 0:
+            raise ValueError('No sources')
+
+        header = None
+        (offsets, timestamps) = ([], [])
+        method = None
+        with open(destination_name, 'wb+') as destination:
+            position = 0
+            for (source_name, frames) in sources:
+                with open(source_name, 'rb') as file_handle:
+                    reader = RavfReader(file_handle, recover = True)
+                    if header is None:
+                        file_handle.seek(0, 0)
+                        (header, first) = (RavfHeader.deserialize(file_handle), reader)
+                        header.write(destination)	# FRAMES-COUNT and OFFSET-INDEX are 0 until the frames are copied
+                        destination.flush()
+                        position = destination.tell()
+                    else:
+                        cls.__check_compatible(first, reader, source_name)
+
+                    frames = cls.__frame_indices(reader, frames)
+                    headers = reader.frame_headers(file_handle)[frames]
+                    starts = reader.index.offsets()[frames].astype(np.int64)
+                    lengths = headers['frame_header_length'].astype(np.int64) + headers['image_data_length']
+
+                    # New offsets are where each frame lands in the destination, runs of adjacent frames are copied in one go
+                    destination_offsets = position + np.cumsum(lengths) - lengths
+                    breaks = np.flatnonzero(starts[1:] != starts[:-1] + lengths[:-1]) + 1
+                    for (run_start, run_stop) in zip(np.concatenate(([0], breaks)), np.concatenate((breaks, [len(frames)]))):
+                        if run_stop > run_start:
+                            length = int(starts[run_stop - 1] + lengths[run_stop - 1] - starts[run_start])
+                            method = cls.__copy(file_handle.fileno(), destination.fileno(), int(starts[run_start]), int(destination_offsets[run_start]), length, method)
+
+                    offsets.append(destination_offsets)
+                    timestamps.append(reader.index.timestamps()[frames])
+                    position += int(lengths.sum())
+
+            index = np.empty(sum(len(o) for o in offsets), RavfIndex.INDEX_DTYPE)
+            (index['offset'], index['timestamp']) = (np.concatenate(offsets), np.concatenate(timestamps))
+
+            header.set_frame_count(len(index))
+            header.update_offset_index(position)
+            header.write(destination)	# Leaves the file position at the end of the copied frames
+            RavfIndex.from_frames(index).write(destination)
+
+        seconds = time.perf_counter() - started
+        return {'frames': len(index), 'bytes': position - header.metadata_value('OFFSET-FRAMES'), 'seconds': seconds, 'method': method or 'none'}
+
+    @classmethod
+    def __frame_indices(cls, reader: RavfReader, frames) -> np.ndarray:
+        count = reader.frame_count()
+        if frames is None:
+            frames = slice(None)
+        if isinstance(frames, slice):
+            return np.arange(*frames.indices(count))
+        frames = np.asarray(frames, np.int64).reshape(-1)
+        frames = np.where(frames < 0, frames + count, frames)
+        if len(frames) and (frames.min() < 0 or frames.max() >= count):
+            raise IndexError('index out of range')
+        return frames
+
+    @classmethod
+    def __check_compatible(cls, first: RavfReader, reader: RavfReader, source_name: str):
+        for name in RavfSegmentedReader.GEOMETRY_ENTRIES + RavfTranscoder.COMPRESSION_ENTRIES:
+            if reader.metadata_value(name) != first.metadata_value(name):
+                raise ValueError(f'{source_name}: {name} differs from the first source')
+
+    @classmethod
+    def __copy(cls, source_fd: int, destination_fd: int, source_offset: int, destination_offset: int, length: int, method: str) -> str:
+        """Copies length bytes between file descriptors at the given offsets, returns the method used, which is tried first
+        next time: 'copy_file_range', 'sendfile' or 'pwrite' if the kernel copies aren't supported for these files"""
+        while length > 0:
+            count = min(length, cls.COPY_CHUNK)
+            try:
+                if method in (None, 'copy_file_range') and hasattr(os, 'copy_file_range'):
+                    copied = os.copy_file_range(source_fd, destination_fd, count, source_offset, destination_offset)
+                    method = 'copy_file_range'
+                elif method in (None, 'copy_file_range', 'sendfile') and hasattr(os, 'sendfile'):
+                    os.lseek(destination_fd, destination_offset, os.SEEK_SET)
+                    copied = os.sendfile(destination_fd, source_fd, source_offset, count)
+                    method = 'sendfile'
+                else:
+                    data = os.pread(source_fd, count, source_offset)
+                    copied = os.pwrite(destination_fd, data, destination_offset)
+                    method = 'pwrite'
+            except OSError as e:
+                if e.errno not in cls.FALLBACK_ERRORS or method == 'pwrite':
+                    raise
+                method = 'sendfile' if method in (None, 'copy_file_range') else 'pwrite'
+                continue
+
+            if copied == 0:
+                raise EOFError(f'Source ended {length} bytes early')
+            (source_offset, destination_offset, length) = (source_offset + copied, destination_offset + copied, length - copied)
+        return method
@@ -0,0 +1,161 @@
+import time
+import numpy as np
+from datetime import timedelta
+from functools import partial
+from .ravf_frame import RavfFrame
+from .ravf_reader import RavfReader
+
+class RavfExporter:
+    """Bulk export of a recording's decoded frames to a NumPy .npy stack or a FITS cube, with a table of the frame headers
+    (timestamps, exposure, GPS status, sequence) alongside.
+
+    The output is created at its final size and memory mapped, frames are decoded in chunks of chunk_frames straight into it,
+    so memory use doesn't depend on the length of the recording. With processes > 1 the chunks are shared between worker
+    processes (see RavfReader.imap_frames), each mapping its chunks of the output itself. FITS is written directly (no astropy needed): a uint16 cube
+    (BITPIX 16, BZERO 32768) in the primary HDU and the frame table in a BINTABLE extension"""
+
+    FITS_BLOCK = 2880
+
+    # Frame table columns from the frame headers, with the FITS binary table format of each
+    TABLE_COLUMNS = (('index', 'K'), ('frame_type', 'B'), ('start_timestamp', 'K'), ('exposure_duration', 'K'), ('satellites', 'B'),
+                     ('almanac_status', 'B'), ('almanac_offset', 'I'), ('satellite_fix_status', 'B'), ('sequence', 'K'))
+    FITS_TYPES = {'K': '>i8', 'J': '>i4', 'I': '>i2', 'B': 'u1'}
+
+    @classmethod
+    def frame_table(cls, reader: RavfReader, file_handle, start: int = 0, stop: int = None) -> np.ndarray:
+        """Returns the frame table of frames start to stop as a structured array"""
+        (start, stop, _) = slice(start, stop).indices(reader.frame_count())
+        headers = reader.frame_headers(file_handle)[start:stop]
+        table = np.empty(len(headers), [(name, cls.FITS_TYPES[form]) for (name, form) in cls.TABLE_COLUMNS])
+        for (name, form) in cls.TABLE_COLUMNS:
+            table[name] = np.arange(start, stop) if name == 'index' else headers[name]
+        return table
+
+    @classmethod
+    def table_name(cls, file_name: str) -> str:
+        return file_name + '.frames.npy'
+
+    @classmethod
+    def to_npy(cls, source_name: str, destination_name: str, mode: str = 'gray', start: int = 0, stop: int = None, processes: int = 1, chunk_frames: int = 64) -> dict:
+        """Exports frames start to stop to a .npy uint16 stack (frames,) + output shape of mode, readable with np.load(mmap_mode = 'r'),
+        the frame table is written to table_name(destination_name)"""
+        with open(source_name, 'rb') as file_handle:
+            reader = RavfReader(file_handle)
+            (start, stop, _) = slice(start, stop).indices(reader.frame_count())
+            shape = (stop - start,) + reader.decode_plan_for(mode).output_shape
+            np.save(cls.table_name(destination_name), cls.frame_table(reader, file_handle, start, stop))
+
+        stack = np.lib.format.open_memmap(destination_name, mode = 'w+', dtype = np.uint16, shape = shape)
+        (offset, dtype) = (stack.offset, '<u2')
+        del stack
+        return cls.__export(source_name, destination_name, offset, dtype, shape, mode, start, stop, processes, chunk_frames)
+
+    @classmethod
+    def to_fits(cls, source_name: str, destination_name: str, mode: str = 'gray', start: int = 0, stop: int = None, processes: int = 1, chunk_frames: int = 64) -> dict:
+        """Exports frames start to stop to a FITS cube (NAXIS1 = width, NAXIS2 = height, NAXIS3 = frames) with the frame table
+        as a BINTABLE extension, mode must be a single channel mode ('gray' or 'raw')"""
+        with open(source_name, 'rb') as file_handle:
+            reader = RavfReader(file_handle)
+            (start, stop, _) = slice(start, stop).indices(reader.frame_count())
+            plan = reader.decode_plan_for(mode)
+            if len(plan.output_shape) != 2:
+                raise ValueError(f'FITS export needs a single channel output mode, {mode} is color')
+            shape = (stop - start,) + plan.output_shape
+            table = cls.frame_table(reader, file_handle, start, stop)
+            primary = cls.__fits_primary_header(reader, shape, table)
+
+        data_length = int(np.prod(shape)) * 2
+        with open(destination_name, 'wb') as destination:
+            destination.write(primary)
+            destination.truncate(len(primary) + cls.__fits_padded(data_length))	# Sparse until written, padding is zeros
+            destination.seek(0, 2)
+            destination.write(cls.__fits_table_hdu(table))
+
+        return cls.__export(source_name, destination_name, len(primary), '>u2', shape, mode, start, stop, processes, chunk_frames)
+
+    @classmethod
+    def __export(cls, source_name: str, destination_name: str, offset: int, dtype: str, shape: tuple, mode: str, start: int, stop: int, processes: int, chunk_frames: int) -> dict:
+        started = time.perf_counter()
+        chunks = [(first, min(first + chunk_frames, stop)) for first in range(start, stop, chunk_frames)]
+        with open(source_name, 'rb') as file_handle:
+            reader = RavfReader(file_handle, use_mmap = True)
+            for _ in reader.imap_frames(file_handle, partial(_export_frames, destination_name, offset, dtype, shape, start, mode), chunks, processes):
+                pass
+            reader.close()
+
+        seconds = time.perf_counter() - started
+        return {'frames': stop - start, 'bytes': int(np.prod(shape)) * 2, 'seconds': seconds, 'frames_per_second': (stop - start) / seconds if seconds > 0 else 0.0}
+
+    @classmethod
+    def __fits_padded(cls, length: int) -> int:
+        return -(-length // cls.FITS_BLOCK) * cls.FITS_BLOCK
+
+    @classmethod
+    def __fits_card(cls, key: str, value, comment: str = '') -> str:
+        if isinstance(value, bool):
+            value = f'{"T" if value else "F":>20}'
+        elif isinstance(value, str):
+            value = "'" + value.replace("'", "''").ljust(8) + "'"	# Strings are at least 8 characters
+            value = f'{value:<20}'
+        elif isinstance(value, float):
+            value = f'{repr(value).upper():>20}'
+        else:
+            value = f'{value:>20}'
+        card = f'{key:<8}= {value}' + (f' / {comment}' if comment else '')
+        return f'{card[:80]:<80}'
+
+    @classmethod
+    def __fits_header(cls, cards: list) -> bytes:
+        header = ''.join(cards) + f'{"END":<80}'
+        return header.ljust(cls.__fits_padded(len(header))).encode('ascii', 'replace')
+
+    @classmethod
+    def __fits_primary_header(cls, reader: RavfReader, shape: tuple, table: np.ndarray) -> bytes:
+        cards = [cls.__fits_card('SIMPLE', True),
+                 cls.__fits_card('BITPIX', 16),
+                 cls.__fits_card('NAXIS', 3),
+                 cls.__fits_card('NAXIS1', shape[2], 'Width'),
+                 cls.__fits_card('NAXIS2', shape[1], 'Height'),
+                 cls.__fits_card('NAXIS3', shape[0], 'Frames'),
+                 cls.__fits_card('EXTEND', True),
+                 cls.__fits_card('BZERO', 32768, 'uint16 data'),
+                 cls.__fits_card('BSCALE', 1)]
+        if len(table):
+            first = RavfFrame.RAVF_EPOCH + timedelta(microseconds = int(table['start_timestamp'][0]) // 1000)
+            cards.append(cls.__fits_card('DATE-OBS', first.strftime('%Y-%m-%dT%H:%M:%S.%f'), 'Start of first frame (UTC)'))
+            cards.append(cls.__fits_card('EXPTIME', float(table['exposure_duration'][0]) / 1e9, 'Exposure of first frame (s)'))
+        for (key, name) in (('INSTRUME', 'INSTRUMENT'), ('TELESCOP', 'TELESCOPE'), ('OBSERVER', 'OBSERVER'), ('OBJECT', 'OBJNAME')):
+            value = reader.metadata_value(name)
+            value = getattr(value, 'txt', value)
+            if value:
+                cards.append(cls.__fits_card(key, value))
+        return cls.__fits_header(cards)
+
+    @classmethod
+    def __fits_table_hdu(cls, table: np.ndarray) -> bytes:
+        cards = [cls.__fits_card('XTENSION', 'BINTABLE'),
+                 cls.__fits_card('BITPIX', 8),
+                 cls.__fits_card('NAXIS', 2),
+                 cls.__fits_card('NAXIS1', table.dtype.itemsize, 'Bytes per row'),
+                 cls.__fits_card('NAXIS2', len(table), 'Frames'),
+                 cls.__fits_card('PCOUNT', 0),
+                 cls.__fits_card('GCOUNT', 1),
+                 cls.__fits_card('TFIELDS', len(cls.TABLE_COLUMNS)),
+                 cls.__fits_card('EXTNAME', 'FRAMES')]
+        for (i, (name, form)) in enumerate(cls.TABLE_COLUMNS, 1):
+            cards.append(cls.__fits_card(f'TTYPE{i}', name.upper()))
+            cards.append(cls.__fits_card(f'TFORM{i}', '1' + form))
+        data = table.tobytes()
+        return cls.__fits_header(cards) + data + bytes(cls.__fits_padded(len(data)) - len(data))
+
+
+def _export_frames(destination_name: str, offset: int, dtype: str, shape: tuple, start: int, mode: str, reader: RavfReader, file_handle, chunk: tuple):
+    """Decodes frames first to last into their part of the output, which is mapped just for the chunk"""
+    (first, last) = chunk
+    frame_bytes = int(np.prod(shape[1:])) * 2
+    destination = np.memmap(destination_name, dtype = dtype, mode = 'r+', offset = offset + (first - start) * frame_bytes, shape = (last - first,) + shape[1:])
+    if destination.dtype == np.dtype('<u2') and destination.dtype.isnative:
+        reader.read_frames(file_handle, range(first, last), out = destination, mode = mode)	# Decoded straight into the output
+    else:
+        np.bitwise_xor(reader.read_frames(file_handle, range(first, last), mode = mode), 0x8000, out = destination)	# FITS: big endian int16 + BZERO
+    destination.flush()
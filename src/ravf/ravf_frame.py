@@ -1,6 +1,10 @@
+import os
+import time
 import struct
+import numpy as np
 from enum import Enum
 from datetime import datetime, timedelta, timezone
+from .ravf_instrumentation import RavfInstrumentation
 
 class RavfFrameType(Enum):
     LIGHT = 0
@@ -11,6 +15,12 @@ class RavfFrameType(Enum):
 class RavfFrame:
     RAVF_MAGIC   = 0xAF8ABD3C2A98CA3F
     RAVF_HEADER_NO_PADDING_LENGTH = 41
+    RAVF_HEADER_LENGTH = RAVF_HEADER_NO_PADDING_LENGTH + 60
+    HEADER_STRUCT = struct.Struct('<QIIBQQBBbBI')	# Precompiled, the header is packed/unpacked for every frame
+    HEADER_DTYPE = np.dtype([('magic', '<u8'), ('frame_header_length', '<u4'), ('image_data_length', '<u4'), ('frame_type', 'u1'),
+                             ('start_timestamp', '<u8'), ('exposure_duration', '<u8'), ('satellites', 'u1'), ('almanac_status', 'u1'),
+                             ('almanac_offset', 'i1'), ('satellite_fix_status', 'u1'), ('sequence', '<u4')])	# HEADER_STRUCT as a NumPy dtype
+    RAVF_EPOCH   = datetime(2010, 1, 1, hour=0, minute=0, second=0, microsecond=0, tzinfo = timezone.utc) # 00:00:00 1st Jan 2010
 
     def __init__(self, frame_type: RavfFrameType, data: bytes, start_timestamp: int, exposure_duration: int, satellites: int, almanac_status: int, almanac_offset: int, satellite_fix_status: int, sequence: int):
         self.frame_type = frame_type
@@ -28,9 +38,15 @@ class RavfFrame:
     @classmethod
     def deserialize(cls, file_handle) -> object:
         offset = file_handle.tell()
+        instrumentation = RavfInstrumentation.active
+        if instrumentation is not None:
+            started = time.perf_counter()
 
-        (magic, frame_header_length, image_data_length, frame_type, start_timestamp, exposure_duration, satellites, almanac_status, almanac_offset, satellite_fix_status, sequence) = struct.unpack('<QIIBQQBBbBI', file_handle.read(cls.RAVF_HEADER_NO_PADDING_LENGTH))
+        (magic, frame_header_length, image_data_length, frame_type, start_timestamp, exposure_duration, satellites, almanac_status, almanac_offset, satellite_fix_status, sequence) = cls.HEADER_STRUCT.unpack(file_handle.read(cls.RAVF_HEADER_NO_PADDING_LENGTH))
         assert magic == cls.RAVF_MAGIC, 'Magic number mismatch'
+        if instrumentation is not None:
+            unpacked = time.perf_counter()
+            instrumentation.record('read.header', unpacked - started, cls.RAVF_HEADER_NO_PADDING_LENGTH)
 
         frame = cls(frame_type = frame_type, data = None, start_timestamp = start_timestamp, exposure_duration = exposure_duration, satellites = satellites, almanac_status = almanac_status, almanac_offset = almanac_offset, satellite_fix_status = satellite_fix_status, sequence = sequence)
 
@@ -38,36 +54,110 @@ class RavfFrame:
         file_handle.seek(offset + frame.__frame_header_length, 0)
 
         frame.data = file_handle.read(image_data_length)
+        if instrumentation is not None:
+            instrumentation.record('read.data', time.perf_counter() - unpacked, len(frame.data))
+
+        return frame
+
+    @classmethod
+    def deserialize_into(cls, file_handle, buffer) -> object:
+        """Deserializes a frame reading the image data directly into buffer (a writable buffer, e.g. a numpy array) instead of allocating"""
+        offset = file_handle.tell()
+        instrumentation = RavfInstrumentation.active
+        if instrumentation is not None:
+            started = time.perf_counter()
+
+        (magic, frame_header_length, image_data_length, frame_type, start_timestamp, exposure_duration, satellites, almanac_status, almanac_offset, satellite_fix_status, sequence) = cls.HEADER_STRUCT.unpack(file_handle.read(cls.RAVF_HEADER_NO_PADDING_LENGTH))
+        assert magic == cls.RAVF_MAGIC, 'Magic number mismatch'
+        if instrumentation is not None:
+            unpacked = time.perf_counter()
+            instrumentation.record('read.header', unpacked - started, cls.RAVF_HEADER_NO_PADDING_LENGTH)
+
+        frame = cls(frame_type = frame_type, data = None, start_timestamp = start_timestamp, exposure_duration = exposure_duration, satellites = satellites, almanac_status = almanac_status, almanac_offset = almanac_offset, satellite_fix_status = satellite_fix_status, sequence = sequence)
+
+        data = memoryview(buffer).cast('B')
+        assert len(data) == image_data_length, 'Buffer length != image data length'
+
+        # Skip to image data
+        file_handle.seek(offset + frame.__frame_header_length, 0)
+
+        length_read = file_handle.readinto(data)
+        assert length_read == image_data_length, 'Frame truncated'
+        if instrumentation is not None:
+            instrumentation.record('read.data', time.perf_counter() - unpacked, length_read)
+        frame.data = buffer
+
+        return frame
+
+    @classmethod
+    def deserialize_from_buffer(cls, buffer, offset: int) -> object:
+        """Deserializes a frame at offset in buffer (e.g. an mmap), data is a memoryview into buffer rather than a copy"""
+        (magic, frame_header_length, image_data_length, frame_type, start_timestamp, exposure_duration, satellites, almanac_status, almanac_offset, satellite_fix_status, sequence) = cls.HEADER_STRUCT.unpack_from(buffer, offset)
+        assert magic == cls.RAVF_MAGIC, 'Magic number mismatch'
+
+        frame = cls(frame_type = frame_type, data = None, start_timestamp = start_timestamp, exposure_duration = exposure_duration, satellites = satellites, almanac_status = almanac_status, almanac_offset = almanac_offset, satellite_fix_status = satellite_fix_status, sequence = sequence)
+
+        data_offset = offset + frame.__frame_header_length
+        frame.data = memoryview(buffer)[data_offset:data_offset + image_data_length]
 
         return frame
 
     def write(self, file_handle):
-        ser = struct.pack('<QIIBQQBBbBI',
-                          self.RAVF_MAGIC,
-                          self.__frame_header_length,
-                          len(self.data),
-                          self.frame_type.value,
-                          self.start_timestamp,
-                          self.exposure_duration,
-                          self.satellites,
-                          self.almanac_status,
-                          self.almanac_offset,
-                          self.satellite_fix_status,
-                          self.sequence,
-                         )
-                          
-        ser += bytearray(60)
-        file_handle.write(ser)
-        file_handle.write(self.data)
+        data = memoryview(self.data).cast('B')
+        header = bytearray(self.__frame_header_length)
+        self.pack_header_into(header, len(data), self.frame_type, self.start_timestamp, self.exposure_duration, self.satellites, self.almanac_status, self.almanac_offset, self.satellite_fix_status, self.sequence)
+        file_handle.write(header)
+        file_handle.write(data)
 
+    @classmethod
+    def pack_header_into(cls, header: bytearray, image_data_length: int, frame_type: RavfFrameType, start_timestamp: int, exposure_duration: int, satellites: int, almanac_status: int, almanac_offset: int, satellite_fix_status: int, sequence: int):
+        """Packs a frame header into header, a reusable RAVF_HEADER_LENGTH buffer whose padding is expected to already be zero"""
+        cls.HEADER_STRUCT.pack_into(header, 0,
+                                    cls.RAVF_MAGIC,
+                                    cls.RAVF_HEADER_LENGTH,
+                                    image_data_length,
+                                    frame_type.value,
+                                    start_timestamp,
+                                    exposure_duration,
+                                    satellites,
+                                    almanac_status,
+                                    almanac_offset,
+                                    satellite_fix_status,
+                                    sequence,
+                                   )
+
+    @classmethod
+    def writev(cls, fd: int, header: bytearray, data: memoryview):
+        """Writes header and image data to the file descriptor with a single writev system call where possible"""
+        length = len(header) + len(data)
+        written = os.writev(fd, (header, data))
+        while written < length:
+            # Short write, write whatever remains
+            if written < len(header):
+                written += os.writev(fd, (memoryview(header)[written:], data))
+            else:
+                written += os.write(fd, data[written - len(header):])
 
     # Returns the start timestamp as a tuple (date,time)
     def start_timestamp_as_str(self) -> (str, str):
-        epoch = datetime(2010, 1, 1, hour=0, minute=0, second=0, microsecond=0, tzinfo = timezone.utc) # 00:00:00 1st Jan 2010
         frame_seconds_since_epoch = timedelta(seconds = self.start_timestamp / 1000000000)
-        timestamp = epoch + frame_seconds_since_epoch
+        timestamp = self.RAVF_EPOCH + frame_seconds_since_epoch
 
         return (timestamp.strftime('%Y-%m-%d'), timestamp.strftime('%H:%M:%S.%f'))
 
+    @classmethod
+    def timestamp_from_datetime(cls, timestamp: datetime) -> int:
+        """Converts a datetime to nanoseconds since the RAVF epoch, naive datetimes are assumed to be UTC"""
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo = timezone.utc)
+        return ((timestamp - cls.RAVF_EPOCH) // timedelta(microseconds = 1)) * 1000
+
+    @classmethod
+    def as_timestamp(cls, timestamp) -> int:
+        """Accepts nanoseconds since the RAVF epoch (2010-01-01 UTC) or a datetime, returns nanoseconds since the RAVF epoch"""
+        if isinstance(timestamp, datetime):
+            return cls.timestamp_from_datetime(timestamp)
+        return int(timestamp)
+
     def __repr__(self):
         return f'RavfFrame(frame_type = {self.frame_type}, data_size: {len(self.data)}, start_timestamp = {self.start_timestamp}, exposure_duration = {self.exposure_duration}, satellites = {self.satellites}, almanac_status = {self.almanac_status}, almanac_offset = {self.almanac_offset}, satellite_fix_status = {self.satellite_fix_status}, sequence = {self.sequence})'
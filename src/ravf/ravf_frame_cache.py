@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+
+class RavfFrameCache:
+    """LRU cache of decoded frames keyed by (frame index, output mode), bounded by the total size in bytes of the cached values"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.__entries = OrderedDict()	# key -> (value, nbytes), least recently used first
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key) -> object:
+        """Returns the cached value for key or None"""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value: object, nbytes: int):
+        """Adds value to the cache, evicting the least recently used entries to stay within max_bytes, values larger than max_bytes aren't cached"""
+        if nbytes > self.max_bytes:
+            return
+
+        with self.__lock:
+            if key in self.__entries:
+                self.__bytes -= self.__entries.pop(key)[1]
+            while self.__entries and self.__bytes + nbytes > self.max_bytes:
+                self.__bytes -= self.__entries.popitem(last = False)[1][1]
+                self.evictions += 1
+            self.__entries[key] = (value, nbytes)
+            self.__bytes += nbytes
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def stats(self) -> dict:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.__entries),
+                'bytes': self.__bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __repr__(self):
+        return f'RavfFrameCache({self.stats()})'
@@ -0,0 +1,119 @@
+import numpy as np
+from functools import partial
+from .metadata_entry import RavfColorType, RavfImageEndianess, RavfImageFormat
+from .ravf_decode_plan import RavfDecodeRegistry
+
+class RavfFrameStats:
+    """Per frame statistics of a recording, stored in a sidecar next to the RAVF file (<file name>.stats.npy), a NumPy
+    structured array of DTYPE that loads in milliseconds, so a GUI can plot an overview of a whole recording and jump to
+    candidate events without decoding any frames.
+
+    Statistics are of the raw (not debayered) image scaled to 16 bit. They are either collected by the writer as frames are
+    written (see RavfWriter frame_stats), or computed afterwards with compute(). row_step > 1 only uses every row_step'th row,
+    which makes collecting them while recording cheap, saturated is then the count in the rows used"""
+
+    DTYPE = np.dtype([('timestamp', '<u8'), ('mean', '<f4'), ('max', '<u2'), ('saturated', '<u4'), ('sequence', '<u4'), ('sequence_gap', '<i4')])
+
+    # Values at or above these (16 bit scaled) are saturated
+    SATURATION = {
+        RavfImageFormat.FORMAT_8BIT:            0xFF00,
+        RavfImageFormat.FORMAT_16BIT:           0xFFFF,
+        RavfImageFormat.FORMAT_UNPACKED_10BIT:  0xFFC0,
+        RavfImageFormat.FORMAT_UNPACKED_12BIT:  0xFFF0,
+        RavfImageFormat.FORMAT_PACKED_10BIT:    0xFFC0,
+        RavfImageFormat.FORMAT_PACKED_12BIT:    0xFFF0,
+    }
+
+    def __init__(self, width: int, height: int, stride: int, format: RavfImageFormat, color_type: RavfColorType, endianess: RavfImageEndianess, row_step: int = 1):
+        self.row_step = row_step
+        self.saturation = self.SATURATION[format]
+        self.__rows = len(range(0, height, row_step))
+        self.__plan = RavfDecodeRegistry.plan(width, self.__rows, stride * row_step, format, color_type, endianess, 'raw')
+        self.__stats = np.empty(1024, self.DTYPE)	# Grows by doubling, only the first __count entries are valid
+        self.__count = 0
+
+    @classmethod
+    def for_header(cls, header, row_step: int = 1) -> object:
+        return cls(header.metadata_value('IMAGE-WIDTH'),
+                   header.metadata_value('IMAGE-HEIGHT'),
+                   header.metadata_value('IMAGE-ROW-STRIDE'),
+                   RavfImageFormat(header.metadata_value('IMAGE-FORMAT')),
+                   RavfColorType(header.metadata_value('COLOR-TYPE')),
+                   RavfImageEndianess(header.metadata_value('IMAGE-ENDIANESS')),
+                   row_step)
+
+    def add(self, data, start_timestamp: int, sequence: int):
+        """Adds the statistics of a frame's image data (any buffer), as it's written"""
+        if self.__count == len(self.__stats):
+            stats = np.empty(len(self.__stats) * 2, self.DTYPE)
+            stats[:self.__count] = self.__stats
+            self.__stats = stats
+
+        # Rows row_step apart are decoded as rows of stride * row_step, so no copy is needed to select them
+        plan = self.__plan
+        image = np.frombuffer(data, np.uint8, count = (self.__rows - 1) * plan.stride + plan.stride // self.row_step)
+        image = np.lib.stride_tricks.as_strided(image, (self.__rows, plan.stride // self.row_step), (plan.stride, 1))
+        (mean, maximum, saturated) = self.image_stats(plan.decode(image), self.saturation)
+
+        gap = 0 if self.__count == 0 else sequence - int(self.__stats[self.__count - 1]['sequence']) - 1
+        self.__stats[self.__count] = (start_timestamp, mean, maximum, saturated, sequence, gap)
+        self.__count += 1
+
+    @classmethod
+    def image_stats(cls, image: np.ndarray, saturation: int) -> (float, int, int):
+        return (float(image.mean()), int(image.max()), int(np.count_nonzero(image >= saturation)))
+
+    def stats(self) -> np.ndarray:
+        return self.__stats[:self.__count]
+
+    @classmethod
+    def sidecar_name(cls, file_name: str) -> str:
+        return file_name + '.stats.npy'
+
+    def save(self, file_name: str):
+        """Writes the sidecar for the RAVF file file_name"""
+        np.save(self.sidecar_name(file_name), self.stats())
+
+    @classmethod
+    def load(cls, file_name: str, mmap: bool = False) -> np.ndarray:
+        """Loads the sidecar of the RAVF file file_name as a structured array of DTYPE"""
+        return np.load(cls.sidecar_name(file_name), mmap_mode = 'r' if mmap else None)
+
+    @classmethod
+    def compute(cls, reader, file_handle, row_step: int = 1, processes: int = 1, save: bool = False) -> np.ndarray:
+        """Computes the statistics of every frame of an open file after recording, optionally in parallel (see RavfReader.map_frames)
+        and writes the sidecar if save is True"""
+        plan = reader.decode_plan_for('raw')
+        saturation = cls.SATURATION[plan.format]
+        stats = reader.map_frames(file_handle, partial(_frame_stats, row_step = row_step, saturation = saturation), processes = processes, dtype = cls.DTYPE)
+
+        stats['timestamp'] = reader.timestamps()
+        stats['sequence'] = reader.frame_sequences(file_handle)
+        stats['sequence_gap'][0] = 0
+        stats['sequence_gap'][1:] = np.diff(stats['sequence'].astype(np.int64)) - 1
+
+        if save:
+            np.save(cls.sidecar_name(file_handle.name), stats)
+        return stats
+
+    @classmethod
+    def candidate_events(cls, stats: np.ndarray, window: int = 25, sigma: float = 5.0) -> np.ndarray:
+        """Returns the indices of frames whose mean differs from the median of the window frames around it by more than
+        sigma robust standard deviations (1.4826 * median absolute deviation) of the whole recording, e.g. an occultation drop"""
+        means = stats['mean'].astype(np.float64)
+        if len(means) == 0:
+            return np.empty(0, np.int64)
+        padded = np.pad(means, window // 2, mode = 'edge')
+        medians = np.median(np.lib.stride_tricks.sliding_window_view(padded, 2 * (window // 2) + 1), axis = 1)
+        residuals = means - medians
+        spread = 1.4826 * np.median(np.abs(residuals - np.median(residuals)))
+        return np.flatnonzero(np.abs(residuals) > sigma * max(spread, np.finfo(np.float64).eps))
+
+
+def _frame_stats(reader, file_handle, frames: range, row_step: int, saturation: int) -> np.ndarray:
+    """map_frames function computing the image statistics of a range of frames"""
+    stats = np.zeros(len(frames), RavfFrameStats.DTYPE)
+    images = reader.read_frames(file_handle, frames, mode = 'raw')[:, ::row_step]
+    for (i, image) in enumerate(images):
+        (stats['mean'][i], stats['max'][i], stats['saturated'][i]) = RavfFrameStats.image_stats(image, saturation)
+    return stats
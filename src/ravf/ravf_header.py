@@ -6,15 +6,17 @@ class RavfHeader:
     RAVF_MAGIC   = 0x46564152	# 'RAVF'
 
     def __update_metadata_entry(self, name: str, value: object):
-        for entry in self.__metadata_entries:
-            if entry.name.txt == name:
-                entry.update(value)
-                return
+        entry = self.__entries_by_name.get(name)
+        if entry is not None:
+            entry.update(value)
 
     """metadata_entries is a list of RavfMetadataEntry"""
     def __init__(self, metadata_entries: list):
         self.__version = self.RAVF_VERSION
         self.__metadata_entries = metadata_entries
+        self.__entries_by_name = {}
+        for entry in metadata_entries:
+            self.__entries_by_name.setdefault(entry.name.txt, entry)	# First entry wins if a name is duplicated
         self.__frame_count = 0
 
         # Set OFFSET-FRAMES by serializing now to determine length
@@ -44,10 +46,10 @@ class RavfHeader:
         return self.__version
 
     def metadata_value(self, name: str) -> object:
-        for entry in self.__metadata_entries:
-            if entry.name.txt == name:
-                return entry.value
-        return None
+        entry = self.__entries_by_name.get(name)
+        if entry is None:
+            return None
+        return entry.value
 
     def metadata(self) -> list((str, object)):
         metadata = []
@@ -61,6 +63,10 @@ class RavfHeader:
 
         return metadata
 
+    def entries(self) -> list:
+        """Returns the RavfMetadataEntry list"""
+        return self.__metadata_entries
+
     def write(self, file_handle):
         self.__update_metadata_entry('FRAMES-COUNT', self.__frame_count)
         file_handle.seek(0, 0)                   # Move to begining of file
@@ -73,5 +79,11 @@ class RavfHeader:
     def increment_frame_count(self):
         self.__frame_count += 1
 
+    def set_frame_count(self, frame_count: int):
+        self.__frame_count = frame_count
+
+    def frame_count(self) -> int:
+        return self.__frame_count
+
     def __repr__(self):
         return f'RavfHeader(version = {self.__version}, metadata_entries = {self.__metadata_entries})'
@@ -1,7 +1,24 @@
+import sys
 import cv2
 import numpy as np
 
+class _StridedView:
+    """Exposes an __array_interface__ so numpy can reinterpret a uint8 image with a different dtype and strides (like as_strided, but allowing the dtype to change)"""
+    def __init__(self, interface: dict, base: np.array):
+        self.__array_interface__ = interface
+        self.base = base
+
 class RavfImageUtils:
+    # Fast path unpacking writes the high and low bytes of the uint16 result directly, so relies on a little endian host
+    _FAST_UNPACK = sys.byteorder == 'little'
+
+    # For a 10-bit packed 5 byte group, maps the 5th (least significant bits) byte to the 2 low bits of all 4 pixels,
+    # already scaled to 16 bit and positioned in the uint16 lanes of a uint64 holding 4 pixels
+    _LUT_10BIT_LSB = np.zeros(256, np.uint64)
+    for _k in range(4):
+        _LUT_10BIT_LSB |= (((np.arange(256, dtype=np.uint64) >> np.uint64(6 - 2 * _k)) & np.uint64(0x03)) << np.uint64(6)) << np.uint64(16 * _k)
+    del _k
+
     @classmethod
     def bytes_to_np_array(cls, buffer: bytes, stride: int, height: int) -> np.array:
         """Converts bytes to a numpy array of uint8"""
@@ -22,61 +39,140 @@ class RavfImageUtils:
     def unstride_12bit(cls, image: np.array, width: int, height: int) -> np.array:
         """Removes the stride padding from the image, so image size is width x height, image should be in uint8 (before unpacking)"""
         unstride_length = ((width * 3) // 2)
-        image = image[:,:unstride_length]
+        image = image[...,:unstride_length]
         return image
 
     @classmethod
     def unstride_10bit(cls, image: np.array, width: int, height: int) -> np.array:
         """Removes the stride padding from the image, so image size is width x height, image should be in uint8 (before unpacking)"""
         unstride_length = ((width * 5) // 4)
-        image = image[:,:unstride_length]
+        image = image[...,:unstride_length]
         return image
 
     @classmethod
     def unstride_16bit(cls, image: np.array, width: int, height: int) -> np.array:
         unstride_length = width
-        image = image[:,:unstride_length]
+        image = image[...,:unstride_length]
         return image
 
     @classmethod
     def unpack_12bit_pihq(cls, image: np.array, width: int, height: int, stride: int) -> np.array:
-        """Unpacks a uint8 12-bit packed image into uint16 pixels"""
-        image = image.flatten()
+        """Unpacks a uint8 12-bit packed image into uint16 pixels, leading dimensions (e.g. a stack of frames) are preserved"""
         image = image.astype(np.uint16)
-        result = np.zeros(height * width, np.uint16)	# Holds the result
+        result = np.empty(image.shape[:-2] + (height, width), np.uint16)	# Holds the result
 
         # There are a few different 12 bit packing formats in the wild where 2x12 bit pixels are encoded into 3 bytes
         # This one for the Pi HQ is  aaaabbbb AAAAAAAA BBBBBBBB
-        result[0::2] = (image[1::3] << 4) | ((image[0::3] & 0xF0) >> 4)
-        result[1::2] = (image[2::3] << 4) | (image[0::3] & 0x0F)
-
-        result = np.reshape(result, (height, width))
+        # Rows are unpacked independently, a row never splits a 3 byte group
+        result[...,0::2] = (image[...,1::3] << 4) | ((image[...,0::3] & 0xF0) >> 4)
+        result[...,1::2] = (image[...,2::3] << 4) | (image[...,0::3] & 0x0F)
 
         return result
 
     @classmethod
     def unpack_10bit_pigsc(cls, image: np.array, width: int, height: int, stride: int) -> np.array:
-        """Unpacks a uint8 10-bit packed image into uint16 pixels"""
-        image = image.flatten()
+        """Unpacks a uint8 10-bit packed image into uint16 pixels, leading dimensions (e.g. a stack of frames) are preserved"""
         image = image.astype(np.uint16)
-        result = np.zeros(height * width, np.uint16)	# Holds the result
+        result = np.empty(image.shape[:-2] + (height, width), np.uint16)	# Holds the result
 
         # 4 pixels are encoded into 5 bytes as follows
         # This one for the Pi HQ is  AAAAAAAA BBBBBBBB CCCCCCCC DDDDDDDD AABBCCDD
         # Bytes 1-4 contain the most sigficant bits and Byte 5 contains the least significant
+        # Rows are unpacked independently, a row never splits a 5 byte group
         #result[0::4] = (image[0::5] << 2) | ((image[3::5] >> 6) & 0x03)
         #result[1::4] = (image[1::5] << 2) | ((image[3::5] >> 4) & 0x03)
         #result[2::4] = (image[2::5] << 2) | ((image[3::5] >> 2) & 0x03)
         #result[3::4] = (image[4::5] << 2) | (image[3::5] & 0x03)
-        result[0::4] = (image[0::5] << 2) | ((image[4::5] >> 6) & 0x03)
-        result[1::4] = (image[1::5] << 2) | ((image[4::5] >> 4) & 0x03)
-        result[2::4] = (image[2::5] << 2) | ((image[4::5] >> 2) & 0x03)
-        result[3::4] = (image[3::5] << 2) | (image[4::5] & 0x03)
-
-        result = np.reshape(result, (height, width))
+        result[...,0::4] = (image[...,0::5] << 2) | ((image[...,4::5] >> 6) & 0x03)
+        result[...,1::4] = (image[...,1::5] << 2) | ((image[...,4::5] >> 4) & 0x03)
+        result[...,2::4] = (image[...,2::5] << 2) | ((image[...,4::5] >> 2) & 0x03)
+        result[...,3::4] = (image[...,3::5] << 2) | (image[...,4::5] & 0x03)
 
         return result
 
+    @classmethod
+    def __reinterpret(cls, image: np.array, dtype: str, offset: int, step: int, count: int) -> np.array:
+        """Returns a view of count elements of dtype starting every step bytes from offset along the last axis of a uint8 image, no data is copied"""
+        assert image.dtype == np.uint8 and image.strides[-1] == 1, 'image must be uint8 with contiguous rows'
+        interface = dict(image.__array_interface__)
+        interface['data'] = (interface['data'][0] + offset, interface['data'][1])
+        interface['typestr'] = dtype
+        interface['shape'] = image.shape[:-1] + (count,)
+        interface['strides'] = image.strides[:-1] + (step,)
+        interface.pop('descr', None)
+        return np.asarray(_StridedView(interface, image))
+
+    @classmethod
+    def __output(cls, image: np.array, width: int, height: int, out: np.array) -> np.array:
+        shape = image.shape[:-2] + (height, width)
+        if out is None:
+            return np.empty(shape, np.uint16)
+        assert out.shape == shape and out.dtype == np.uint16 and out.strides[-1] == 2, 'out must be uint16 of shape %s with contiguous rows' % str(shape)
+        return out
+
+    @classmethod
+    def unpack_12bit_pihq_to_16bit(cls, image: np.array, width: int, height: int, out: np.array = None) -> np.array:
+        """Unpacks a uint8 12-bit packed image (stride padding is ignored, no need to unstride) and scales to 16 bit in one pass.
+        Equivalent to unstride_12bit + unpack_12bit_pihq + scale_12_to_16bit without the intermediate copies, leading dimensions are preserved"""
+        out = cls.__output(image, width, height, out)
+        if not cls._FAST_UNPACK or width % 2:
+            np.copyto(out, cls.scale_12_to_16bit(cls.unpack_12bit_pihq(cls.unstride_12bit(image, width, height), width, height, None)))
+            return out
+
+        # aaaabbbb AAAAAAAA BBBBBBBB scaled to 16 bit is AAAAAAAAaaaa0000 and BBBBBBBBbbbb0000
+        # Read as little endian uint16, bytes 0-1 are AAAAAAAAaaaabbbb and bytes 1-2 BBBBBBBBAAAAAAAA, so masking gives the results
+        # directly apart from bbbb, which is written straight into the low byte of the second pixel
+        groups = width // 2
+        np.bitwise_and(cls.__reinterpret(image, '<u2', 0, 3, groups), 0xFFF0, out=out[...,0::2])
+        np.bitwise_and(cls.__reinterpret(image, '<u2', 1, 3, groups), 0xFF00, out=out[...,1::2])
+        np.left_shift(image[...,0:groups * 3:3], 4, out=out.view(np.uint8)[...,2::4])
+
+        return out
+
+    @classmethod
+    def unpack_10bit_pigsc_to_16bit(cls, image: np.array, width: int, height: int, out: np.array = None) -> np.array:
+        """Unpacks a uint8 10-bit packed image (stride padding is ignored, no need to unstride) and scales to 16 bit in one pass.
+        Equivalent to unstride_10bit + unpack_10bit_pigsc + scale_10_to_16bit without the intermediate copies, leading dimensions are preserved"""
+        out = cls.__output(image, width, height, out)
+        if not cls._FAST_UNPACK or width % 4 or out.strides[-2] % 8:
+            np.copyto(out, cls.scale_10_to_16bit(cls.unpack_10bit_pigsc(cls.unstride_10bit(image, width, height), width, height, None)))
+            return out
+
+        # AAAAAAAA BBBBBBBB CCCCCCCC DDDDDDDD AABBCCDD, each group of 4 pixels is handled as one uint64 of 4 uint16 lanes
+        # The 4 most significant bytes are read as a uint32 and spread into the high byte of each lane, then the
+        # least significant bits for all 4 lanes are looked up from the 5th byte and or'ed in
+        groups = width // 4
+        lanes = out.view(np.uint64)
+        scratch = np.empty(lanes.shape, np.uint64)
+        np.copyto(lanes, cls.__reinterpret(image, '<u4', 0, 5, groups), casting='unsafe')
+        np.left_shift(lanes, np.uint64(16), out=scratch)		# DCBA -> 00DC00BA
+        np.bitwise_or(lanes, scratch, out=lanes)
+        np.bitwise_and(lanes, np.uint64(0x0000FFFF0000FFFF), out=lanes)
+        np.left_shift(lanes, np.uint64(8), out=scratch)		# 00DC00BA -> D0C0B0A0
+        np.left_shift(lanes, np.uint64(16), out=lanes)
+        np.bitwise_or(lanes, scratch, out=lanes)
+        np.bitwise_and(lanes, np.uint64(0xFF00FF00FF00FF00), out=lanes)
+        np.take(cls._LUT_10BIT_LSB, image[...,4:groups * 5:5], out=scratch, mode='clip')
+        np.bitwise_or(lanes, scratch, out=lanes)
+
+        return out
+
+    @classmethod
+    def unpack_8bit_to_16bit(cls, image: np.array, width: int, out: np.array = None) -> np.array:
+        """Removes the stride padding from uint8 image data and scales to 16 bit, width is in samples (i.e. x3 for RGB)"""
+        return np.left_shift(image[...,:width], 8, out=out, dtype=np.uint16)
+
+    @classmethod
+    def unpack_16bit_to_16bit(cls, image: np.array, width: int, shift: int, big_endian: bool = False, out: np.array = None) -> np.array:
+        """Reinterprets uint8 image data as uint16, removes the stride padding and scales by shift bits, width is in samples (i.e. x3 for RGB)"""
+        image = cls.unstride_16bit(image.view('>u2' if big_endian else '<u2'), width, None)
+        if shift:
+            return np.left_shift(image, shift, out=out, dtype=np.uint16)
+        if out is None:
+            return image.astype(np.uint16, copy=image.dtype != np.uint16)
+        np.copyto(out, image)
+        return out
+
     @classmethod
     def scale_12_to_16bit(cls, image: np.array) -> np.array:
         """Scales and image from 12 to 16 bit"""
@@ -88,26 +184,61 @@ class RavfImageUtils:
         return image << 6 
 
     @classmethod
-    def debayer_BGGR_to_BGR(cls, image: np.array) -> np.array:
+    def debayer_BGGR_to_BGR(cls, image: np.array, out: np.array = None) -> np.array:
         """Converts a bayered image from BBGR to BGR, note opencv has whacky bayers""" 
-        return cv2.cvtColor(image, cv2.COLOR_BayerRG2BGR)
+        return cv2.cvtColor(image, cv2.COLOR_BayerRG2BGR, dst=out)
 
     @classmethod
-    def debayer_GBRG_to_BGR(cls, image: np.array) -> np.array:
+    def debayer_GBRG_to_BGR(cls, image: np.array, out: np.array = None) -> np.array:
         """Converts a bayered image from GBRG to BGR, note opencv has whacky bayers""" 
-        return cv2.cvtColor(image, cv2.COLOR_BayerGR2BGR)
+        return cv2.cvtColor(image, cv2.COLOR_BayerGR2BGR, dst=out)
 
     @classmethod
-    def debayer_BGGR_to_BGR_VNG(cls, image: np.array) -> np.array:
+    def debayer_BGGR_to_BGR_VNG(cls, image: np.array, out: np.array = None) -> np.array:
         """Converts a bayered image from BBGR to BGR using VNG, note opencv has whacky bayers""" 
-        return cv2.cvtColor(image, cv2.COLOR_BayerRG2BGR_VNG)
+        return cv2.cvtColor(image, cv2.COLOR_BayerRG2BGR_VNG, dst=out)
 
     @classmethod
-    def debayer_BGGR_to_GRAY(cls, image: np.array) -> np.array:
+    def debayer_BGGR_to_GRAY(cls, image: np.array, out: np.array = None) -> np.array:
         """Converts a bayered image from BBGR to GRAY, note opencv has whacky bayers""" 
-        return cv2.cvtColor(image, cv2.COLOR_BayerRG2GRAY)
+        return cv2.cvtColor(image, cv2.COLOR_BayerRG2GRAY, dst=out)
 
     @classmethod
-    def debayer_GBRG_to_GRAY(cls, image: np.array) -> np.array:
+    def debayer_GBRG_to_GRAY(cls, image: np.array, out: np.array = None) -> np.array:
         """Converts a bayered image from GBRG to GRAY, note opencv has whacky bayers""" 
-        return cv2.cvtColor(image, cv2.COLOR_BayerGR2GRAY)
+        return cv2.cvtColor(image, cv2.COLOR_BayerGR2GRAY, dst=out)
+
+    @classmethod
+    def debayer(cls, image: np.array, code: int, out: np.array = None) -> np.array:
+        """Converts an image with the opencv color conversion code, e.g. cv2.COLOR_BayerRG2GRAY"""
+        return cv2.cvtColor(image, code, dst=out)
+
+    @classmethod
+    def debayer_CMY_to_GRAY(cls, image: np.array, out: np.array = None) -> np.array:
+        """Approximate luminance of a CYYM family CFA image, opencv has no CMY support, so each pixel is the mean
+        of its 2x2 neighbourhood, which always contains one C, one M and two Y (~3R + 3G + 2B)"""
+        return cv2.boxFilter(image, -1, (2, 2), dst=out, normalize=True, borderType=cv2.BORDER_REPLICATE)
+
+    @classmethod
+    def debayer_CMY_to_BGR(cls, image: np.array, layout: str, out: np.array = None) -> np.array:
+        """Converts a CYYM family CFA image to BGR by superpixel demosaicing, layout is the 2x2 pattern, e.g. 'CYYM'.
+        Each 2x2 quad gives C = G+B, Y = R+G, M = R+B from which R, G and B are solved, the half resolution
+        result is then resized back up to the image size"""
+        (height, width) = image.shape
+        quad = {}
+        for (position, channel) in enumerate(layout):
+            quad.setdefault(channel, []).append(image[position // 2::2, position % 2::2].astype(np.float32))
+        c = quad['C'][0]
+        m = quad['M'][0]
+        y = (quad['Y'][0] + quad['Y'][1]) * 0.5
+
+        superpixels = np.empty((height // 2, width // 2, 3), np.float32)
+        superpixels[...,0] = (c + m - y) * 0.5		# B
+        superpixels[...,1] = (c + y - m) * 0.5		# G
+        superpixels[...,2] = (y + m - c) * 0.5		# R
+        np.clip(superpixels, 0, 65535, out=superpixels)
+
+        if out is None:
+            out = np.empty((height, width, 3), np.uint16)
+        np.copyto(out, cv2.resize(superpixels, (width, height), interpolation=cv2.INTER_LINEAR), casting='unsafe')
+        return out
@@ -1,12 +1,24 @@
 import struct
+import numpy as np
+from .ravf_frame import RavfFrame
 
 class RavfIndex:
+    INDEX_DTYPE = np.dtype([('offset', '<u8'), ('timestamp', '<u8')])	# Matches the on-disk layout of an index entry
+    SCAN_BLOCK_SIZE = 16 * 1024 * 1024	# Block size used when scanning for the frame magic number during rebuild
 
     def __init__(self):
-        self.__frames = []
+        self.__frames = np.empty(1024, dtype=self.INDEX_DTYPE)	# Grows by doubling, only the first __count entries are valid
+        self.__count = 0
+        self.__timestamp_order = None	# Lazily computed, see __sorted_timestamps
 
     def add_frame(self, offset, start_timestamp):
-        self.__frames.append((offset, start_timestamp))
+        if self.__count == len(self.__frames):
+            frames = np.empty(len(self.__frames) * 2, dtype=self.INDEX_DTYPE)
+            frames[:self.__count] = self.__frames
+            self.__frames = frames
+        self.__frames[self.__count] = (offset, start_timestamp)
+        self.__count += 1
+        self.__timestamp_order = None
 
     @classmethod
     def deserialize(cls, file_handle) -> object:
@@ -14,32 +26,147 @@ class RavfIndex:
 
         count_frames = struct.unpack('<I', file_handle.read(4))[0]
 
-        for i in range(count_frames):
-            frame = struct.unpack('<QQ', file_handle.read(16)) 
-            index.__frames.append(frame)
-       
+        # Read the whole table in one go rather than frame by frame
+        table_length = count_frames * cls.INDEX_DTYPE.itemsize
+        table = file_handle.read(table_length)
+        assert len(table) == table_length, 'Index truncated'
+
+        index.__frames = np.frombuffer(table, dtype=cls.INDEX_DTYPE)
+        index.__count = count_frames
+
+        return index
+
+    @classmethod
+    def from_frames(cls, frames: np.ndarray) -> object:
+        """Returns an index of frames, a structured array of INDEX_DTYPE (copied)"""
+        index = cls()
+        index.__frames = np.empty(max(len(index.__frames), len(frames)), dtype=cls.INDEX_DTYPE)
+        index.__frames[:len(frames)] = frames
+        index.__count = len(frames)
+        return index
+
+    @classmethod
+    def rebuild(cls, file_handle, offset_frames: int) -> object:
+        """Rebuilds the index of a file without one (e.g. recording interrupted by power loss) from the frames themselves.
+        Frames are stored back to back, so the frame headers are followed from offset_frames without reading image data.
+        If a frame header is not where it's expected, the file is scanned in large blocks for the next RavfFrame.RAVF_MAGIC.
+        A final frame that was only partially written is excluded."""
+        index = cls()
+
+        file_size = file_handle.seek(0, 2)
+        offset = offset_frames
+        while offset + RavfFrame.RAVF_HEADER_NO_PADDING_LENGTH <= file_size:
+            file_handle.seek(offset, 0)
+            (magic, frame_header_length, image_data_length, frame_type, start_timestamp) = RavfFrame.HEADER_STRUCT.unpack(file_handle.read(RavfFrame.RAVF_HEADER_NO_PADDING_LENGTH))[:5]
+
+            if magic == RavfFrame.RAVF_MAGIC and frame_header_length >= RavfFrame.RAVF_HEADER_NO_PADDING_LENGTH:
+                frame_end = offset + frame_header_length + image_data_length
+                if frame_end > file_size:
+                    break	# Truncated frame
+                index.add_frame(offset, start_timestamp)
+                offset = frame_end
+            else:
+                offset = cls.__scan_for_magic(file_handle, offset + 1, file_size)
+                if offset is None:
+                    break
+
         return index
 
+    @classmethod
+    def __scan_for_magic(cls, file_handle, offset: int, file_size: int) -> int:
+        """Returns the offset of the next frame magic number at or after offset, or None"""
+        magic = struct.pack('<Q', RavfFrame.RAVF_MAGIC)
+        while offset < file_size:
+            file_handle.seek(offset, 0)
+            block = file_handle.read(cls.SCAN_BLOCK_SIZE)
+            found = block.find(magic)
+            if found >= 0:
+                return offset + found
+            if len(block) < len(magic):
+                break
+            offset += len(block) - (len(magic) - 1)	# Overlap blocks so a magic number spanning 2 blocks is found
+        return None
+
     def __serialize(self) -> bytes:
-        ser = struct.pack('<I', len(self.__frames))
-        for i in range(len(self.__frames)):
-            ser += struct.pack('<QQ', self.__frames[i][0], self.__frames[i][1])
-        return ser
+        return struct.pack('<I', self.__count) + self.__frames[:self.__count].tobytes()
 
     def write(self, file_handle):
         file_handle.write(self.__serialize())    # Write the header
 
     def count(self):
-        return len(self.__frames)
+        return self.__count
 
     def item(self, index: int) -> (int, int):
-        return (self.__frames[index][0], self.__frames[index][1])
+        if index < 0:
+            index += self.__count
+        if index < 0 or index >= self.__count:
+            raise IndexError('index out of range')
+        frame = self.__frames[index]
+        return (int(frame['offset']), int(frame['timestamp']))
+
+    def frames(self) -> np.ndarray:
+        """Returns a read only structured array view of (offset, timestamp) for all frames"""
+        frames = self.__frames[:self.__count]
+        frames.flags.writeable = False
+        return frames
+
+    def offsets(self) -> np.ndarray:
+        """Returns a read only array view of the frame offsets"""
+        return self.frames()['offset']
+
+    def timestamps(self) -> np.ndarray:
+        """Returns a read only array view of the frame start timestamps"""
+        return self.frames()['timestamp']
+
+    def __sorted_timestamps(self) -> (np.ndarray, np.ndarray):
+        """Returns (timestamps in ascending order, frame index for each or None if already in frame order).
+        Timestamps are normally monotonic, so this is a one off vectorized check, a sort is only needed
+        if the recording contains out of order timestamps"""
+        timestamps = self.timestamps()
+        if self.__timestamp_order is None:
+            if self.__count < 2 or np.all(timestamps[1:] >= timestamps[:-1]):
+                self.__timestamp_order = ()
+            else:
+                self.__timestamp_order = np.argsort(timestamps, kind='stable')
+
+        if len(self.__timestamp_order) == 0:
+            return (timestamps, None)
+        return (timestamps[self.__timestamp_order], self.__timestamp_order)
+
+    def index_for_timestamp(self, timestamp: int, mode: str = 'nearest') -> int:
+        """Binary searches for the frame with a start timestamp nearest to timestamp (mode = 'nearest'),
+        the last frame starting at or before it (mode = 'before'), or the first starting at or after it (mode = 'after')"""
+        if mode not in ('nearest', 'before', 'after'):
+            raise ValueError(f'Unrecognized mode: {mode}')
+        if self.__count == 0:
+            raise ValueError('Index contains no frames')
+
+        (timestamps, order) = self.__sorted_timestamps()
+        timestamp = int(timestamp)
+
+        if mode == 'before':
+            pos = int(np.searchsorted(timestamps, timestamp, side='right')) - 1
+        elif mode == 'after':
+            pos = int(np.searchsorted(timestamps, timestamp, side='left'))
+        else:
+            pos = int(np.searchsorted(timestamps, timestamp, side='left'))
+            if pos == self.__count or (pos > 0 and timestamp - int(timestamps[pos - 1]) <= int(timestamps[pos]) - timestamp):
+                pos -= 1
+
+        if pos < 0 or pos >= self.__count:
+            raise ValueError(f'No frame {mode} timestamp {timestamp}')
+
+        return pos if order is None else int(order[pos])
+
+    def indices_for_timestamps(self, start_timestamp: int, end_timestamp: int) -> np.ndarray:
+        """Returns the indices (in frame order) of all frames with start_timestamp <= start timestamp <= end_timestamp"""
+        (timestamps, order) = self.__sorted_timestamps()
+        lo = int(np.searchsorted(timestamps, int(start_timestamp), side='left'))
+        hi = int(np.searchsorted(timestamps, int(end_timestamp), side='right'))
 
-    def timestamps(self) -> list:
-        timestamps = []
-        for i in range(len(self.__frames)):
-            timestamps.append(self.__frames[i][1])
-        return timestamps
+        if order is None:
+            return np.arange(lo, max(lo, hi))
+        return np.sort(order[lo:hi])
 
     def __repr__(self):
-        return f'RavfIndex(frames(offset, timestamp) = {self.__frames})'
+        return f'RavfIndex(frames(offset, timestamp) = {self.frames().tolist()})'
@@ -0,0 +1,153 @@
+import threading
+import time
+
+class RavfHistogram:
+    """Fixed size log-linear histogram of non-negative integers (e.g. ns), memory and the cost of add() don't depend on
+    how many values are recorded. Each power of 2 is split into SUB_BUCKETS buckets, so percentiles are within 12.5%,
+    values below 2 * SUB_BUCKETS are exact. count, total and max are exact"""
+
+    SUB_BUCKETS = 8
+    SUB_BITS = 3
+    BUCKETS = (64 - SUB_BITS - 1) * SUB_BUCKETS + 2 * SUB_BUCKETS	# Enough for any uint64
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def bucket(cls, value: int) -> int:
+        if value < 2 * cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BITS - 1	# value >> shift is SUB_BUCKETS to 2 * SUB_BUCKETS - 1
+        return cls.SUB_BUCKETS * shift + (value >> shift)
+
+    @classmethod
+    def bucket_limit(cls, bucket: int) -> int:
+        """Returns the largest value in bucket"""
+        if bucket < 2 * cls.SUB_BUCKETS:
+            return bucket
+        shift = bucket // cls.SUB_BUCKETS - 1
+        return ((bucket - cls.SUB_BUCKETS * shift + 1) << shift) - 1
+
+    def add(self, value: int):
+        value = max(0, int(value))
+        self.counts[self.bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent: float) -> int:
+        """Returns the upper limit of the bucket holding the percent'th percentile (at most max), 0 if empty"""
+        if self.count == 0:
+            return 0
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for (bucket, count) in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bucket_limit(bucket), self.max)
+        return self.max
+
+    def summary(self, scale: float = 1.0) -> dict:
+        """Returns {'count', 'mean', 'p50', 'p99', 'max'}, values multiplied by scale"""
+        return {'count': self.count, 'mean': self.total * scale / self.count if self.count else 0.0,
+                'p50': self.percentile(50) * scale, 'p99': self.percentile(99) * scale, 'max': self.max * scale}
+
+
+class RavfInstrumentation:
+    """Process wide instrumentation of the hot paths of RavfWriter, RavfAsyncWriter, RavfReader, RavfFrame and the decode
+    plans (and so the RavfImageUtils unpack and debayer functions), for finding where time goes when a capture drops frames
+    or playback stutters, without a profiler.
+
+    Disabled by default: the hot paths only check RavfInstrumentation.active, which is None until enable() is called.
+    When enabled, each stage's time is recorded in a RavfHistogram with the bytes it moved, and queue depths as gauges:
+
+        write.pack          Packing the frame header (struct.pack_into)
+        write.io            The write system call(s) of header + image data
+        write.frame_stats   RavfFrameStats collection, if enabled
+        write.checkpoint    Header rewrite + fsync
+        async.copy          Copying a frame into a RavfAsyncWriter buffer
+        async.buffer_wait   Waiting for a free buffer (block_when_full)
+        read.header         Reading and unpacking a frame header (not mmapped)
+        read.data           Reading a frame's image data (not mmapped)
+        read.decompress     Decompressing a frame of a compressed file
+        read.frames         RavfReader.read_frames, the whole call
+        read.pymovie        getPymovieMainImageAndStatusData end to end (cache misses)
+        decode.<stage>      Each decode plan stage, e.g. decode.unpack, decode.debayer, decode.calibrate
+
+        async.queue_depth   (gauge) Frames waiting for the RavfAsyncWriter thread after each write_frame
+
+    If callback is set, it's called with stats() at most every interval seconds, from whichever thread records a value"""
+
+    active = None
+
+    def __init__(self, callback = None, interval: float = 1.0):
+        self.callback = callback
+        self.interval = interval
+        self.__lock = threading.Lock()
+        self.__timings = {}	# name -> [RavfHistogram of ns, bytes]
+        self.__gauges = {}	# name -> RavfHistogram
+        self.__last_callback = time.perf_counter()
+
+    @classmethod
+    def enable(cls, callback = None, interval: float = 1.0) -> object:
+        """Starts recording into a new RavfInstrumentation, which is returned"""
+        cls.active = cls(callback, interval)
+        return cls.active
+
+    @classmethod
+    def disable(cls) -> object:
+        """Stops recording, returns the RavfInstrumentation that was active (or None) so its stats can still be read"""
+        (instrumentation, cls.active) = (cls.active, None)
+        return instrumentation
+
+    def record(self, name: str, seconds: float, nbytes: int = 0):
+        with self.__lock:
+            timing = self.__timings.get(name)
+            if timing is None:
+                timing = self.__timings[name] = [RavfHistogram(), 0]
+            timing[0].add(seconds * 1e9)
+            timing[1] += nbytes
+        self.__maybe_callback()
+
+    def gauge(self, name: str, value: int):
+        with self.__lock:
+            histogram = self.__gauges.get(name)
+            if histogram is None:
+                histogram = self.__gauges[name] = RavfHistogram()
+            histogram.add(value)
+        self.__maybe_callback()
+
+    def __maybe_callback(self):
+        if self.callback is None:
+            return
+        now = time.perf_counter()
+        with self.__lock:
+            if now - self.__last_callback < self.interval:
+                return
+            self.__last_callback = now
+        self.callback(self.stats())
+
+    def reset(self):
+        with self.__lock:
+            self.__timings.clear()
+            self.__gauges.clear()
+
+    def stats(self) -> dict:
+        """Returns {'timings': {name: {'count', 'mean_us', 'p50_us', 'p99_us', 'max_us', 'total_s', 'bytes', 'mb_per_s'}},
+                    'gauges': {name: {'count', 'mean', 'p50', 'p99', 'max'}}}"""
+        with self.__lock:
+            timings = {}
+            for (name, (histogram, nbytes)) in self.__timings.items():
+                summary = histogram.summary(1e-3)
+                total_s = histogram.total * 1e-9
+                timings[name] = {'count': summary['count'], 'mean_us': summary['mean'], 'p50_us': summary['p50'], 'p99_us': summary['p99'], 'max_us': summary['max'],
+                                 'total_s': total_s, 'bytes': nbytes, 'mb_per_s': nbytes / total_s / 1e6 if nbytes and total_s > 0 else 0.0}
+            gauges = {name: histogram.summary() for (name, histogram) in self.__gauges.items()}
+        return {'timings': timings, 'gauges': gauges}
+
+    def __repr__(self):
+        return f'RavfInstrumentation({self.stats()})'
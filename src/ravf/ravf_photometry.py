@@ -0,0 +1,138 @@
+import time
+import warnings
+import numpy as np
+from dataclasses import dataclass, field
+from functools import partial
+from .ravf_reader import RavfReader
+
+@dataclass(frozen = True)
+class RavfAperture:
+    """A circular aperture centred on (x, y) with a background annulus between background_inner and background_outer
+    (defaults radius + 4 and radius + 8). The position can move from frame to frame, either at a constant drift in pixels
+    per frame from frame 0, or explicitly with positions, an (N, 2) array of (x, y) for every frame in the file,
+    e.g. from a tracker"""
+    name: str
+    x: float
+    y: float
+    radius: float
+    background_inner: float = None
+    background_outer: float = None
+    drift: tuple = (0.0, 0.0)
+    positions: np.ndarray = field(default = None, compare = False, repr = False)
+
+    def annulus(self) -> (float, float):
+        inner = self.radius + 4 if self.background_inner is None else self.background_inner
+        outer = inner + 4 if self.background_outer is None else self.background_outer
+        return (inner, outer)
+
+    def centres(self, frames: np.ndarray) -> (np.ndarray, np.ndarray):
+        """Returns (x, y) arrays of the aperture centre in each frame"""
+        if self.positions is not None:
+            positions = np.asarray(self.positions, np.float64)[frames]
+            return (positions[:, 0], positions[:, 1])
+        return (self.x + self.drift[0] * frames, self.y + self.drift[1] * frames)
+
+
+class RavfPhotometry:
+    """Streaming aperture photometry of a RAVF recording. All apertures are measured over a range of frames in one pass,
+    decoding only the region of interest around each aperture for batches of frames at a time (see RavfReader.read_rois),
+    optionally split across processes (see RavfReader.imap_frames), each reading its own share of the file.
+
+    run() returns a structured array with one row per frame:
+        index, timestamp                                 Frame index and start timestamp
+        <name>_x, <name>_y                               Aperture centre
+        <name>_sum, <name>_area                          Sum and number of pixels within the aperture
+        <name>_background                                Median per pixel value in the background annulus
+
+    calibration is an optional RavfCalibration applied to the frames before they're measured
+    """
+
+    def __init__(self, file_name: str, apertures: list, mode: str = 'gray', use_mmap: bool = True, calibration = None):
+        if len(set(aperture.name for aperture in apertures)) != len(apertures):
+            raise ValueError('Aperture names must be unique')
+        self.file_name = file_name
+        self.apertures = list(apertures)
+        self.mode = mode
+        self.use_mmap = use_mmap
+        self.calibration = calibration
+        self.stats = {}	# Of the last run: frames, seconds, frames_per_second
+
+    @classmethod
+    def table_dtype(cls, apertures: list) -> np.dtype:
+        fields = [('index', '<u4'), ('timestamp', '<u8')]
+        for aperture in apertures:
+            fields += [(f'{aperture.name}_{name}', '<f8') for name in ('x', 'y', 'sum', 'area', 'background')]
+        return np.dtype(fields)
+
+    def run(self, start: int = 0, stop: int = None, processes: int = 1, batch_frames: int = 256) -> np.ndarray:
+        """Measures all apertures in frames start to stop, processes > 1 splits the frames into batches of batch_frames
+        shared between that many worker processes"""
+        started = time.perf_counter()
+        with open(self.file_name, 'rb') as file_handle:
+            reader = RavfReader(file_handle, use_mmap = self.use_mmap)
+            reader.set_calibration(self.calibration)
+            (start, stop, _) = slice(start, stop).indices(reader.frame_count())
+            batches = [(first, min(first + batch_frames, stop)) for first in range(start, stop, batch_frames)]
+            table = np.empty(stop - start, self.table_dtype(self.apertures))
+
+            results = reader.imap_frames(file_handle, partial(_measure_batch, self.apertures, self.mode), batches, processes)
+            for ((first, last), result) in zip(batches, results):
+                table[first - start:last - start] = result
+            reader.close()
+
+        seconds = time.perf_counter() - started
+        self.stats = {'frames': len(table), 'seconds': seconds, 'frames_per_second': len(table) / seconds if seconds > 0 else 0.0}
+        return table
+
+    @classmethod
+    def measure(cls, reader: RavfReader, file_handle, apertures: list, mode: str, start: int, stop: int) -> np.ndarray:
+        """Measures apertures in frames start to stop of an open reader, returns rows of the run() table"""
+        frames = np.arange(start, stop)
+        table = np.empty(len(frames), cls.table_dtype(apertures))
+        table['index'] = frames
+        table['timestamp'] = reader.timestamps()[start:stop]
+
+        plan = reader.decode_plan_for(mode)
+        for aperture in apertures:
+            (x, y) = aperture.centres(frames)
+            outer = max(aperture.radius, aperture.annulus()[1])
+
+            # One ROI covering the aperture in every frame of the batch, so the batch is decoded in one go
+            x0 = max(0, int(np.floor(x.min() - outer)))
+            y0 = max(0, int(np.floor(y.min() - outer)))
+            x1 = min(plan.width, int(np.ceil(x.max() + outer)) + 1)
+            y1 = min(plan.height, int(np.ceil(y.max() + outer)) + 1)
+            if x1 <= x0 or y1 <= y0:
+                raise ValueError(f'Aperture {aperture.name} is outside the image')
+
+            images = reader.read_rois(file_handle, frames, x0, y0, x1 - x0, y1 - y0, mode = mode).astype(np.float64)
+            if images.ndim == 4:
+                images = images.mean(axis = -1)		# Color modes are measured on the mean of the channels
+
+            (table[f'{aperture.name}_x'], table[f'{aperture.name}_y']) = (x, y)
+            (table[f'{aperture.name}_sum'], table[f'{aperture.name}_area'], table[f'{aperture.name}_background']) = cls.__measure_aperture(images, x - x0, y - y0, aperture)
+
+        return table
+
+    @classmethod
+    def __measure_aperture(cls, images: np.ndarray, x: np.ndarray, y: np.ndarray, aperture: RavfAperture) -> tuple:
+        """Returns (sums, areas, backgrounds) for a stack of ROI images with the aperture centred at (x, y) in each"""
+        rows = np.arange(images.shape[1], dtype = np.float64)[None, :, None] - y[:, None, None]
+        columns = np.arange(images.shape[2], dtype = np.float64)[None, None, :] - x[:, None, None]
+        distance_squared = rows * rows + columns * columns
+
+        inside = distance_squared <= aperture.radius * aperture.radius
+        sums = np.sum(images, axis = (1, 2), where = inside)
+        areas = np.count_nonzero(inside, axis = (1, 2)).astype(np.float64)
+
+        (inner, outer) = aperture.annulus()
+        annulus = (distance_squared >= inner * inner) & (distance_squared <= outer * outer)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)	# All NaN when the annulus is entirely outside the image
+            backgrounds = np.nanmedian(np.where(annulus, images, np.nan).reshape(len(images), -1), axis = 1)
+
+        return (sums, areas, backgrounds)
+
+
+def _measure_batch(apertures: list, mode: str, reader: RavfReader, file_handle, batch: tuple) -> np.ndarray:
+    return RavfPhotometry.measure(reader, file_handle, apertures, mode, *batch)
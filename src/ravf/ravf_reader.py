@@ -1,20 +1,26 @@
-from .metadata_entry import UTF8String, RavfColorType, RavfImageFormat
+import io
+import os
+import mmap
+import struct
+import threading
+import time
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+from .metadata_entry import UTF8String, RavfColorType, RavfImageEndianess, RavfImageFormat
 from .ravf_header import RavfHeader
 from .ravf_index import RavfIndex
-from .ravf_frame import RavfFrame
+from .ravf_frame import RavfFrame, RavfFrameType
 from .ravf_image_utils import RavfImageUtils
+from .ravf_frame_cache import RavfFrameCache
+from .ravf_decode_plan import RavfDecodePlan, RavfDecodeRegistry
+from .ravf_compression import RavfCompression
+from .ravf_instrumentation import RavfInstrumentation
 
-class RavfReader:
-
-    """ Returns required_metadata_entries user_metadata_entries and index_table """
-    def __init__(self, file_handle):
-        self.header = RavfHeader.deserialize(file_handle)
-        #print(self.header)
-
-        offset_index = self.header.metadata_value('OFFSET-INDEX')
-        file_handle.seek(offset_index, 0)
-        self.index = RavfIndex.deserialize(file_handle)
-        #print(self.index)
+class RavfReaderBase:
+    """ The parts of the reader interface shared by RavfReader and RavfSegmentedReader, built on self.header, self.index,
+        frame_headers, frame_by_index and getPymovieMainImageAndStatusData """
 
     def metadata(self) -> list((UTF8String, object)):
         return self.header.metadata()
@@ -28,56 +34,399 @@ class RavfReader:
     def version(self) -> int:
         return self.header.version()
 
+    def timestamps(self) -> np.ndarray:
+        return self.index.timestamps()
+
+    def frame_types(self, file_handle) -> np.ndarray:
+        """ Returns the RavfFrameType value of every frame as a uint8 array """
+        return self.frame_headers(file_handle)['frame_type']
+
+    def frame_sequences(self, file_handle) -> np.ndarray:
+        """ Returns the sequence number of every frame as a uint32 array """
+        return self.frame_headers(file_handle)['sequence']
+
+    def frames_of_type(self, file_handle, frame_type: RavfFrameType) -> np.ndarray:
+        """ Returns the indices of all frames of frame_type, e.g. RavfFrameType.DARK """
+        return np.flatnonzero(self.frame_types(file_handle) == frame_type.value)
+
+    def index_for_time(self, timestamp, mode: str = 'nearest') -> int:
+        """ Returns the index of the frame nearest to timestamp, mode can be 'nearest', 'before' or 'after' """
+        return self.index.index_for_timestamp(RavfFrame.as_timestamp(timestamp), mode)
+
+    def frame_at_time(self, file_handle, timestamp, mode: str = 'nearest') -> (RavfFrame):
+        return self.frame_by_index(file_handle, self.index_for_time(timestamp, mode))
+
+    def frames_in_range(self, start_timestamp, end_timestamp) -> np.ndarray:
+        """ Returns the indices of all frames starting between start_timestamp and end_timestamp inclusive """
+        return self.index.indices_for_timestamps(RavfFrame.as_timestamp(start_timestamp), RavfFrame.as_timestamp(end_timestamp))
+
+    def iter_frames(self, file_handle, start: int = 0, stop: int = None, prefetch: int = 4, workers: int = None):
+        """ Generator yielding (err, image, frameInfo, status) as getPymovieMainImageAndStatusData does for frames start to stop-1 in order.
+            Frames are read and decoded ahead on a pool of worker threads, at most prefetch frames are held in memory at once """
+        if stop is None:
+            stop = self.frame_count()
+        prefetch = max(1, prefetch)
+        if workers is None:
+            workers = min(prefetch, os.cpu_count() or 1)
+
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            pending = deque()
+            next_frame = start
+            try:
+                while pending or next_frame < stop:
+                    while next_frame < stop and len(pending) < prefetch:
+                        pending.append(pool.submit(self.getPymovieMainImageAndStatusData, file_handle, next_frame))
+                        next_frame += 1
+                    yield pending.popleft().result()
+            finally:
+                # If the caller stops early, don't decode frames that will never be used
+                for future in pending:
+                    future.cancel()
+
+
+class RavfReader(RavfReaderBase):
+
+    """ Returns required_metadata_entries user_metadata_entries and index_table
+        If use_mmap is True, the file is memory mapped and frames returned by frame_by_index reference
+        the mapped file directly instead of being copied, if file_handle can't be mapped, regular reads are used
+        If cache_bytes is > 0, decoded images are kept in an LRU cache (self.cache) of up to cache_bytes
+        If recover is True and the index is missing or invalid (e.g. the recording was interrupted), the index is rebuilt from the frames
+        Compressed files (see RavfCompression) are decompressed transparently, frame data is then a copy rather than a view of the mmap """
+    def __init__(self, file_handle, use_mmap: bool = False, cache_bytes: int = 0, recover: bool = False):
+        file_handle.seek(0, 0)
+        self.header = RavfHeader.deserialize(file_handle)
+        #print(self.header)
+
+        self.index = self.__read_index(file_handle)
+        self.recovered = self.index is None
+        if self.recovered:
+            if not recover:
+                raise ValueError('Index is missing or invalid, the recording may have been interrupted, use recover = True to rebuild it')
+            self.index = RavfIndex.rebuild(file_handle, self.header.metadata_value('OFFSET-FRAMES'))
+        #print(self.index)
+
+        self.__mmap = self.__map_file(file_handle) if use_mmap else None
+        self.__file_lock = threading.Lock()	# Serializes seek + read on the shared file_handle between threads
+        self.cache = RavfFrameCache(cache_bytes) if cache_bytes > 0 else None
+        self.__decode_plans = {}
+        self.__roi_plans = {}
+        self.calibration = None
+        self.__frame_headers = None
+        self.compression = RavfCompression.for_header(self.header)
+        try:
+            self.decode_plan = self.decode_plan_for('gray') if RavfDecodeRegistry.is_supported(*self.__image_type('gray')) else None
+        except ValueError:
+            self.decode_plan = None	# Unknown COLOR-TYPE, IMAGE-FORMAT or IMAGE-ENDIANESS, the metadata and index can still be read
+
+    def __read_index(self, file_handle) -> RavfIndex:
+        """Returns the index, or None if OFFSET-INDEX is unset or doesn't point at a valid index"""
+        offset_index = self.header.metadata_value('OFFSET-INDEX')
+        file_size = file_handle.seek(0, 2)
+        if offset_index < self.header.metadata_value('OFFSET-FRAMES') or offset_index + 4 > file_size:
+            return None
+
+        file_handle.seek(offset_index, 0)
+        try:
+            index = RavfIndex.deserialize(file_handle)
+        except (AssertionError, struct.error):
+            return None
+
+        if index.count() > 0 and int(index.offsets().max()) >= offset_index:
+            return None
+        return index
+
+    def __image_type(self, mode: str) -> tuple:
+        return (RavfImageFormat(self.metadata_value('IMAGE-FORMAT')), RavfColorType(self.metadata_value('COLOR-TYPE')), RavfImageEndianess(self.metadata_value('IMAGE-ENDIANESS')), mode)
+
+    def decode_plan_for(self, mode: str = 'gray', calibrated: bool = True) -> RavfDecodePlan:
+        """Returns the decode plan for output mode 'gray', 'bgr' or 'raw' (see RavfDecodeRegistry), plans are created once and reused.
+        The plan includes the calibration (see set_calibration) unless calibrated is False"""
+        calibrated = calibrated and self.calibration is not None
+        key = mode if calibrated or self.calibration is None else (mode, 'uncalibrated')
+        plan = self.__decode_plans.get(key)
+        if plan is None:
+            plan = RavfDecodeRegistry.plan_for_header(self.header, mode)
+            if calibrated:
+                plan = self.calibration.apply_to_plan(plan)
+            self.__decode_plans[key] = plan
+        return plan
+
+    def set_calibration(self, calibration):
+        """Sets a RavfCalibration applied to every frame decoded from now on (None to remove it), images from read_preview aren't calibrated"""
+        self.calibration = calibration
+        self.__decode_plans.clear()
+        self.__roi_plans.clear()
+        if self.cache is not None:
+            self.cache.clear()
+        self.decode_plan = self.decode_plan_for('gray') if self.decode_plan is not None else None
+
+    @classmethod
+    def __map_file(cls, file_handle) -> mmap.mmap:
+        """Returns a read only mmap of file_handle, or None if the handle isn't backed by a mappable file"""
+        try:
+            return mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            return None
+
+    def is_mmapped(self) -> bool:
+        return self.__mmap is not None
+
+    def close(self):
+        """Releases the memory map, frames previously returned by frame_by_index must not be used after this"""
+        if self.__mmap is not None:
+            try:
+                self.__mmap.close()
+            except BufferError:
+                pass	# Frame data still references the map, it's released when they are garbage collected
+            self.__mmap = None
+
     def frame_by_index(self, file_handle, index) -> (RavfFrame): 
         ind = self.index.item(index)
-        file_handle.seek(ind[0], 0)
-        frame = RavfFrame.deserialize(file_handle)
+        if self.__mmap is not None:
+            frame = RavfFrame.deserialize_from_buffer(self.__mmap, ind[0])
+        else:
+            with self.__file_lock:
+                file_handle.seek(ind[0], 0)
+                frame = RavfFrame.deserialize(file_handle)
+        if self.compression is not None:
+            instrumentation = RavfInstrumentation.active
+            if instrumentation is not None:
+                started = time.perf_counter()
+            frame.data = self.compression.decompress(frame.data)
+            if instrumentation is not None:
+                instrumentation.record('read.decompress', time.perf_counter() - started, len(frame.data))
         return frame
+
+    def __frame_image(self, file_handle, index: int) -> np.array:
+        """Returns the decompressed uint8 image data of a frame of a compressed file as (height, stride)"""
+        return np.frombuffer(self.frame_by_index(file_handle, index).data, np.uint8).reshape(-1, self.decode_plan_for('raw').stride)
  
-    def timestamps(self) -> list:
-        return self.index.timestamps()
+    def __frame_data_location(self, file_handle, index: int) -> (int, int):
+        """Returns (offset, length) of the image data of a frame from its frame header"""
+        offset = self.index.item(index)[0]
+        if self.__mmap is not None:
+            header = self.__mmap[offset:offset + RavfFrame.RAVF_HEADER_NO_PADDING_LENGTH]
+        else:
+            with self.__file_lock:
+                file_handle.seek(offset, 0)
+                header = file_handle.read(RavfFrame.RAVF_HEADER_NO_PADDING_LENGTH)
+        (magic, frame_header_length, image_data_length) = RavfFrame.HEADER_STRUCT.unpack(header)[:3]
+        assert magic == RavfFrame.RAVF_MAGIC, 'Magic number mismatch'
+        return (offset + frame_header_length, image_data_length)
+
+    def read_rows(self, file_handle, index: int, rows: np.ndarray) -> np.array:
+        """ Returns the uint8 image data of the given rows of a frame as (len(rows), stride) without reading the rest of the frame """
+        if self.compression is not None:
+            return self.__frame_image(file_handle, index)[rows]
+
+        stride = self.decode_plan_for('raw').stride
+        (offset, length) = self.__frame_data_location(file_handle, index)
+        assert len(rows) == 0 or (int(np.max(rows)) + 1) * stride <= length, 'Row out of range'
+
+        if self.__mmap is not None:
+            image = np.frombuffer(self.__mmap, np.uint8, count = length, offset = offset).reshape(-1, stride)
+            return image[rows]
+
+        # Read runs of consecutive rows with one read each
+        result = np.empty((len(rows), stride), np.uint8)
+        rows = np.asarray(rows)
+        run_starts = np.flatnonzero(np.diff(rows, prepend = -2) != 1)
+        run_ends = np.append(run_starts[1:], len(rows))
+        with self.__file_lock:
+            for (start, end) in zip(run_starts, run_ends):
+                file_handle.seek(offset + int(rows[start]) * stride, 0)
+                file_handle.readinto(memoryview(result[start:end]).cast('B'))
+        return result
+
+    def read_preview(self, file_handle, index: int, scale: int = 4) -> np.array:
+        """ Returns a reduced resolution uint16 mono preview (height // scale, width // scale) of a frame for scale 2, 4 or 8,
+            only the rows needed are read and there's no debayering, see RavfDecodePlan.preview_decode """
+        if self.cache is not None:
+            key = (index, f'preview{scale}')
+            image = self.cache.get(key)
+            if image is None:
+                image = self.__read_preview(file_handle, index, scale)
+                image.flags.writeable = False
+                self.cache.put(key, image, image.nbytes)
+            return image
+        return self.__read_preview(file_handle, index, scale)
+
+    def __read_preview(self, file_handle, index: int, scale: int) -> np.array:
+        plan = self.decode_plan_for('raw')
+        rows = plan.preview_rows(scale)
+        if rows is None:
+            rows = np.arange(plan.height)
+        return plan.preview_decode(self.read_rows(file_handle, index, rows), scale)
+
+    ROI_DEBAYER_MARGIN = 4	# Pixels decoded around a CFA region of interest so the debayer matches a full frame decode
+
+    def __roi_window(self, x: int, y: int, width: int, height: int, mode: str) -> tuple:
+        """Returns (rows, columns as bytes, crop, plan) for decoding a region of interest. The region is widened to whole
+        packing groups and an even bayer phase (plus a margin when debayering) and decoded with its own plan, crop selects
+        the requested region from the decoded window"""
+        plan = self.decode_plan_for(mode)
+        if width <= 0 or height <= 0 or x < 0 or y < 0 or x + width > plan.width or y + height > plan.height:
+            raise ValueError(f'ROI ({x}, {y}, {width}, {height}) outside image ({plan.width}, {plan.height})')
+
+        (group_pixels, group_bytes) = plan.packing()
+        (align_x, align_y) = (group_pixels, 1)
+        margin = 0
+        if plan.is_cfa():
+            (align_x, align_y) = (max(group_pixels, 2), 2)
+            margin = self.ROI_DEBAYER_MARGIN if mode != 'raw' else 0
+
+        x0 = max(0, x - margin) // align_x * align_x
+        y0 = max(0, y - margin) // align_y * align_y
+        x1 = min(plan.width, -(-(x + width + margin) // align_x) * align_x)
+        y1 = min(plan.height, -(-(y + height + margin) // align_y) * align_y)
+
+        # Plans only depend on the window size, unless calibrating, when the window's part of the masters is needed
+        key = (mode, x1 - x0, y1 - y0) if self.calibration is None else (mode, x0, y0, x1, y1)
+        roi_plan = self.__roi_plans.get(key)
+        if roi_plan is None:
+            roi_plan = RavfDecodeRegistry.plan((x1 - x0), (y1 - y0), (x1 - x0) // group_pixels * group_bytes, *self.__image_type(mode))
+            if self.calibration is not None:
+                roi_plan = self.calibration.apply_to_plan(roi_plan, slice(y0, y1), slice(x0, x1))
+            self.__roi_plans[key] = roi_plan
+
+        columns = slice(x0 // group_pixels * group_bytes, x1 // group_pixels * group_bytes)
+        crop = (slice(y - y0, y - y0 + height), slice(x - x0, x - x0 + width))
+        return (slice(y0, y1), columns, crop, roi_plan)
+
+    def read_roi(self, file_handle, index: int, x: int, y: int, width: int, height: int, mode: str = 'gray') -> np.array:
+        """ Decodes just a region of interest of a frame, (height, width) for the default 'gray' mode. Only the bytes of the rows
+            covering the region are read (a view of those bytes when mmapped) and only the region is unpacked and debayered """
+        return self.read_rois(file_handle, [index], x, y, width, height, mode = mode)[0]
+
+    def read_rois(self, file_handle, frames, x: int, y: int, width: int, height: int, out: np.array = None, mode: str = 'gray') -> np.array:
+        """ Decodes the same region of interest of several frames into a uint16 stack, (N, height, width) for the default 'gray' mode
+            frames is a slice or a sequence of frame indices, out is an optional preallocated stack to decode into, see read_roi """
+        (rows, columns, crop, plan) = self.__roi_window(x, y, width, height, mode)
+        stride = self.decode_plan_for('raw').stride
+
+        if isinstance(frames, slice):
+            frames = range(*frames.indices(self.frame_count()))
+
+        shape = (len(frames), height, width) + plan.output_shape[2:]
+        if out is None:
+            out = np.empty(shape, np.uint16)
+        assert out.shape == shape and out.dtype == np.uint16, f'out must be uint16 of shape {shape}'
+        if len(frames) == 0:
+            return out
+
+        # Rows are read whole (apart from the first and last) with one read per frame, a partial row read would be a read per row
+        raw = np.empty((len(frames), rows.stop - rows.start, stride), np.uint8)
+        start = rows.start * stride + columns.start
+        length = (rows.stop - rows.start - 1) * stride + (columns.stop - columns.start)
+        for (i, index) in enumerate(frames):
+            if self.compression is not None:
+                np.copyto(raw[i, :, columns], self.__frame_image(file_handle, index)[rows, columns])
+                continue
+            (offset, data_length) = self.__frame_data_location(file_handle, index)
+            assert start + length <= data_length, 'Frame truncated'
+            if self.__mmap is not None:
+                image = np.frombuffer(self.__mmap, np.uint8, count = data_length, offset = offset).reshape(-1, stride)
+                np.copyto(raw[i, :, columns], image[rows, columns])
+            else:
+                with self.__file_lock:
+                    file_handle.seek(offset + start, 0)
+                    file_handle.readinto(memoryview(raw[i].reshape(-1)[columns.start:columns.start + length]))
+
+        image = plan.decode(raw[:, :, columns])
+        np.copyto(out, image[(slice(None),) + crop])
+        return out
+
+    def frame_headers(self, file_handle) -> np.ndarray:
+        """ Returns the headers of all frames as a structured array of RavfFrame.HEADER_DTYPE without reading any image data, read once and kept.
+            When mmapped and the frames are evenly spaced (they normally are), the headers are copied out through a single strided view """
+        if self.__frame_headers is None:
+            offsets = self.index.offsets()
+            length = RavfFrame.RAVF_HEADER_NO_PADDING_LENGTH
+            steps = np.diff(offsets)
+            if self.__mmap is not None and len(offsets) > 0 and (len(steps) == 0 or np.all(steps == steps[0])):
+                step = int(steps[0]) if len(steps) else length
+                headers = np.ndarray((len(offsets),), RavfFrame.HEADER_DTYPE, buffer = self.__mmap, offset = int(offsets[0]), strides = (step,)).copy()
+            elif self.__mmap is not None:
+                headers = np.frombuffer(self.__mmap, np.uint8)[offsets.astype(np.int64)[:, None] + np.arange(length)].view(RavfFrame.HEADER_DTYPE)[:, 0]
+            else:
+                data = np.empty((len(offsets), length), np.uint8)
+                with self.__file_lock:
+                    for (i, offset) in enumerate(offsets):
+                        file_handle.seek(int(offset), 0)
+                        file_handle.readinto(data[i])
+                headers = data.view(RavfFrame.HEADER_DTYPE)[:, 0]
+
+            assert np.all(headers['magic'] == RavfFrame.RAVF_MAGIC), 'Magic number mismatch'
+            headers.flags.writeable = False
+            self.__frame_headers = headers
+        return self.__frame_headers
+
+    def read_frames(self, file_handle, frames, out: np.array = None, mode: str = 'gray', calibrated: bool = True) -> np.array:
+        """ Decodes several frames into a uint16 stack, (N, height, width) for the default 'gray' mode, which is the same
+            mono format as getPymovieMainImageAndStatusData, see RavfDecodeRegistry for other output modes
+            frames is a slice or a sequence of frame indices, out is an optional preallocated stack to decode into
+            If calibrated is False, the calibration (see set_calibration) isn't applied """
+        plan = self.decode_plan_for(mode, calibrated)
+        (height, stride) = (plan.height, plan.stride)
+        instrumentation = RavfInstrumentation.active
+        if instrumentation is not None:
+            started = time.perf_counter()
+
+        if isinstance(frames, slice):
+            frames = range(*frames.indices(self.frame_count()))
+
+        shape = (len(frames),) + plan.output_shape
+        if out is None:
+            out = np.empty(shape, np.uint16)
+        assert out.shape == shape and out.dtype == np.uint16, f'out must be uint16 of shape {shape}'
+        if len(frames) == 0:
+            return out		# Empty stacks don't have the contiguous rows the unpack functions need
+
+        # Read the raw frames into one contiguous buffer so the unpacking is vectorized across the whole stack
+        raw = np.empty((len(frames), height, stride), np.uint8)
+        for (i, index) in enumerate(frames):
+            ind = self.index.item(index)
+            if self.compression is not None:
+                np.copyto(raw[i], self.__frame_image(file_handle, index))
+            elif self.__mmap is not None:
+                np.copyto(raw[i], RavfImageUtils.bytes_to_np_array(RavfFrame.deserialize_from_buffer(self.__mmap, ind[0]).data, stride, height))
+            else:
+                with self.__file_lock:
+                    file_handle.seek(ind[0], 0)
+                    RavfFrame.deserialize_into(file_handle, raw[i])
+
+        out = plan.decode(raw, out)
+        if instrumentation is not None:
+            instrumentation.record('read.frames', time.perf_counter() - started, raw.nbytes)
+        return out
 
     """ Returns err, image, frameInfo, status for pymovie in mono format"""
     def getPymovieMainImageAndStatusData(self, file_handle, frame_to_show):
-        stride = self.metadata_value('IMAGE-ROW-STRIDE')
-        height = self.metadata_value('IMAGE-HEIGHT')
-        width = self.metadata_value('IMAGE-WIDTH')
-        format = self.metadata_value('IMAGE-FORMAT')
+        if self.cache is None:
+            return self.__pymovie_main_image_and_status_data(file_handle, frame_to_show)
 
-        frame = self.frame_by_index(file_handle, frame_to_show)
+        # Cached images are shared between callers so are made read only, the dicts are copied as they're cheap
+        key = (frame_to_show, 'pymovie')
+        cached = self.cache.get(key)
+        if cached is None:
+            cached = self.__pymovie_main_image_and_status_data(file_handle, frame_to_show)
+            cached[1].flags.writeable = False
+            self.cache.put(key, cached, cached[1].nbytes)
+        (err, image, frameInfo, status) = cached
+        return (err, image, dict(frameInfo), dict(status))
 
-        if self.metadata_value('IMAGE-FORMAT') == RavfImageFormat.FORMAT_PACKED_10BIT.value:
-            #print('Found 10bit packed')
-            image = RavfImageUtils.bytes_to_np_array(frame.data, stride, height)
-            image = RavfImageUtils.unstride_10bit(image, width, height)
-            image = RavfImageUtils.unpack_10bit_pigsc(image, width, height, stride)
-            image = RavfImageUtils.scale_10_to_16bit(image)
-            if self.metadata_value('COLOR-TYPE') != RavfColorType.MONO.value:
-               image = RavfImageUtils.debayer_BGGR_to_GRAY(image)
-        elif self.metadata_value('IMAGE-FORMAT') == RavfImageFormat.FORMAT_PACKED_12BIT.value:
-            #print('Found 12bit packed')
-            image = RavfImageUtils.bytes_to_np_array(frame.data, stride, height)
-            image = RavfImageUtils.unstride_12bit(image, width, height)
-            image = RavfImageUtils.unpack_12bit_pihq(image, width, height, stride)
-            image = RavfImageUtils.scale_12_to_16bit(image)
-            image = RavfImageUtils.debayer_BGGR_to_GRAY(image)
-        elif self.metadata_value('IMAGE-FORMAT') == RavfImageFormat.FORMAT_UNPACKED_12BIT.value:
-            #print('Found 12bit unpacked')
-            image = RavfImageUtils.bytes_to_np_array_16bit(frame.data, stride, height)
-            image = RavfImageUtils.unstride_16bit(image, width, height)
-            image = RavfImageUtils.scale_12_to_16bit(image)
-            image = RavfImageUtils.debayer_BGGR_to_GRAY(image)
-        elif self.metadata_value('IMAGE-FORMAT') == RavfImageFormat.FORMAT_UNPACKED_10BIT.value:
-            #print('Found 10bit unpacked')
-            image = RavfImageUtils.bytes_to_np_array_16bit(frame.data, stride, height)
-            image = RavfImageUtils.unstride_16bit(image, width, height)
-            image = RavfImageUtils.scale_10_to_16bit(image)
-            image = RavfImageUtils.debayer_GBRG_to_GRAY(image)
-        elif self.metadata_value('IMAGE-FORMAT') == RavfImageFormat.FORMAT_16BIT.value:
-            #print('Found 16bit')
-            image = RavfImageUtils.bytes_to_np_array_16bit(frame.data, stride, height)
-        else:
+    def __pymovie_main_image_and_status_data(self, file_handle, frame_to_show):
+        plan = self.decode_plan
+        if plan is None:
             raise ValueError('Unrecognized image type')
+        instrumentation = RavfInstrumentation.active
+        if instrumentation is not None:
+            started = time.perf_counter()
+
+        frame = self.frame_by_index(file_handle, frame_to_show)
+
+        image = RavfImageUtils.bytes_to_np_array(frame.data, plan.stride, plan.height)
+        image = plan.decode(image)
 
         frameInfo = {}
         ts = frame.start_timestamp_as_str()
@@ -96,5 +445,104 @@ class RavfReader:
         }
 
         err = 0 
+        if instrumentation is not None:
+            instrumentation.record('read.pymovie', time.perf_counter() - started, len(frame.data))
 
         return (err, image, frameInfo, status)
+
+    def imap_frames(self, file_handle, func, tasks, processes: int = None, prefetch: int = 2):
+        """ Generator yielding func(reader, file_handle, task) for each of tasks in order, run on a pool of worker processes
+
+            Each worker opens the file itself by file_handle.name, with this reader's options and calibration, and keeps its
+            reader for all the tasks it's given. func and the tasks must be picklable (func a module level function or a
+            functools.partial of one) unless processes is 1, when they're run in this process with this reader. At most
+            prefetch tasks per process are in flight, so results can be consumed as they arrive without piling up """
+        tasks = list(tasks)
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if processes <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield func(self, file_handle, task)
+            return
+
+        initargs = (file_handle.name, self.__mmap is not None, self.recovered, self.calibration)
+        with ProcessPoolExecutor(max_workers = processes, initializer = _open_pool_worker, initargs = initargs) as executor:
+            pending = deque()
+            try:
+                for task in tasks:
+                    pending.append(executor.submit(_run_in_pool_worker, func, task))
+                    if len(pending) >= max(1, prefetch) * processes:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # If the caller stops early, don't run tasks whose results will never be used
+                for future in pending:
+                    future.cancel()
+
+    def map_frames(self, file_handle, func, ranges = None, processes: int = None, shape: tuple = (), dtype = np.float64, chunk_frames: int = 256) -> np.ndarray:
+        """ Runs func over frames in parallel worker processes and returns the results as one array of (frames,) + shape of dtype
+
+            func(reader, file_handle, frames) is called with a range of consecutive frame indices and returns an array like of
+            (len(frames),) + shape, it must be picklable (a module level function) unless processes is 1. ranges is a list of
+            (start, stop) frame ranges (all frames if None), results are in the order of ranges. Ranges are split into chunks of
+            chunk_frames run with imap_frames, each worker writes its results straight into a multiprocessing.shared_memory
+            array, so only chunk indices pass between processes """
+        if ranges is None:
+            ranges = [(0, self.frame_count())]
+        chunks = []
+        for (start, stop) in ranges:
+            (start, stop, _) = slice(start, stop).indices(self.frame_count())
+            chunks += [(first, min(first + chunk_frames, stop)) for first in range(start, stop, chunk_frames)]
+
+        positions = np.cumsum([0] + [stop - start for (start, stop) in chunks])
+        tasks = [(start, stop, int(position)) for ((start, stop), position) in zip(chunks, positions)]
+        shape = (int(positions[-1]),) + tuple(shape)
+
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if processes <= 1 or len(tasks) <= 1:
+            results = np.empty(shape, dtype)
+            for (start, stop, position) in tasks:
+                results[position:position + stop - start] = func(self, file_handle, range(start, stop))
+            return results
+
+        from multiprocessing import shared_memory	# Python 3.8+
+        results = np.empty(shape, dtype)
+        shared = shared_memory.SharedMemory(create = True, size = max(1, results.nbytes))
+        try:
+            for _ in self.imap_frames(file_handle, partial(_map_chunk, func, shared.name, shape, results.dtype), tasks, processes):
+                pass
+            np.copyto(results, np.ndarray(shape, dtype, buffer = shared.buf))
+        finally:
+            shared.close()
+            shared.unlink()
+        return results
+
+
+# The reader of an imap_frames worker process, opened once and kept for all the tasks it's given
+_pool_worker = None
+
+def _open_pool_worker(file_name: str, use_mmap: bool, recover: bool, calibration):
+    global _pool_worker
+    file_handle = open(file_name, 'rb')
+    reader = RavfReader(file_handle, use_mmap = use_mmap, recover = recover)
+    if calibration is not None:
+        reader.set_calibration(calibration)
+    _pool_worker = (reader, file_handle)
+
+def _run_in_pool_worker(func, task):
+    (reader, file_handle) = _pool_worker
+    return func(reader, file_handle, task)
+
+def _map_chunk(func, shared_name: str, shape: tuple, dtype, reader: RavfReader, file_handle, task: tuple) -> int:
+    from multiprocessing import shared_memory
+    (start, stop, position) = task
+    shared = shared_memory.SharedMemory(name = shared_name)
+    try:
+        results = np.ndarray(shape, dtype, buffer = shared.buf)
+        results[position:position + stop - start] = func(reader, file_handle, range(start, stop))
+        del results		# The buffer can't be closed while a view of it exists
+    finally:
+        shared.close()
+    return stop - start
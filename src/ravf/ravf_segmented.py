@@ -0,0 +1,260 @@
+import os
+import re
+import glob
+import threading
+import numpy as np
+from .metadata_entry import UTF8String, RavfMetadataType
+from .ravf_frame import RavfFrame, RavfFrameType
+from .ravf_index import RavfIndex
+from .ravf_reader import RavfReader, RavfReaderBase
+from .ravf_writer import RavfWriter
+
+class RavfSegmentedWriter:
+    """Writes a recording as a series of complete RAVF files (segments), rolling over to the next segment before a segment
+    would exceed max_bytes (by default just under the 4 GB FAT32 file size limit), max_frames frames or max_seconds of
+    recording time (from frame start timestamps). Finished segments can be copied while the recording continues.
+
+    Segments are named by segment_name(base_name, n) and record their number in the SEGMENT-NUMBER user metadata entry,
+    every segment has the same metadata otherwise. The next segment is opened and its header written on a background
+    thread ahead of time, and the finished segment's index is written on it too, so a rollover in write_frame is only a
+    swap of file handles. writer_kwargs (e.g. checkpoint_frames, frame_stats) are passed to the RavfWriter of each segment,
+    which is quiet (see RavfWriter) unless quiet = False is passed"""
+
+    MAX_BYTES_FAT32 = 4 * 1024 * 1024 * 1024 - 1
+    INDEX_ENTRY_LENGTH = RavfIndex.INDEX_DTYPE.itemsize
+
+    def __init__(self, base_name: str, required_metadata_entries: list((UTF8String, object)), user_metadata_entries: list((UTF8String, RavfMetadataType, object)), max_bytes: int = MAX_BYTES_FAT32, max_frames: int = 0, max_seconds: float = 0, **writer_kwargs):
+        self.base_name = base_name
+        self.max_bytes = max_bytes
+        self.max_frames = max_frames
+        self.max_seconds = max_seconds
+        self.__entries = (required_metadata_entries, user_metadata_entries)
+        self.__writer_kwargs = {'quiet': True, **writer_kwargs}	# Segments are opened and finished on a background thread
+
+        self.segment_names = []
+        self.frame_count = 0
+        self.__error = None
+        self.__segment = self.__open_segment(0)
+        self.__next = None
+        self.__thread = None
+        self.__start_background(None, 1)
+
+    @classmethod
+    def segment_name(cls, base_name: str, number: int) -> str:
+        """Returns the file name of segment number of base_name, e.g. night.ravf -> night.000.ravf"""
+        (root, ext) = os.path.splitext(base_name)
+        return f'{root}.{number:03d}{ext}'
+
+    @classmethod
+    def segment_names_for(cls, base_name: str) -> list:
+        """Returns the file names of the existing segments of base_name in order"""
+        (root, ext) = os.path.splitext(base_name)
+        pattern = re.compile(re.escape(root) + r'\.(\d{3,})' + re.escape(ext) + '$')
+        numbered = []
+        for name in glob.glob(glob.escape(root) + '.*' + glob.escape(ext)):
+            match = pattern.match(name)
+            if match is not None:
+                numbered.append((int(match.group(1)), name))
+        return [name for (number, name) in sorted(numbered)]
+
+    def __open_segment(self, number: int) -> list:
+        """Returns [number, file_handle, writer, bytes, frames, first start timestamp] of a new segment with its header written"""
+        (required_entries, user_entries) = self.__entries
+        file_name = self.segment_name(self.base_name, number)
+        file_handle = open(file_name, 'wb+')
+        try:
+            writer = RavfWriter(file_handle, required_entries, list(user_entries) + [('SEGMENT-NUMBER', RavfMetadataType.UINT32, number)], **self.__writer_kwargs)
+        except Exception:
+            file_handle.close()
+            os.remove(file_name)
+            raise
+        return [number, file_handle, writer, file_handle.tell(), 0, None]
+
+    def __close_segment(self, segment: list):
+        (number, file_handle, writer) = segment[:3]
+        writer.finish(file_handle)
+        file_handle.close()
+        self.segment_names.append(self.segment_name(self.base_name, number))
+
+    def __background(self, finished: list, number: int):
+        try:
+            if finished is not None:
+                self.__close_segment(finished)
+            self.__next = self.__open_segment(number)
+        except Exception as e:
+            self.__error = e	# Reported on the next rollover or finish
+
+    def __start_background(self, finished: list, number: int):
+        self.__thread = threading.Thread(target = self.__background, args = (finished, number), name = 'RavfSegmentedWriter', daemon = True)
+        self.__thread.start()
+
+    def __join_background(self):
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        if self.__error is not None:
+            raise RuntimeError('RavfSegmentedWriter failed to finish or open a segment') from self.__error
+
+    def __needs_rollover(self, length: int, start_timestamp: int) -> bool:
+        (number, file_handle, writer, size, frames, first_timestamp) = self.__segment
+        if frames == 0:
+            return False	# A segment always gets at least one frame
+        if self.max_frames and frames >= self.max_frames:
+            return True
+        if self.max_seconds and start_timestamp - first_timestamp >= self.max_seconds * 1e9:
+            return True
+        # Size of the segment once this frame and the index, which grows with it, are written
+        return size + RavfFrame.RAVF_HEADER_LENGTH + length + 4 + (frames + 1) * self.INDEX_ENTRY_LENGTH > self.max_bytes
+
+    def __rollover(self):
+        self.__join_background()
+        (finished, self.__segment, self.__next) = (self.__segment, self.__next, None)
+        self.__start_background(finished, self.__segment[0] + 1)
+
+    def write_frame(self, frame_type: RavfFrameType, data: bytes, start_timestamp: int, exposure_duration: int, satellites: int, almanac_status: int, almanac_offset: int, satellite_fix_status: int, sequence: int):
+        """Writes a frame to the current segment, or the next one if the frame would take the current one over a threshold"""
+        length = memoryview(data).nbytes
+        if self.__needs_rollover(length, start_timestamp):
+            self.__rollover()
+
+        segment = self.__segment
+        segment[2].write_frame(segment[1], frame_type, data, start_timestamp, exposure_duration, satellites, almanac_status, almanac_offset, satellite_fix_status, sequence)
+        segment[3] += RavfFrame.RAVF_HEADER_LENGTH + length
+        segment[4] += 1
+        if segment[5] is None:
+            segment[5] = start_timestamp
+        self.frame_count += 1
+
+    def segment_number(self) -> int:
+        """Returns the number of the segment currently being written"""
+        return self.__segment[0]
+
+    def finish(self) -> list:
+        """Finishes the current segment and removes the preopened next one, returns the file names of all the segments"""
+        self.__join_background()
+        self.__close_segment(self.__segment)
+        if self.__next is not None:
+            (number, file_handle) = self.__next[:2]
+            file_handle.close()
+            os.remove(self.segment_name(self.base_name, number))
+            self.__next = None
+        return self.segment_names
+
+
+class RavfSegmentedReader(RavfReaderBase):
+    """Reads the segments of a recording (see RavfSegmentedWriter) as one, with the RavfReader interface: frame indices,
+    timestamps and frame headers run across all the segments in order. Each segment is opened with its own RavfReader
+    (self.readers) and file handle, the file_handle argument of the RavfReader methods is accepted for compatibility
+    and ignored (None can be passed). The metadata is that of the first segment"""
+
+    GEOMETRY_ENTRIES = ('COLOR-TYPE', 'IMAGE-ENDIANESS', 'IMAGE-WIDTH', 'IMAGE-HEIGHT', 'IMAGE-ROW-STRIDE', 'IMAGE-FORMAT')
+
+    def __init__(self, file_names: list, use_mmap: bool = False, cache_bytes: int = 0, recover: bool = False):
+        """file_names are the segments in order, cache_bytes is per segment, recover is passed to each RavfReader"""
+        if len(file_names) == 0:
+            raise ValueError('No segments')
+        self.file_names = list(file_names)
+        self.file_handles = []
+        self.readers = []
+        try:
+            for file_name in self.file_names:
+                file_handle = open(file_name, 'rb')
+                self.file_handles.append(file_handle)
+                self.readers.append(RavfReader(file_handle, use_mmap = use_mmap, cache_bytes = cache_bytes, recover = recover))
+        except Exception:
+            self.close()
+            raise
+
+        first = self.readers[0]
+        for (file_name, reader) in zip(self.file_names[1:], self.readers[1:]):
+            for name in self.GEOMETRY_ENTRIES:
+                if reader.metadata_value(name) != first.metadata_value(name):
+                    raise ValueError(f'{file_name}: {name} differs from the first segment')
+
+        self.header = first.header
+        self.decode_plan = first.decode_plan
+        self.starts = np.cumsum([0] + [reader.frame_count() for reader in self.readers])	# First frame of each segment, and the frame count
+        self.index = RavfIndex.from_frames(np.concatenate([reader.index.frames() for reader in self.readers]))	# Offsets are within each segment
+        self.__frame_headers = None
+
+    @classmethod
+    def open(cls, base_name: str, **kwargs) -> object:
+        """Opens all the existing segments of base_name"""
+        file_names = RavfSegmentedWriter.segment_names_for(base_name)
+        if len(file_names) == 0:
+            raise FileNotFoundError(f'No segments of {base_name}')
+        return cls(file_names, **kwargs)
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+        for file_handle in self.file_handles:
+            file_handle.close()
+        self.readers = []
+        self.file_handles = []
+
+    def segment_for(self, index: int) -> (int, int):
+        """Returns (segment, frame index within the segment) of frame index"""
+        count = self.frame_count()
+        if index < 0:
+            index += count
+        if index < 0 or index >= count:
+            raise IndexError('index out of range')
+        segment = int(np.searchsorted(self.starts, index, side = 'right')) - 1
+        return (segment, index - int(self.starts[segment]))
+
+    def decode_plan_for(self, mode: str = 'gray', calibrated: bool = True):
+        return self.readers[0].decode_plan_for(mode, calibrated)
+
+    def set_calibration(self, calibration):
+        for reader in self.readers:
+            reader.set_calibration(calibration)
+        self.decode_plan = self.readers[0].decode_plan
+
+    def frame_by_index(self, file_handle, index) -> (RavfFrame):
+        (segment, index) = self.segment_for(index)
+        return self.readers[segment].frame_by_index(self.file_handles[segment], index)
+
+    def frame_headers(self, file_handle = None) -> np.ndarray:
+        """ Returns the headers of all frames of all segments as a structured array of RavfFrame.HEADER_DTYPE, see RavfReader.frame_headers """
+        if self.__frame_headers is None:
+            headers = np.concatenate([reader.frame_headers(fh) for (reader, fh) in zip(self.readers, self.file_handles)])
+            headers.flags.writeable = False
+            self.__frame_headers = headers
+        return self.__frame_headers
+
+    def read_frames(self, file_handle, frames, out: np.array = None, mode: str = 'gray', calibrated: bool = True) -> np.array:
+        """ Decodes several frames into a uint16 stack, see RavfReader.read_frames, runs of frames in the same segment are decoded together """
+        if isinstance(frames, slice):
+            frames = range(*frames.indices(self.frame_count()))
+        frames = np.asarray(frames, np.int64)
+        frames = np.where(frames < 0, frames + self.frame_count(), frames)
+        if len(frames) and (frames.min() < 0 or frames.max() >= self.frame_count()):
+            raise IndexError('index out of range')
+
+        shape = (len(frames),) + self.decode_plan_for(mode).output_shape
+        if out is None:
+            out = np.empty(shape, np.uint16)
+        assert out.shape == shape and out.dtype == np.uint16, f'out must be uint16 of shape {shape}'
+        if len(frames) == 0:
+            return out
+
+        segments = np.searchsorted(self.starts, frames, side = 'right') - 1
+        breaks = np.flatnonzero(np.diff(segments)) + 1
+        for (start, stop) in zip(np.concatenate(([0], breaks)), np.concatenate((breaks, [len(frames)]))):
+            segment = int(segments[start])
+            self.readers[segment].read_frames(self.file_handles[segment], frames[start:stop] - self.starts[segment], out[start:stop], mode, calibrated)
+        return out
+
+    def read_roi(self, file_handle, index: int, x: int, y: int, width: int, height: int, mode: str = 'gray') -> np.array:
+        (segment, index) = self.segment_for(index)
+        return self.readers[segment].read_roi(self.file_handles[segment], index, x, y, width, height, mode)
+
+    def read_preview(self, file_handle, index: int, scale: int = 4) -> np.array:
+        (segment, index) = self.segment_for(index)
+        return self.readers[segment].read_preview(self.file_handles[segment], index, scale)
+
+    """ Returns err, image, frameInfo, status for pymovie in mono format"""
+    def getPymovieMainImageAndStatusData(self, file_handle, frame_to_show):
+        (segment, index) = self.segment_for(frame_to_show)
+        return self.readers[segment].getPymovieMainImageAndStatusData(self.file_handles[segment], index)
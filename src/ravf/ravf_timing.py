@@ -0,0 +1,110 @@
+import numpy as np
+
+class RavfTimingAnalyzer:
+    """Audits the timing integrity of a recording from its frame headers alone (see RavfReader.frame_headers), no image data is read.
+
+    Reports dropped frames (gaps in the frame sequence), timestamp jitter relative to the nominal frame interval, exposure
+    anomalies and runs of frames without a GPS time fix, all vectorized over the whole recording"""
+
+    GAPS_DTYPE = np.dtype([('index', '<i8'), ('sequence', '<u4'), ('missing', '<i8')])	# Frame after the gap, its sequence, frames missing (< 0 if the sequence went backwards)
+    RUNS_DTYPE = np.dtype([('start', '<i8'), ('stop', '<i8')])	# Frame ranges, stop is exclusive
+
+    TIME_FIX = 2	# satellite_fix_status of a time fix or better, 0 = no fix, 1 = internal time keeping after a previous fix
+
+    def __init__(self, headers: np.ndarray, timing_accuracy: int = 0):
+        """headers is a structured array of RavfFrame.HEADER_DTYPE, timing_accuracy is FRAME-TIMING-ACCURACY in ns"""
+        self.headers = headers
+        self.timing_accuracy = timing_accuracy
+
+    @classmethod
+    def for_reader(cls, reader, file_handle) -> object:
+        return cls(reader.frame_headers(file_handle), reader.metadata_value('FRAME-TIMING-ACCURACY') or 0)
+
+    @classmethod
+    def runs(cls, mask: np.ndarray) -> np.ndarray:
+        """Returns the (start, stop) ranges of consecutive True values of mask"""
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+        runs = np.empty(len(edges) // 2, cls.RUNS_DTYPE)
+        (runs['start'], runs['stop']) = (edges[0::2], edges[1::2])
+        return runs
+
+    def sequence_steps(self) -> np.ndarray:
+        """Returns the sequence number increment from the previous frame for every frame after the first (1 normally)"""
+        return np.diff(self.headers['sequence'].astype(np.int64))
+
+    def dropped_frames(self) -> np.ndarray:
+        """Returns a GAPS_DTYPE array of every point the sequence number doesn't increment by 1"""
+        steps = self.sequence_steps()
+        where = np.flatnonzero(steps != 1)
+        gaps = np.empty(len(where), self.GAPS_DTYPE)
+        gaps['index'] = where + 1
+        gaps['sequence'] = self.headers['sequence'][where + 1]
+        gaps['missing'] = steps[where] - 1
+        return gaps
+
+    def intervals(self) -> np.ndarray:
+        """Returns the start timestamp differences between consecutive frames in ns"""
+        return np.diff(self.headers['start_timestamp'].astype(np.int64))
+
+    def nominal_interval(self) -> float:
+        """Returns the median interval between consecutive frames where no frames were dropped"""
+        intervals = self.intervals()[self.sequence_steps() == 1]
+        return float(np.median(intervals)) if len(intervals) else 0.0
+
+    def jitter(self) -> np.ndarray:
+        """Returns, for every frame after the first, its start timestamp error in ns relative to the nominal interval after
+        the previous frame, dropped frames are allowed for (NaN where the sequence didn't increase)"""
+        steps = self.sequence_steps()
+        jitter = self.intervals() - self.nominal_interval() * steps
+        return np.where(steps > 0, jitter, np.nan)
+
+    def jitter_frames(self, tolerance: float = None) -> np.ndarray:
+        """Returns the indices of frames whose jitter exceeds tolerance ns, by default the larger of FRAME-TIMING-ACCURACY
+        and 10% of the nominal interval"""
+        if tolerance is None:
+            tolerance = max(self.timing_accuracy, 0.1 * self.nominal_interval())
+        with np.errstate(invalid = 'ignore'):
+            return np.flatnonzero(np.abs(self.jitter()) > tolerance) + 1
+
+    def exposure_anomalies(self, tolerance: float = 0.01) -> np.ndarray:
+        """Returns the indices of frames whose exposure differs from the median exposure by more than tolerance (a fraction),
+        or that are longer than the nominal frame interval"""
+        exposures = self.headers['exposure_duration'].astype(np.float64)
+        if len(exposures) == 0:
+            return np.empty(0, np.int64)
+        median = np.median(exposures)
+        anomalous = np.abs(exposures - median) > tolerance * median
+        nominal = self.nominal_interval()
+        if nominal > 0:
+            anomalous |= exposures > nominal * (1 + tolerance)
+        return np.flatnonzero(anomalous)
+
+    def fix_losses(self) -> np.ndarray:
+        """Returns the runs of frames without a GPS time fix (satellite_fix_status < TIME_FIX)"""
+        return self.runs(self.headers['satellite_fix_status'] < self.TIME_FIX)
+
+    def almanac_uncertain(self) -> np.ndarray:
+        """Returns the runs of frames where the leap second correction to UTC was uncertain"""
+        return self.runs(self.headers['almanac_status'] != 0)
+
+    def report(self) -> dict:
+        """Summarizes the timing integrity of the recording"""
+        gaps = self.dropped_frames()
+        jitter = self.jitter()
+        jitter = jitter[~np.isnan(jitter)]
+        fix_losses = self.fix_losses()
+        return {
+            'frames': len(self.headers),
+            'dropped_frames': int(gaps['missing'][gaps['missing'] > 0].sum()),
+            'sequence_gaps': int(np.count_nonzero(gaps['missing'] > 0)),
+            'sequence_resets': int(np.count_nonzero(gaps['missing'] < 0)),
+            'nominal_interval_ns': self.nominal_interval(),
+            'jitter_rms_ns': float(np.sqrt(np.mean(np.square(jitter)))) if len(jitter) else 0.0,
+            'jitter_max_ns': float(np.max(np.abs(jitter))) if len(jitter) else 0.0,
+            'jitter_frames': len(self.jitter_frames()),
+            'exposure_anomalies': len(self.exposure_anomalies()),
+            'fix_losses': len(fix_losses),
+            'frames_without_fix': int((fix_losses['stop'] - fix_losses['start']).sum()),
+            'almanac_uncertain_frames': int(np.count_nonzero(self.headers['almanac_status'] != 0)),
+            'min_satellites': int(self.headers['satellites'].min()) if len(self.headers) else 0,
+        }
@@ -0,0 +1,72 @@
+import io
+import os
+import time
+import contextlib
+from functools import partial
+from .ravf_frame import RavfFrameType
+from .ravf_reader import RavfReader
+from .ravf_writer import RavfWriter
+from .ravf_compression import RavfCompression, RavfCompressionType
+
+class RavfTranscoder:
+    """Offline transcoding of a RAVF file into a compressed RAVF file (or back, with RavfCompressionType.NONE) for archiving.
+
+    Frames are compressed in batches on a pool of worker processes (see RavfReader.imap_frames), and written in
+    order with their original frame headers. All metadata is kept, the compression is recorded in the IMAGE-COMPRESSION
+    and IMAGE-SHUFFLE user metadata entries, see RavfCompression. RavfReader decompresses frames transparently"""
+
+    COMPRESSION_ENTRIES = ('IMAGE-COMPRESSION', 'IMAGE-SHUFFLE')
+
+    @classmethod
+    def transcode(cls, source_name: str, destination_name: str, compression_type: RavfCompressionType = RavfCompressionType.ZLIB, level: int = None, shuffle: bool = True, processes: int = None, batch_frames: int = 16) -> dict:
+        """Transcodes source_name to destination_name, shuffle byte-plane shuffles each packing group (e.g. 2 bytes for 16-bit formats,
+        5 for packed 10-bit) before compressing. Returns {'frames', 'source_bytes', 'destination_bytes', 'ratio', 'seconds', 'frames_per_second'}"""
+        started = time.perf_counter()
+        if processes is None:
+            processes = os.cpu_count() or 1
+
+        with open(source_name, 'rb') as source, open(destination_name, 'wb+') as destination:
+            reader = RavfReader(source, use_mmap = True)
+            group_bytes = reader.decode_plan_for('raw').packing()[1]
+            compression = RavfCompression(compression_type, group_bytes if shuffle and group_bytes > 1 and compression_type != RavfCompressionType.NONE else 0, level)
+
+            with contextlib.redirect_stdout(io.StringIO()):		# RavfWriter prints the header
+                writer = RavfWriter(destination, *cls.__writer_entries(reader, compression))
+            headers = reader.frame_headers(source)
+
+            batches = [(start, min(start + batch_frames, len(headers))) for start in range(0, len(headers), batch_frames)]
+            compressed = reader.imap_frames(source, partial(_compress_frames, compression), batches, processes)
+            for ((start, stop), frames) in zip(batches, compressed):
+                for (i, data) in enumerate(frames, start):
+                    header = headers[i]
+                    writer.write_frame(destination, RavfFrameType(int(header['frame_type'])), data, int(header['start_timestamp']), int(header['exposure_duration']), int(header['satellites']), int(header['almanac_status']), int(header['almanac_offset']), int(header['satellite_fix_status']), int(header['sequence']))
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                writer.finish(destination)
+            reader.close()
+
+        seconds = time.perf_counter() - started
+        (source_bytes, destination_bytes) = (os.path.getsize(source_name), os.path.getsize(destination_name))
+        return {'frames': len(headers), 'source_bytes': source_bytes, 'destination_bytes': destination_bytes, 'ratio': source_bytes / max(1, destination_bytes),
+                'seconds': seconds, 'frames_per_second': len(headers) / seconds if seconds > 0 else 0.0}
+
+    @classmethod
+    def __writer_entries(cls, reader: RavfReader, compression: RavfCompression) -> (list, list):
+        """Returns (required_metadata_entries, user_metadata_entries) for a RavfWriter, copying the source's metadata"""
+        (public_names, private_names) = (set(RavfWriter.public_entry_names()), set(RavfWriter.private_entry_names()))
+        values = dict(reader.metadata())
+        (required_entries, user_entries) = ([], [])
+        for entry in reader.header.entries():
+            name = entry.name.txt
+            if name in public_names:
+                required_entries.append((name, values[name]))
+            elif name not in cls.COMPRESSION_ENTRIES and name not in private_names:
+                user_entries.append((name, entry.entry_type, values[name]))
+        if compression.compression_type != RavfCompressionType.NONE:
+            user_entries += compression.metadata_entries()
+        return (required_entries, user_entries)
+
+
+def _compress_frames(compression: RavfCompression, reader: RavfReader, file_handle, batch: tuple) -> list:
+    (start, stop) = batch
+    return [compression.compress(reader.frame_by_index(file_handle, i).data) for i in range(start, stop)]
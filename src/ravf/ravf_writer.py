@@ -1,7 +1,12 @@
+import io
+import os
+import time
 from .metadata_entry import UTF8String, RavfMetadataEntry, RavfMetadataType, RavfColorType, RavfImageEndianess, RavfImageFormat, RavfEquinox
 from .ravf_header import RavfHeader
 from .ravf_frame import RavfFrame, RavfFrameType
 from .ravf_index import RavfIndex
+from .ravf_frame_stats import RavfFrameStats
+from .ravf_instrumentation import RavfInstrumentation
 
 class RavfWriter:
 
@@ -12,8 +17,9 @@ class RavfWriter:
                  return True
         return False
 
-    def __init__(self, file_handle, required_metadata_entries: list((UTF8String, object)), user_metadata_entries: list((UTF8String, RavfMetadataType, object))):
-
+    @classmethod
+    def __required_entries(cls) -> (list, list):
+        """Returns new (private, public) lists of the required RavfMetadataEntry with their default values"""
         private_required_entries = [
             RavfMetadataEntry('OFFSET-FRAMES',               RavfMetadataType.UINT64, int(0)),
             RavfMetadataEntry('OFFSET-INDEX',                RavfMetadataType.UINT64, int(0)),
@@ -58,6 +64,27 @@ class RavfWriter:
             RavfMetadataEntry('FRAME-TIMING-ACCURACY',       RavfMetadataType.UINT64,     int(0),                                      True),
         ]
 
+        return (private_required_entries, public_required_entries)
+
+    @classmethod
+    def private_entry_names(cls) -> list:
+        """Returns the names of the required entries maintained by the writer"""
+        return [entry.name.txt for entry in cls.__required_entries()[0]]
+
+    @classmethod
+    def public_entry_names(cls) -> list:
+        """Returns the names of the required entries that can be set with required_metadata_entries"""
+        return [entry.name.txt for entry in cls.__required_entries()[1]]
+
+    """If checkpoint_frames or checkpoint_seconds is set, the header is periodically rewritten with the frame count and the file flushed to disk
+       (fsync), so that if the recording is interrupted, RavfReader(..., recover = True) can recover all frames up to the last checkpoint
+       If frame_stats is True, per frame statistics are collected from every stats_row_step'th row of each frame and written
+       to a sidecar by finish(), see RavfFrameStats
+       If quiet is True, the metadata entries and final header aren't printed"""
+    def __init__(self, file_handle, required_metadata_entries: list((UTF8String, object)), user_metadata_entries: list((UTF8String, RavfMetadataType, object)), checkpoint_frames: int = 0, checkpoint_seconds: float = 0, frame_stats: bool = False, stats_row_step: int = 4, quiet: bool = False):
+
+        (private_required_entries, public_required_entries) = self.__required_entries()
+
         # Update the required entries
         for entry in required_metadata_entries:
             # Sanity check on what we're changi9ng
@@ -86,21 +113,87 @@ class RavfWriter:
 
         metadata_entries += user_entries
 
-        print(*metadata_entries, sep='\n')
+        if not quiet:
+            print(*metadata_entries, sep='\n')
+        self.quiet = quiet
 
         self.header = RavfHeader(metadata_entries)
         self.header.write(file_handle)
         self.index = RavfIndex()
 
+        # Hot path state for write_frame, the frame header buffer is reused for every frame
+        self.__frame_header = bytearray(RavfFrame.RAVF_HEADER_LENGTH)
+        self.__offset = file_handle.tell()
+        self.__fd = self.__writev_fd(file_handle)
+
+        self.__checkpoint_frames = checkpoint_frames
+        self.__checkpoint_seconds = checkpoint_seconds
+        self.__frames_since_checkpoint = 0
+        self.__last_checkpoint = time.monotonic()
+
+        self.frame_stats = RavfFrameStats.for_header(self.header, stats_row_step) if frame_stats else None
+
+    @classmethod
+    def __writev_fd(cls, file_handle) -> int:
+        """Returns the file descriptor to write frames to with os.writev, or None if file_handle doesn't have one or writev isn't available"""
+        if not hasattr(os, 'writev'):
+            return None
+        try:
+            return file_handle.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
+
+    """data can be any contiguous buffer (bytes, numpy array, memoryview etc.), it is written without being converted to bytes"""
     def write_frame(self, file_handle, frame_type: RavfFrameType, data: bytes, start_timestamp: int, exposure_duration: int, satellites: int, almanac_status: int, almanac_offset: int, satellite_fix_status: int, sequence: int):
-        offset_frame = file_handle.tell()
-
-        frame = RavfFrame(frame_type, data, start_timestamp, exposure_duration, satellites, almanac_status, almanac_offset, satellite_fix_status, sequence)
-        frame.write(file_handle)
+        offset_frame = self.__offset
+        data = memoryview(data).cast('B')
+        instrumentation = RavfInstrumentation.active
+        if instrumentation is not None:
+            started = time.perf_counter()
+
+        RavfFrame.pack_header_into(self.__frame_header, len(data), frame_type, start_timestamp, exposure_duration, satellites, almanac_status, almanac_offset, satellite_fix_status, sequence)
+        if instrumentation is not None:
+            packed = time.perf_counter()
+            instrumentation.record('write.pack', packed - started)
+
+        if self.__fd is not None:
+            file_handle.flush()		# Nothing should be buffered, but the file object's buffer must precede our writes
+            RavfFrame.writev(self.__fd, self.__frame_header, data)
+        else:
+            file_handle.write(self.__frame_header)
+            file_handle.write(data)
+        self.__offset += len(self.__frame_header) + len(data)
+        if instrumentation is not None:
+            instrumentation.record('write.io', time.perf_counter() - packed, len(self.__frame_header) + len(data))
 
         self.index.add_frame(offset_frame, start_timestamp)
         self.header.increment_frame_count()
 
+        if self.frame_stats is not None:
+            if instrumentation is not None:
+                started = time.perf_counter()
+            self.frame_stats.add(data, start_timestamp, sequence)
+            if instrumentation is not None:
+                instrumentation.record('write.frame_stats', time.perf_counter() - started)
+
+        if self.__checkpoint_frames or self.__checkpoint_seconds:
+            self.__frames_since_checkpoint += 1
+            if (self.__checkpoint_frames and self.__frames_since_checkpoint >= self.__checkpoint_frames) or (self.__checkpoint_seconds and time.monotonic() - self.__last_checkpoint >= self.__checkpoint_seconds):
+                self.checkpoint(file_handle)
+
+    def checkpoint(self, file_handle):
+        """Updates FRAMES-COUNT in the header and forces everything written so far to disk, OFFSET-INDEX remains 0 until finish()"""
+        started = time.perf_counter()
+        self.header.write(file_handle)
+        file_handle.flush()
+        if self.__fd is not None:
+            os.fsync(self.__fd)
+        instrumentation = RavfInstrumentation.active
+        if instrumentation is not None:
+            instrumentation.record('write.checkpoint', time.perf_counter() - started)
+        self.__frames_since_checkpoint = 0
+        self.__last_checkpoint = time.monotonic()
+
     def version(self):
         return self.header.version
 
@@ -109,5 +202,9 @@ class RavfWriter:
         self.header.write(file_handle)
         self.index.write(file_handle)
 
-        print(self.header)
+        if self.frame_stats is not None and hasattr(file_handle, 'name'):
+            self.frame_stats.save(file_handle.name)
+
+        if not self.quiet:
+            print(self.header)
         #print(self.index)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from ravf import RavfReader, RavfWriter, RavfColorType, RavfImageEndianess, RavfImageFormat
+from ravf.ravf_frame import RavfFrameType
+
+FRAME_INTERVAL = 40_000_000		# 25 frames/sec in ns
+DARK_EVERY = 7					# Frames 0, 7, 14... are DARK, the rest LIGHT
+
+MAX_VALUES = {
+    RavfImageFormat.FORMAT_16BIT:          0xFFFF,
+    RavfImageFormat.FORMAT_UNPACKED_10BIT: 0x3FF,
+    RavfImageFormat.FORMAT_UNPACKED_12BIT: 0xFFF,
+}
+
+
+def stride_for(format: RavfImageFormat, width: int, color_type: RavfColorType) -> int:
+    """Rows padded to 32 bytes, as the Pi cameras do"""
+    samples = width * (3 if color_type in (RavfColorType.RGB, RavfColorType.BGR) else 1)
+    row_bytes = {RavfImageFormat.FORMAT_PACKED_10BIT: samples * 5 // 4, RavfImageFormat.FORMAT_PACKED_12BIT: samples * 3 // 2,
+                 RavfImageFormat.FORMAT_8BIT: samples}.get(format, samples * 2)
+    return (row_bytes + 31) // 32 * 32
+
+
+def required_entries(format: RavfImageFormat, color_type: RavfColorType, width: int, height: int, endianess: RavfImageEndianess = RavfImageEndianess.LITTLE_ENDIAN) -> list:
+    return [
+        ('COLOR-TYPE',            color_type.value),
+        ('IMAGE-ENDIANESS',       endianess.value),
+        ('IMAGE-WIDTH',           width),
+        ('IMAGE-HEIGHT',          height),
+        ('IMAGE-ROW-STRIDE',      stride_for(format, width, color_type)),
+        ('IMAGE-FORMAT',          format.value),
+        ('FRAME-TIMING-ACCURACY', 1000),
+    ]
+
+
+def random_frames(format: RavfImageFormat, color_type: RavfColorType, width: int, height: int, count: int, endianess: RavfImageEndianess = RavfImageEndianess.LITTLE_ENDIAN, seed: int = 0) -> list:
+    """Returns count (height, stride) uint8 frames of random pixels, unpacked formats only use their bit depth"""
+    rng = np.random.default_rng(seed)
+    stride = stride_for(format, width, color_type)
+    max_value = MAX_VALUES.get(format)
+    frames = []
+    for i in range(count):
+        if max_value is None:
+            frames.append(rng.integers(0, 256, (height, stride), dtype = np.uint8))
+        else:
+            pixels = rng.integers(0, max_value + 1, (height, stride // 2), dtype = np.uint16)
+            frames.append(pixels.astype('>u2' if endianess == RavfImageEndianess.BIG_ENDIAN else '<u2').view(np.uint8))
+    return frames
+
+
+def frame_type(index: int) -> RavfFrameType:
+    return RavfFrameType.DARK if index % DARK_EVERY == 0 else RavfFrameType.LIGHT
+
+
+def write_frames(writer, file_handle, frames: list):
+    """Writes frames with RavfWriter.write_frame, or RavfSegmentedWriter.write_frame if file_handle is None"""
+    for (i, frame) in enumerate(frames):
+        args = (frame_type(i), frame, (i + 1) * FRAME_INTERVAL, FRAME_INTERVAL // 2, 8, 0, 0, 3, i)
+        if file_handle is None:
+            writer.write_frame(*args)
+        else:
+            writer.write_frame(file_handle, *args)
+
+
+def check_round_trip(file_name: str, frames: list, use_mmap: bool):
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle, use_mmap = use_mmap)
+        assert reader.frame_count() == len(frames)
+        assert np.array_equal(reader.timestamps(), (np.arange(len(frames)) + 1) * FRAME_INTERVAL)
+        assert np.array_equal(reader.frame_sequences(file_handle), np.arange(len(frames)))
+        assert list(reader.frames_of_type(file_handle, RavfFrameType.DARK)) == [i for i in range(len(frames)) if frame_type(i) == RavfFrameType.DARK]
+        for (i, data) in enumerate(frames):
+            frame = reader.frame_by_index(file_handle, i)
+            assert (frame.frame_type, frame.start_timestamp, frame.sequence) == (frame_type(i).value, (i + 1) * FRAME_INTERVAL, i)
+            assert bytes(frame.data) == data.tobytes()
+        reader.close()
+
+
+@pytest.fixture
+def recording(tmp_path):
+    """Returns a function writing a recording of random frames with writer_class (RavfWriter by default),
+    which returns (file name, the frames written)"""
+    def write(format: RavfImageFormat = RavfImageFormat.FORMAT_PACKED_10BIT, color_type: RavfColorType = RavfColorType.BAYER_BGGR,
+              width: int = 64, height: int = 48, count: int = 20, endianess: RavfImageEndianess = RavfImageEndianess.LITTLE_ENDIAN,
+              seed: int = 0, writer_class = RavfWriter, **writer_kwargs) -> (str, list):
+        file_name = str(tmp_path / f'{format.name}_{color_type.name}_{seed}.ravf')
+        frames = random_frames(format, color_type, width, height, count, endianess, seed)
+        with open(file_name, 'wb+') as file_handle:
+            writer = writer_class(file_handle, required_entries(format, color_type, width, height, endianess), [], **writer_kwargs)
+            write_frames(writer, file_handle, frames)
+            writer.finish(file_handle)
+        return (file_name, frames)
+    return write
@@ -0,0 +1,102 @@
+import tracemalloc
+import numpy as np
+import pytest
+from ravf import RavfReader, RavfCalibration, RavfAperture, RavfPhotometry, RavfColorType, RavfImageFormat
+from ravf.ravf_frame import RavfFrameType
+
+
+def frame_sums(reader, file_handle, frames) -> np.ndarray:
+    return reader.read_frames(file_handle, frames, mode = 'raw').sum(axis = (1, 2))
+
+
+def expected(raw: np.ndarray, calibration: RavfCalibration) -> np.ndarray:
+    return np.clip(np.rint(raw.astype(np.float64) - calibration.dark + calibration.pedestal), 0, 65535).astype(np.uint16)
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_calibration_of_read_only_16bit_frames(recording, use_mmap):
+    """Little endian 16 bit frames unpack to a read-only view of the frame data, the calibration mustn't write to it"""
+    (file_name, frames) = recording(RavfImageFormat.FORMAT_16BIT, RavfColorType.MONO, count = 4)
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle, use_mmap = use_mmap)
+        raw = reader.read_frames(file_handle, [1, 2], mode = 'raw')
+        calibration = RavfCalibration(dark = np.full((48, 64), 1000.0, np.float32), pedestal = 100.0)
+        reader.set_calibration(calibration)
+
+        assert np.array_equal(reader.read_frames(file_handle, [1, 2], mode = 'raw'), expected(raw, calibration))
+        (err, image, frame_info, status) = reader.getPymovieMainImageAndStatusData(file_handle, 2)
+        assert np.array_equal(image, expected(raw[1], calibration))
+        assert np.array_equal(reader.read_roi(file_handle, 1, 5, 6, 20, 10, mode = 'raw'), expected(raw[0], calibration)[6:16, 5:25])
+
+        # The plan doesn't modify its input
+        data = np.frombuffer(frames[1].tobytes(), np.uint8).reshape(frames[1].shape).copy()
+        plan = reader.decode_plan_for('raw')
+        assert np.array_equal(plan.decode(data), expected(raw[0], calibration))
+        assert np.array_equal(data, frames[1])
+        reader.close()
+
+
+@pytest.mark.parametrize('method', ['mean', 'sigma_clip', 'median'])
+def test_masters_ignore_the_readers_calibration(recording, method):
+    (file_name, frames) = recording(RavfImageFormat.FORMAT_PACKED_12BIT, RavfColorType.BAYER_BGGR, count = 30)
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle)
+        darks = reader.read_frames(file_handle, reader.frames_of_type(file_handle, RavfFrameType.DARK), mode = 'raw').astype(np.float64)
+        dark = RavfCalibration.build_master(reader, file_handle, RavfFrameType.DARK, method)
+        if method == 'mean':
+            assert np.allclose(dark, darks.mean(axis = 0))
+
+        reader.set_calibration(RavfCalibration.from_file(reader, file_handle, method))
+        assert np.array_equal(RavfCalibration.build_master(reader, file_handle, RavfFrameType.DARK, method), dark)
+        assert np.array_equal(reader.read_frames(file_handle, [0], mode = 'raw', calibrated = False)[0], darks[0])
+        assert not np.array_equal(reader.read_frames(file_handle, [0], mode = 'raw')[0], darks[0])
+
+
+def test_workers_use_the_readers_calibration(recording):
+    (file_name, frames) = recording(RavfImageFormat.FORMAT_PACKED_10BIT, RavfColorType.MONO, count = 12)
+    calibration = RavfCalibration(dark = np.full((48, 64), 5000.0, np.float32), pedestal = 10.0)
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle)
+        uncalibrated = reader.map_frames(file_handle, frame_sums, processes = 1)
+        reader.set_calibration(calibration)
+        calibrated = reader.map_frames(file_handle, frame_sums, processes = 1)
+        assert not np.array_equal(calibrated, uncalibrated)
+        assert np.array_equal(reader.map_frames(file_handle, frame_sums, processes = 2, chunk_frames = 4), calibrated)
+
+    apertures = [RavfAperture('star', 30.0, 20.0, 5.0)]
+    photometry = RavfPhotometry(file_name, apertures, mode = 'raw', calibration = calibration)
+    table = photometry.run(processes = 1)
+    assert np.array_equal(photometry.run(processes = 2, batch_frames = 4), table)
+    assert not np.array_equal(RavfPhotometry(file_name, apertures, mode = 'raw').run()['star_sum'], table['star_sum'])
+
+
+def test_calibration_stage_corrects_decode_temporaries_in_place():
+    calibration = RavfCalibration(dark = np.full((6, 8), 100.0, np.float32))
+    correct = calibration.stage().fn
+    image = np.arange(48, dtype = np.uint16).reshape(6, 8) * 1000
+    raw = image.copy()
+    assert correct(image) is image
+    assert np.array_equal(image, expected(raw, calibration))
+
+    # Views, read-only or not, aren't modified
+    for view in (np.frombuffer(raw.tobytes(), np.uint16).reshape(6, 8), raw.view()):
+        result = correct(view)
+        assert not np.shares_memory(result, view)
+        assert np.array_equal(result, expected(raw, calibration))
+    assert np.array_equal(raw, np.arange(48, dtype = np.uint16).reshape(6, 8) * 1000)
+
+
+def test_calibrated_packed_decode_makes_no_extra_frame_copy(recording):
+    (file_name, frames) = recording(RavfImageFormat.FORMAT_PACKED_12BIT, RavfColorType.MONO, width = 64, height = 1024, count = 1)
+    calibration = RavfCalibration(dark = np.full((1024, 64), 100.0, np.float32))
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle)
+        data = np.frombuffer(reader.frame_by_index(file_handle, 0).data, np.uint8).reshape(frames[0].shape)
+        peaks = []
+        for plan in (reader.decode_plan_for('raw', calibrated = False), calibration.apply_to_plan(reader.decode_plan_for('raw'))):
+            plan.decode(data)
+            tracemalloc.start()
+            plan.decode(data)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        assert peaks[1] - peaks[0] < 1024 * 64 * 2
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from ravf import RavfReader, RavfColorType, RavfImageEndianess, RavfImageFormat
+from ravf.ravf_image_utils import RavfImageUtils
+from conftest import stride_for
+
+(WIDTH, HEIGHT) = (64, 48)
+BAYER_TYPES = [RavfColorType.BAYER_RGGB, RavfColorType.BAYER_GRBG, RavfColorType.BAYER_GBRG, RavfColorType.BAYER_BGGR]
+CMY_TYPES = [RavfColorType.BAYER_CYYM, RavfColorType.BAYER_YCMY, RavfColorType.BAYER_YMCY, RavfColorType.BAYER_MYYC]
+FORMATS = [RavfImageFormat.FORMAT_8BIT, RavfImageFormat.FORMAT_16BIT, RavfImageFormat.FORMAT_PACKED_10BIT,
+           RavfImageFormat.FORMAT_PACKED_12BIT, RavfImageFormat.FORMAT_UNPACKED_10BIT, RavfImageFormat.FORMAT_UNPACKED_12BIT]
+# Offset of the crop of each pattern that is BGGR
+BGGR_CROPS = {RavfColorType.BAYER_RGGB: (1, 1), RavfColorType.BAYER_GRBG: (1, 0), RavfColorType.BAYER_GBRG: (0, 1), RavfColorType.BAYER_BGGR: (0, 0)}
+
+
+def baseline_raw(format: RavfImageFormat, data: np.ndarray) -> np.ndarray:
+    """Unpacks little endian frame data as getPymovieMainImageAndStatusData did before the decode plans, 8 bit is scaled by 256"""
+    stride = stride_for(format, WIDTH, RavfColorType.MONO)
+    if format == RavfImageFormat.FORMAT_PACKED_10BIT:
+        image = RavfImageUtils.unstride_10bit(RavfImageUtils.bytes_to_np_array(data.tobytes(), stride, HEIGHT), WIDTH, HEIGHT)
+        return RavfImageUtils.scale_10_to_16bit(RavfImageUtils.unpack_10bit_pigsc(image, WIDTH, HEIGHT, stride))
+    if format == RavfImageFormat.FORMAT_PACKED_12BIT:
+        image = RavfImageUtils.unstride_12bit(RavfImageUtils.bytes_to_np_array(data.tobytes(), stride, HEIGHT), WIDTH, HEIGHT)
+        return RavfImageUtils.scale_12_to_16bit(RavfImageUtils.unpack_12bit_pihq(image, WIDTH, HEIGHT, stride))
+    if format == RavfImageFormat.FORMAT_8BIT:
+        return data[:, :WIDTH].astype(np.uint16) << 8
+    image = RavfImageUtils.unstride_16bit(RavfImageUtils.bytes_to_np_array_16bit(data.tobytes(), stride, HEIGHT), WIDTH, HEIGHT)
+    return {RavfImageFormat.FORMAT_16BIT: image, RavfImageFormat.FORMAT_UNPACKED_10BIT: RavfImageUtils.scale_10_to_16bit(image),
+            RavfImageFormat.FORMAT_UNPACKED_12BIT: RavfImageUtils.scale_12_to_16bit(image)}[format]
+
+
+def read(file_name: str, mode: str) -> (np.ndarray, np.ndarray):
+    """Returns (frames decoded by read_frames, frames decoded by getPymovieMainImageAndStatusData)"""
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle)
+        frames = reader.read_frames(file_handle, slice(None), mode = mode)
+        pymovie = np.stack([reader.getPymovieMainImageAndStatusData(file_handle, i)[1] for i in range(reader.frame_count())])
+    return (frames, pymovie)
+
+
+@pytest.mark.parametrize(('format', 'color_type', 'debayer'), [
+    (RavfImageFormat.FORMAT_16BIT,          RavfColorType.MONO,       None),
+    (RavfImageFormat.FORMAT_PACKED_10BIT,   RavfColorType.MONO,       None),
+    (RavfImageFormat.FORMAT_PACKED_10BIT,   RavfColorType.BAYER_BGGR, RavfImageUtils.debayer_BGGR_to_GRAY),
+    (RavfImageFormat.FORMAT_PACKED_12BIT,   RavfColorType.BAYER_BGGR, RavfImageUtils.debayer_BGGR_to_GRAY),
+    (RavfImageFormat.FORMAT_UNPACKED_10BIT, RavfColorType.BAYER_GBRG, RavfImageUtils.debayer_GBRG_to_GRAY),
+    (RavfImageFormat.FORMAT_UNPACKED_12BIT, RavfColorType.BAYER_BGGR, RavfImageUtils.debayer_BGGR_to_GRAY)])
+def test_gray_matches_baseline_decode(recording, format, color_type, debayer):
+    """The combinations the original getPymovieMainImageAndStatusData decoded with the right CFA pattern"""
+    (file_name, frames) = recording(format, color_type, count = 3)
+    expected = np.stack([baseline_raw(format, data) if debayer is None else debayer(baseline_raw(format, data)) for data in frames])
+    (gray, pymovie) = read(file_name, 'gray')
+    assert np.array_equal(gray, expected) and np.array_equal(pymovie, expected)
+
+
+@pytest.mark.parametrize('format', FORMATS)
+@pytest.mark.parametrize('endianess', [RavfImageEndianess.LITTLE_ENDIAN, RavfImageEndianess.BIG_ENDIAN])
+def test_raw_matches_baseline_unpack(recording, format, endianess):
+    (file_name, frames) = recording(format, RavfColorType.MONO, count = 3, endianess = endianess)
+    # The same seed gives the same pixel values in either byte order
+    little_endian = recording(format, RavfColorType.MONO, count = 3)[1] if endianess == RavfImageEndianess.BIG_ENDIAN else frames
+    expected = np.stack([baseline_raw(format, data) for data in little_endian])
+    assert np.array_equal(read(file_name, 'raw')[0], expected)
+
+
+@pytest.mark.parametrize('format', FORMATS)
+@pytest.mark.parametrize('color_type', BAYER_TYPES)
+def test_gray_of_each_bayer_pattern(recording, format, color_type):
+    """Each pattern's image, cropped to start on a BGGR quad, debayers like the original BGGR decode away from the borders"""
+    (file_name, frames) = recording(format, color_type, count = 2)
+    (y, x) = BGGR_CROPS[color_type]
+    (gray, pymovie) = read(file_name, 'gray')
+    assert np.array_equal(gray, pymovie)
+    for (data, image) in zip(frames, gray):
+        expected = RavfImageUtils.debayer_BGGR_to_GRAY(np.ascontiguousarray(baseline_raw(format, data)[y:, x:]))
+        assert np.array_equal(image[y:, x:][2:-2, 2:-2], expected[2:-2, 2:-2])
+
+
+@pytest.mark.parametrize('color_type', CMY_TYPES)
+def test_gray_of_cmy_patterns(recording, color_type):
+    (file_name, frames) = recording(RavfImageFormat.FORMAT_PACKED_12BIT, color_type, count = 2)
+    for (data, image) in zip(frames, read(file_name, 'gray')[0]):
+        raw = baseline_raw(RavfImageFormat.FORMAT_PACKED_12BIT, data).astype(np.float64)
+        quads = (raw[:-1, :-1] + raw[1:, :-1] + raw[:-1, 1:] + raw[1:, 1:]) / 4
+        assert np.abs(image[1:, 1:] - quads).max() <= 1
@@ -0,0 +1,84 @@
+import errno
+import os
+import pytest
+from datetime import timedelta
+from ravf import RavfReader, RavfEditor, RavfImageFormat
+from ravf.ravf_frame import RavfFrame
+from conftest import FRAME_INTERVAL, frame_type
+
+
+def check_frames(file_name: str, sources: list):
+    """sources is a list of (frames written, frame indices) in the order the frames should appear"""
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle)
+        assert not reader.recovered
+        index = 0
+        for (frames, indices) in sources:
+            for i in indices:
+                frame = reader.frame_by_index(file_handle, index)
+                assert (frame.start_timestamp, frame.sequence, frame.frame_type) == ((i + 1) * FRAME_INTERVAL, i, frame_type(i).value)
+                assert bytes(frame.data) == frames[i].tobytes()
+                index += 1
+        assert reader.frame_count() == index == reader.metadata_value('FRAMES-COUNT')
+
+
+def test_extract(recording, tmp_path):
+    (file_name, frames) = recording(count = 12)
+    destination = str(tmp_path / 'extract.ravf')
+    result = RavfEditor.extract(file_name, destination, [5, 1, 2, 3, -1])
+    assert result['frames'] == 5 and result['bytes'] == 5 * (RavfFrame.RAVF_HEADER_LENGTH + frames[0].nbytes)
+    check_frames(destination, [(frames, [5, 1, 2, 3, 11])])
+
+    assert RavfEditor.extract(file_name, destination, slice(2, 8))['frames'] == 6
+    check_frames(destination, [(frames, range(2, 8))])
+    assert RavfEditor.extract(file_name, destination, [])['frames'] == 0
+    check_frames(destination, [(frames, [])])
+    with pytest.raises(IndexError):
+        RavfEditor.extract(file_name, destination, [12])
+
+
+def test_trim(recording, tmp_path):
+    (file_name, frames) = recording(count = 12)
+    destination = str(tmp_path / 'trim.ravf')
+    assert RavfEditor.trim(file_name, destination, 3 * FRAME_INTERVAL, 7 * FRAME_INTERVAL)['frames'] == 5	# Inclusive
+    check_frames(destination, [(frames, range(2, 7))])
+    RavfEditor.trim(file_name, destination, RavfFrame.RAVF_EPOCH + timedelta(microseconds = 3 * FRAME_INTERVAL // 1000 + 1), 7 * FRAME_INTERVAL - 1)
+    check_frames(destination, [(frames, range(3, 6))])
+
+
+def test_splice(recording, tmp_path):
+    (first, first_frames) = recording(count = 6, seed = 1)
+    (second, second_frames) = recording(count = 8, seed = 2)
+    destination = str(tmp_path / 'splice.ravf')
+    assert RavfEditor.splice([first, (second, slice(2, 5)), (first, [0])], destination)['frames'] == 10
+    check_frames(destination, [(first_frames, range(6)), (second_frames, range(2, 5)), (first_frames, [0])])
+
+    (other, frames) = recording(RavfImageFormat.FORMAT_PACKED_12BIT, count = 2)
+    with pytest.raises(ValueError):
+        RavfEditor.splice([first, other], destination)
+    with pytest.raises(ValueError):
+        RavfEditor.splice([], destination)
+
+
+def test_splice_of_interrupted_recording(recording, tmp_path):
+    (file_name, frames) = recording(count = 6)
+    os.truncate(file_name, os.path.getsize(file_name) - 8)	# Index damaged, rebuilt from the frames
+    destination = str(tmp_path / 'recovered.ravf')
+    assert RavfEditor.splice([file_name], destination)['frames'] == 6
+    check_frames(destination, [(frames, range(6))])
+
+
+def test_copy_fallbacks(recording, tmp_path, monkeypatch):
+    (file_name, frames) = recording(count = 6)
+    destination = str(tmp_path / 'fallback.ravf')
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, 'Cross-device link')
+
+    methods = []
+    for name in ('copy_file_range', 'sendfile'):
+        if hasattr(os, name):
+            monkeypatch.setattr(os, name, unsupported)
+            result = RavfEditor.extract(file_name, destination, [4, 0, 1, 2])
+            methods.append(result['method'])
+            check_frames(destination, [(frames, [4, 0, 1, 2])])
+    assert methods[-1] == 'pwrite'
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from ravf import RavfReader, RavfExporter, RavfColorType, RavfImageFormat
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_export(recording, tmp_path, processes):
+    (file_name, frames) = recording(RavfImageFormat.FORMAT_PACKED_12BIT, RavfColorType.BAYER_BGGR, count = 30)
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle)
+        (gray, bgr) = (reader.read_frames(file_handle, slice(5, 25)), reader.read_frames(file_handle, slice(5, 25), mode = 'bgr'))
+        sequences = reader.frame_sequences(file_handle)[5:25]
+
+    npy = str(tmp_path / 'frames.npy')
+    for (mode, expected) in (('gray', gray), ('bgr', bgr)):
+        RavfExporter.to_npy(file_name, npy, mode = mode, start = 5, stop = 25, processes = processes, chunk_frames = 6)
+        assert np.array_equal(np.load(npy, mmap_mode = 'r'), expected)
+    table = np.load(RavfExporter.table_name(npy))
+    assert np.array_equal(table['index'], np.arange(5, 25)) and np.array_equal(table['sequence'], sequences)
+
+    fits = str(tmp_path / 'frames.fits')
+    RavfExporter.to_fits(file_name, fits, start = 5, stop = 25, processes = processes, chunk_frames = 6)
+    with open(fits, 'rb') as f:
+        data = f.read()
+    assert len(data) % RavfExporter.FITS_BLOCK == 0
+    cube = np.frombuffer(data, '>i2', count = gray.size, offset = RavfExporter.FITS_BLOCK).reshape(gray.shape).astype(np.int32) + 32768
+    assert np.array_equal(cube, gray)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from ravf import RavfReader
+from ravf.ravf_frame_cache import RavfFrameCache
+
+
+def test_cache_hits_and_lru_eviction():
+    cache = RavfFrameCache(300)
+    for key in 'abc':
+        cache.put(key, key.upper(), 100)
+    assert cache.get('a') == 'A'		# a is now the most recently used
+    assert cache.get('x') is None
+    cache.put('d', 'D', 100)			# Evicts b
+    assert (cache.get('b'), cache.get('c'), cache.get('d'), cache.get('a')) == (None, 'C', 'D', 'A')
+
+    cache.put('e', 'E', 250)			# Evicts as many as needed
+    assert [key for key in 'acd' if cache.get(key) is not None] == []
+    cache.put('f', 'F', 301)			# Larger than the whole cache, not cached
+    assert (cache.get('e'), cache.get('f')) == ('E', None)
+
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['evictions']) == (1, 250, 4)
+    assert (stats['hits'], stats['misses']) == (5, 6)
+    cache.clear()
+    assert (cache.stats()['entries'], cache.stats()['bytes'], cache.get('e')) == (0, 0, None)
+
+
+def test_replacing_an_entry_updates_its_size():
+    cache = RavfFrameCache(300)
+    cache.put('a', 1, 200)
+    cache.put('a', 2, 100)
+    cache.put('b', 3, 200)
+    assert (cache.get('a'), cache.get('b'), cache.stats()['evictions']) == (2, 3, 0)
+
+
+def test_reader_cache(recording):
+    (file_name, frames) = recording(count = 4)
+    with open(file_name, 'rb') as file_handle:
+        image_bytes = 48 * 64 * 2
+        reader = RavfReader(file_handle, cache_bytes = 2 * image_bytes)
+        uncached = RavfReader(file_handle)
+        first = reader.getPymovieMainImageAndStatusData(file_handle, 1)[1]
+        assert reader.getPymovieMainImageAndStatusData(file_handle, 1)[1] is first
+        assert np.array_equal(first, uncached.getPymovieMainImageAndStatusData(file_handle, 1)[1])
+        with pytest.raises(ValueError):
+            first[0, 0] = 0		# Shared between callers, so read only
+
+        reader.getPymovieMainImageAndStatusData(file_handle, 2)
+        reader.getPymovieMainImageAndStatusData(file_handle, 3)	# Evicts frame 1
+        assert reader.getPymovieMainImageAndStatusData(file_handle, 1)[1] is not first
+        assert (reader.cache.stats()['hits'], reader.cache.stats()['evictions']) == (1, 2)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from ravf import RavfReader, RavfWriter, RavfFrameStats, RavfColorType, RavfImageFormat
+from ravf.ravf_frame import RavfFrameType
+from conftest import FRAME_INTERVAL, required_entries
+
+
+@pytest.mark.parametrize('format', [RavfImageFormat.FORMAT_PACKED_12BIT, RavfImageFormat.FORMAT_16BIT, RavfImageFormat.FORMAT_8BIT])
+@pytest.mark.parametrize('row_step', [1, 4])
+def test_sidecar_matches_compute(recording, format, row_step):
+    (file_name, frames) = recording(format, count = 10, frame_stats = True, stats_row_step = row_step)
+    sidecar = RavfFrameStats.load(file_name)
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle)
+        stats = RavfFrameStats.compute(reader, file_handle, row_step)
+        assert np.array_equal(RavfFrameStats.compute(reader, file_handle, row_step, processes = 2), stats)
+    assert sidecar.dtype == RavfFrameStats.DTYPE and len(sidecar) == len(frames)
+    for name in ('timestamp', 'max', 'saturated', 'sequence', 'sequence_gap'):
+        assert np.array_equal(sidecar[name], stats[name]), name
+    assert np.allclose(sidecar['mean'], stats['mean'], rtol = 1e-6)
+
+
+def test_saturation_gaps_and_events(tmp_path):
+    file_name = str(tmp_path / 'event.ravf')
+    frames = [np.full((48, 128), 0x10, np.uint8) for i in range(40)]
+    frames[5] = np.full((48, 128), 0xFF, np.uint8)		# Saturated
+    frames[30] = np.full((48, 128), 0x01, np.uint8)	# Occultation
+    sequences = list(range(20)) + list(range(23, 43))	# 3 frames dropped
+    with open(file_name, 'wb+') as file_handle:
+        writer = RavfWriter(file_handle, required_entries(RavfImageFormat.FORMAT_16BIT, RavfColorType.MONO, 64, 48), [], frame_stats = True)
+        for (i, (frame, sequence)) in enumerate(zip(frames, sequences)):
+            writer.write_frame(file_handle, RavfFrameType.LIGHT, frame, (sequence + 1) * FRAME_INTERVAL, FRAME_INTERVAL // 2, 8, 0, 0, 3, sequence)
+        writer.finish(file_handle)
+
+    stats = RavfFrameStats.load(file_name, mmap = True)
+    assert list(np.flatnonzero(stats['saturated'])) == [5] and stats['saturated'][5] == 64 * 48 // 4	# Every 4th row by default
+    assert list(np.flatnonzero(stats['sequence_gap'])) == [20] and stats['sequence_gap'][20] == 3
+    assert list(RavfFrameStats.candidate_events(stats)) == [5, 30]
+    assert len(RavfFrameStats.candidate_events(stats[:0])) == 0
+
+    with open(file_name, 'rb') as file_handle:
+        computed = RavfFrameStats.compute(RavfReader(file_handle), file_handle, save = True)
+    assert np.array_equal(RavfFrameStats.load(file_name), computed)
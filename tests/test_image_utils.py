@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from ravf.ravf_image_utils import RavfImageUtils
+
+
+def reference_12bit(image: np.ndarray, width: int, height: int) -> np.ndarray:
+    return RavfImageUtils.scale_12_to_16bit(RavfImageUtils.unpack_12bit_pihq(RavfImageUtils.unstride_12bit(image, width, height), width, height, None))
+
+
+def reference_10bit(image: np.ndarray, width: int, height: int) -> np.ndarray:
+    return RavfImageUtils.scale_10_to_16bit(RavfImageUtils.unpack_10bit_pigsc(RavfImageUtils.unstride_10bit(image, width, height), width, height, None))
+
+
+def packed(shape: tuple, row_bytes: int, seed: int = 0) -> np.ndarray:
+    """Random uint8 image data with rows padded to 32 bytes"""
+    return np.random.default_rng(seed).integers(0, 256, shape + ((row_bytes + 31) // 32 * 32,), dtype = np.uint8)
+
+
+@pytest.mark.parametrize('fast', [True, False])
+@pytest.mark.parametrize('width', [4, 64, 1456])
+@pytest.mark.parametrize('leading', [(), (3,)])
+def test_unpack_10bit_matches_reference(monkeypatch, fast, width, leading):
+    monkeypatch.setattr(RavfImageUtils, '_FAST_UNPACK', fast)
+    height = 6
+    image = packed(leading + (height,), width * 5 // 4)
+    assert np.array_equal(RavfImageUtils.unpack_10bit_pigsc_to_16bit(image, width, height), reference_10bit(image, width, height))
+
+
+@pytest.mark.parametrize('fast', [True, False])
+@pytest.mark.parametrize('width', [2, 64, 4056])
+@pytest.mark.parametrize('leading', [(), (3,)])
+def test_unpack_12bit_matches_reference(monkeypatch, fast, width, leading):
+    monkeypatch.setattr(RavfImageUtils, '_FAST_UNPACK', fast)
+    height = 6
+    image = packed(leading + (height,), width * 3 // 2)
+    assert np.array_equal(RavfImageUtils.unpack_12bit_pihq_to_16bit(image, width, height), reference_12bit(image, width, height))
+
+
+@pytest.mark.parametrize('row_padding', [0, 2, 4])
+def test_unpack_into_strided_out(row_padding):
+    """out can be a view with padded rows, e.g. a region of a larger image"""
+    (width, height) = (64, 6)
+    for (unpack, reference, row_bytes) in ((RavfImageUtils.unpack_10bit_pigsc_to_16bit, reference_10bit, width * 5 // 4),
+                                           (RavfImageUtils.unpack_12bit_pihq_to_16bit, reference_12bit, width * 3 // 2)):
+        image = packed((height,), row_bytes, seed = row_padding)
+        buffer = np.zeros((height, width + row_padding), np.uint16)
+        out = buffer[:, :width]
+        assert unpack(image, width, height, out = out) is out
+        assert np.array_equal(out, reference(image, width, height))
+        assert not buffer[:, width:].any()
+
+
+def test_unpack_rejects_wrong_out():
+    image = packed((6,), 80)
+    with pytest.raises(AssertionError):
+        RavfImageUtils.unpack_10bit_pigsc_to_16bit(image, 64, 6, out = np.empty((6, 63), np.uint16))
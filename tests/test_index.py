@@ -0,0 +1,49 @@
+import pytest
+from ravf.ravf_index import RavfIndex
+
+
+def index_of(timestamps: list) -> RavfIndex:
+    index = RavfIndex()
+    for (i, timestamp) in enumerate(timestamps):
+        index.add_frame(1000 + i * 100, timestamp)
+    return index
+
+
+def test_index_for_timestamp_boundaries():
+    index = index_of([100, 200, 300, 400])
+    # Exact matches
+    for mode in ('nearest', 'before', 'after'):
+        assert [index.index_for_timestamp(t, mode) for t in (100, 200, 300, 400)] == [0, 1, 2, 3]
+    # Between frames, a tie is resolved to the earlier frame
+    assert [index.index_for_timestamp(t) for t in (149, 150, 151)] == [0, 0, 1]
+    assert (index.index_for_timestamp(201, 'before'), index.index_for_timestamp(201, 'after')) == (1, 2)
+    # Outside the recording
+    assert (index.index_for_timestamp(0), index.index_for_timestamp(10**12)) == (0, 3)
+    assert (index.index_for_timestamp(99, 'after'), index.index_for_timestamp(401, 'before')) == (0, 3)
+    with pytest.raises(ValueError):
+        index.index_for_timestamp(99, 'before')
+    with pytest.raises(ValueError):
+        index.index_for_timestamp(401, 'after')
+    with pytest.raises(ValueError):
+        index.index_for_timestamp(200, 'closest')
+    with pytest.raises(ValueError):
+        RavfIndex().index_for_timestamp(200)
+
+
+def test_indices_for_timestamps_are_inclusive():
+    index = index_of([100, 200, 300, 400])
+    assert list(index.indices_for_timestamps(200, 300)) == [1, 2]
+    assert list(index.indices_for_timestamps(201, 299)) == []
+    assert list(index.indices_for_timestamps(0, 10**12)) == [0, 1, 2, 3]
+    assert list(index.indices_for_timestamps(300, 200)) == []
+
+
+def test_out_of_order_timestamps():
+    index = index_of([100, 300, 200, 400, 300])
+    assert index.index_for_timestamp(210) == 2
+    assert index.index_for_timestamp(300, 'after') in (1, 4)
+    assert index.index_for_timestamp(299, 'before') == 2
+    assert list(index.indices_for_timestamps(200, 300)) == [1, 2, 4]
+    # Adding a frame invalidates the sort order
+    index.add_frame(2000, 50)
+    assert index.index_for_timestamp(60) == 5
@@ -0,0 +1,30 @@
+from ravf import RavfReader, RavfInstrumentation, RavfHistogram
+
+
+def test_histogram_percentiles():
+    histogram = RavfHistogram()
+    for value in range(1, 1001):
+        histogram.add(value)
+    assert (histogram.count, histogram.total, histogram.max) == (1000, 500500, 1000)
+    for percent in (50, 90, 99):
+        exact = 10 * percent
+        assert exact <= histogram.percentile(percent) <= exact * 1.125
+    assert RavfHistogram().percentile(50) == 0
+
+
+def test_decode_stages_recorded_once(recording):
+    (file_name, frames) = recording(count = 4)
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle)
+        instrumentation = RavfInstrumentation.enable()
+        try:
+            reader.read_frames(file_handle, [0, 1, 2])
+            reader.getPymovieMainImageAndStatusData(file_handle, 3)
+        finally:
+            assert RavfInstrumentation.disable() is instrumentation
+        timings = instrumentation.stats()['timings']
+        assert timings['read.frames']['count'] == 1
+        for stage in reader.decode_plan.stages:
+            assert timings['decode.' + stage.name]['count'] == 2
+        reader.read_frames(file_handle, [0])
+        assert instrumentation.stats()['timings']['read.frames']['count'] == 1		# Nothing recorded once disabled
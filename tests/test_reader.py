@@ -0,0 +1,143 @@
+import threading
+import numpy as np
+import pytest
+from ravf import RavfReader, RavfWriter, RavfAsyncWriter, RavfColorType, RavfImageFormat
+from conftest import FRAME_INTERVAL, check_round_trip, frame_type, random_frames, required_entries, write_frames
+
+FORMATS = [RavfImageFormat.FORMAT_8BIT, RavfImageFormat.FORMAT_16BIT, RavfImageFormat.FORMAT_PACKED_10BIT,
+           RavfImageFormat.FORMAT_PACKED_12BIT, RavfImageFormat.FORMAT_UNPACKED_10BIT, RavfImageFormat.FORMAT_UNPACKED_12BIT]
+COLOR_TYPES = [RavfColorType.MONO, RavfColorType.BAYER_BGGR, RavfColorType.BAYER_CYYM]
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_writer_round_trip(recording, use_mmap):
+    check_round_trip(*recording(count = 12), use_mmap)
+
+
+@pytest.mark.parametrize('block_when_full', [False, True])
+def test_async_writer_round_trip(recording, block_when_full):
+    # Enough buffers that no frame is dropped when not blocking
+    check_round_trip(*recording(count = 12, writer_class = RavfAsyncWriter, buffer_count = 16, block_when_full = block_when_full), False)
+
+
+def test_checkpointed_writer_round_trip(recording):
+    check_round_trip(*recording(count = 12, checkpoint_frames = 5), True)
+
+
+@pytest.mark.parametrize('format', FORMATS)
+@pytest.mark.parametrize('color_type', COLOR_TYPES)
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_roi_matches_crop_of_full_decode(recording, format, color_type, use_mmap):
+    (file_name, frames) = recording(format, color_type, count = 3)
+    rng = np.random.default_rng(format.value * 16 + color_type.value)
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle, use_mmap = use_mmap)
+        for mode in ('raw', 'gray', 'bgr'):
+            full = reader.read_frames(file_handle, [0, 1, 2], mode = mode)
+            regions = [(0, 0, 64, 48), (0, 0, 1, 1), (63, 47, 1, 1)]
+            for i in range(8):
+                (x, y) = (int(rng.integers(0, 63)), int(rng.integers(0, 47)))
+                regions.append((x, y, int(rng.integers(1, 65 - x)), int(rng.integers(1, 49 - y))))
+            for (x, y, width, height) in regions:
+                assert np.array_equal(reader.read_rois(file_handle, slice(0, 3), x, y, width, height, mode = mode), full[:, y:y + height, x:x + width]), (mode, x, y, width, height)
+            assert np.array_equal(reader.read_roi(file_handle, 1, 13, 7, 20, 17, mode = mode), full[1, 7:24, 13:33])
+        reader.close()
+
+
+def test_roi_outside_image(recording):
+    (file_name, frames) = recording(count = 1)
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle)
+        with pytest.raises(ValueError):
+            reader.read_roi(file_handle, 0, 60, 0, 8, 8)
+
+
+@pytest.mark.parametrize('format', FORMATS)
+@pytest.mark.parametrize('color_type', [RavfColorType.MONO, RavfColorType.BAYER_BGGR])
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_preview_matches_quads_of_full_decode(recording, format, color_type, use_mmap):
+    (file_name, frames) = recording(format, color_type, count = 2)
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle, use_mmap = use_mmap)
+        raw = reader.read_frames(file_handle, [1], mode = 'raw')[0].astype(np.int64)
+        # Packed formats only use the most significant byte of each pixel
+        tolerance = 0xFF if format in (RavfImageFormat.FORMAT_PACKED_10BIT, RavfImageFormat.FORMAT_PACKED_12BIT) else 0
+        for scale in (2, 4, 8):
+            (height, width) = (48 // scale, 64 // scale)
+            quads = raw[0::scale, 0::scale] + raw[1::scale, 0::scale] + raw[0::scale, 1::scale] + raw[1::scale, 1::scale]
+            preview = reader.read_preview(file_handle, 1, scale)
+            assert preview.shape == (height, width) and preview.dtype == np.uint16
+            assert np.abs(preview - quads[:height, :width] // 4).max() <= tolerance, scale
+        reader.close()
+
+
+def frame_sequence_sums(reader, file_handle, frames) -> int:
+    return int(reader.frame_sequences(file_handle)[frames[0]:frames[1]].sum())
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_imap_frames_in_order(recording, processes):
+    (file_name, frames) = recording(count = 20)
+    tasks = [(start, start + 3) for start in range(0, 20, 3)]
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle)
+        results = list(reader.imap_frames(file_handle, frame_sequence_sums, tasks, processes, prefetch = 1))
+        assert results == [sum(range(start, min(stop, 20))) for (start, stop) in tasks]
+
+        # Stopping early doesn't leave the pool running
+        results = reader.imap_frames(file_handle, frame_sequence_sums, tasks, processes)
+        assert next(results) == sum(range(3))
+        results.close()
+
+
+@pytest.mark.parametrize('format', FORMATS)
+def test_read_no_frames(recording, format):
+    (file_name, frames) = recording(format, count = 2)
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle)
+        for mode in ('raw', 'gray', 'bgr'):
+            assert reader.read_frames(file_handle, [], mode = mode).shape == (0,) + reader.decode_plan_for(mode).output_shape
+            assert reader.read_frames(file_handle, slice(1, 1), mode = mode).shape[0] == 0
+            assert reader.read_rois(file_handle, [], 3, 4, 10, 12, mode = mode).shape[:3] == (0, 12, 10)
+
+
+def test_unknown_image_format_only_fails_to_decode(tmp_path):
+    file_name = str(tmp_path / 'future.ravf')
+    frames = random_frames(RavfImageFormat.FORMAT_8BIT, RavfColorType.MONO, 64, 48, 3)
+    entries = [(name, 99 if name == 'IMAGE-FORMAT' else value) for (name, value) in required_entries(RavfImageFormat.FORMAT_8BIT, RavfColorType.MONO, 64, 48)]
+    with open(file_name, 'wb+') as file_handle:
+        writer = RavfWriter(file_handle, entries, [])
+        write_frames(writer, file_handle, frames)
+        writer.finish(file_handle)
+
+    with open(file_name, 'rb') as file_handle:
+        reader = RavfReader(file_handle)
+        assert reader.decode_plan is None
+        assert reader.metadata_value('IMAGE-FORMAT') == 99
+        assert np.array_equal(reader.timestamps(), (np.arange(3) + 1) * FRAME_INTERVAL)
+        assert bytes(reader.frame_by_index(file_handle, 2).data) == frames[2].tobytes()
+        with pytest.raises(ValueError):
+            reader.read_frames(file_handle, [0])
+        with pytest.raises(ValueError):
+            reader.getPymovieMainImageAndStatusData(file_handle, 0)
+
+
+def test_async_writer_checkpoints_on_the_writer_thread(tmp_path, monkeypatch):
+    threads = []
+    checkpoint = RavfWriter.checkpoint
+    def record_thread(self, file_handle):
+        threads.append(threading.current_thread())
+        checkpoint(self, file_handle)
+    monkeypatch.setattr(RavfWriter, 'checkpoint', record_thread)
+
+    file_name = str(tmp_path / 'async.ravf')
+    frames = random_frames(RavfImageFormat.FORMAT_PACKED_10BIT, RavfColorType.BAYER_BGGR, 64, 48, 12)
+    with open(file_name, 'wb+') as file_handle:
+        writer = RavfAsyncWriter(file_handle, required_entries(RavfImageFormat.FORMAT_PACKED_10BIT, RavfColorType.BAYER_BGGR, 64, 48), [], buffer_count = 16, checkpoint_frames = 5)
+        for (i, frame) in enumerate(frames):
+            writer.write_frame(file_handle, frame_type(i), frame, (i + 1) * FRAME_INTERVAL, FRAME_INTERVAL // 2, 8, 0, 0, 3, i)
+            if i == 5:
+                writer.checkpoint(file_handle)
+        writer.finish(file_handle)
+    assert len(threads) == 3 and threading.current_thread() not in threads
+    check_round_trip(file_name, frames, False)
@@ -0,0 +1,52 @@
+import os
+import numpy as np
+import pytest
+from ravf import RavfReader, RavfWriter, RavfColorType, RavfImageFormat
+from ravf.ravf_frame import RavfFrame
+from conftest import FRAME_INTERVAL, random_frames, required_entries, write_frames
+
+
+def interrupted_recording(file_name: str, count: int, **writer_kwargs) -> (list, list):
+    """Writes count frames without finishing, returns (the frames, the offset of each frame)"""
+    frames = random_frames(RavfImageFormat.FORMAT_PACKED_10BIT, RavfColorType.BAYER_BGGR, 64, 48, count)
+    with open(file_name, 'wb+') as file_handle:
+        writer = RavfWriter(file_handle, required_entries(RavfImageFormat.FORMAT_PACKED_10BIT, RavfColorType.BAYER_BGGR, 64, 48), [], **writer_kwargs)
+        offsets = [file_handle.tell() + i * (RavfFrame.RAVF_HEADER_LENGTH + len(frames[0].tobytes())) for i in range(count)]
+        write_frames(writer, file_handle, frames)
+    return (frames, offsets)
+
+
+def check_recovered(file_name: str, frames: list, indices: list):
+    with open(file_name, 'rb') as file_handle:
+        with pytest.raises(ValueError):
+            RavfReader(file_handle)
+        reader = RavfReader(file_handle, recover = True)
+        assert reader.recovered and reader.frame_count() == len(indices)
+        assert np.array_equal(reader.timestamps(), (np.asarray(indices) + 1) * FRAME_INTERVAL)
+        for (i, index) in enumerate(indices):
+            assert bytes(reader.frame_by_index(file_handle, i).data) == frames[index].tobytes()
+
+
+def test_recover_truncated_recording(tmp_path):
+    file_name = str(tmp_path / 'interrupted.ravf')
+    (frames, offsets) = interrupted_recording(file_name, 12, checkpoint_frames = 5)
+    os.truncate(file_name, offsets[11] + 500)	# Power lost while writing the last frame
+    check_recovered(file_name, frames, list(range(11)))
+
+    with open(file_name, 'rb') as file_handle:
+        assert RavfReader(file_handle, recover = True).metadata_value('FRAMES-COUNT') == 10	# As of the last checkpoint
+
+
+def test_recover_truncated_index(recording):
+    (file_name, frames) = recording(count = 6)
+    os.truncate(file_name, os.path.getsize(file_name) - 8)
+    check_recovered(file_name, frames, list(range(6)))
+
+
+def test_recover_skips_corrupt_frame(tmp_path):
+    file_name = str(tmp_path / 'corrupt.ravf')
+    (frames, offsets) = interrupted_recording(file_name, 8)
+    with open(file_name, 'r+b') as file_handle:
+        file_handle.seek(offsets[3], 0)
+        file_handle.write(bytes(8))		# Frame 3's magic number
+    check_recovered(file_name, frames, [0, 1, 2, 4, 5, 6, 7])
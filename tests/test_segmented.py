@@ -0,0 +1,72 @@
+import os
+from datetime import timedelta
+import numpy as np
+import pytest
+from ravf import RavfReader, RavfSegmentedWriter, RavfSegmentedReader, RavfColorType, RavfImageFormat
+from ravf.ravf_frame import RavfFrame, RavfFrameType
+from conftest import FRAME_INTERVAL, frame_type, random_frames, required_entries, write_frames
+
+
+def write_segments(base_name: str, frames: list, **kwargs) -> list:
+    writer = RavfSegmentedWriter(base_name, required_entries(RavfImageFormat.FORMAT_PACKED_12BIT, RavfColorType.BAYER_BGGR, 64, 48), [], **kwargs)
+    write_frames(writer, None, frames)
+    return writer.finish()
+
+
+@pytest.mark.parametrize('kwargs', [{'max_frames': 4}, {'max_seconds': 0.15}, {'max_bytes': 20000}, {'max_frames': 100}])
+def test_segmented_round_trip(tmp_path, kwargs):
+    base_name = str(tmp_path / 'night.ravf')
+    frames = random_frames(RavfImageFormat.FORMAT_PACKED_12BIT, RavfColorType.BAYER_BGGR, 64, 48, 14)
+    names = write_segments(base_name, frames, **kwargs)
+    assert names == RavfSegmentedWriter.segment_names_for(base_name)
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(name) for name in names)	# No preopened segment left behind
+
+    counts = []
+    for (number, name) in enumerate(names):
+        with open(name, 'rb') as file_handle:
+            reader = RavfReader(file_handle)
+            assert reader.metadata_value('SEGMENT-NUMBER') == number
+            counts.append(reader.frame_count())
+            if 'max_bytes' in kwargs:
+                assert os.path.getsize(name) <= kwargs['max_bytes']
+    assert sum(counts) == len(frames)
+    if 'max_frames' in kwargs:
+        assert max(counts) <= kwargs['max_frames']
+
+    reader = RavfSegmentedReader.open(base_name)
+    try:
+        assert reader.frame_count() == len(frames)
+        assert np.array_equal(reader.timestamps(), (np.arange(len(frames)) + 1) * FRAME_INTERVAL)
+        assert np.array_equal(reader.frame_sequences(None), np.arange(len(frames)))
+        assert list(reader.frames_of_type(None, RavfFrameType.DARK)) == [i for i in range(len(frames)) if frame_type(i) == RavfFrameType.DARK]
+        for (i, data) in enumerate(frames):
+            assert bytes(reader.frame_by_index(None, i).data) == data.tobytes()
+        assert reader.index_for_time(5 * FRAME_INTERVAL + 1) == 4
+        assert reader.index_for_time(RavfFrame.RAVF_EPOCH + timedelta(microseconds = 5 * FRAME_INTERVAL // 1000 - 1), 'after') == 4
+        assert list(reader.frames_in_range(3 * FRAME_INTERVAL, 9 * FRAME_INTERVAL)) == list(range(2, 9))
+
+        # Decoding across segments matches decoding each segment's frames on its own
+        expected = []
+        for name in names:
+            with open(name, 'rb') as file_handle:
+                expected.append(RavfReader(file_handle).read_frames(file_handle, slice(None)))
+        expected = np.concatenate(expected)
+        assert np.array_equal(reader.read_frames(None, slice(None)), expected)
+        assert np.array_equal(reader.read_frames(None, [13, 0, 5]), expected[[13, 0, 5]])
+        assert reader.read_frames(None, []).shape == (0, 48, 64)
+        assert np.array_equal(np.stack([image for (err, image, info, status) in reader.iter_frames(None)]), expected)
+    finally:
+        reader.close()
+
+
+def test_segmented_reader_rejects_different_geometry(recording):
+    (first, frames) = recording(RavfImageFormat.FORMAT_PACKED_12BIT, count = 2)
+    (second, frames) = recording(RavfImageFormat.FORMAT_PACKED_10BIT, count = 2)
+    with pytest.raises(ValueError):
+        RavfSegmentedReader([first, second])
+
+
+def test_segment_writers_are_quiet(tmp_path, capsys):
+    frames = random_frames(RavfImageFormat.FORMAT_PACKED_12BIT, RavfColorType.BAYER_BGGR, 64, 48, 6)
+    write_segments(str(tmp_path / 'night.ravf'), frames, max_frames = 2)
+    assert capsys.readouterr().out == ''
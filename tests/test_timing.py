@@ -0,0 +1,54 @@
+import numpy as np
+from ravf import RavfReader, RavfWriter, RavfTimingAnalyzer, RavfColorType, RavfImageFormat
+from ravf.ravf_frame import RavfFrame, RavfFrameType
+from conftest import FRAME_INTERVAL, random_frames, required_entries
+
+
+def test_timing_gaps_and_jitter(tmp_path):
+    file_name = str(tmp_path / 'timing.ravf')
+    count = 30
+    sequences = np.arange(count) + np.where(np.arange(count) >= 10, 2, 0)	# 2 frames dropped before frame 10
+    sequences[25:] = np.arange(count - 25)								# Camera restarted at frame 25
+    timestamps = (np.arange(count) + np.where(np.arange(count) >= 10, 2, 0)) * FRAME_INTERVAL + 10**9
+    timestamps[15] += FRAME_INTERVAL // 4								# Late by 10 ms
+    timestamps[25:] += 5 * FRAME_INTERVAL
+    exposures = np.full(count, FRAME_INTERVAL // 2)
+    exposures[18] = FRAME_INTERVAL // 4
+    fix_status = np.full(count, 3)
+    fix_status[20:23] = 1
+    almanac_status = np.where((np.arange(count) >= 3) & (np.arange(count) < 5), 1, 0)
+
+    frame = random_frames(RavfImageFormat.FORMAT_8BIT, RavfColorType.MONO, 64, 48, 1)[0]
+    with open(file_name, 'wb+') as file_handle:
+        writer = RavfWriter(file_handle, required_entries(RavfImageFormat.FORMAT_8BIT, RavfColorType.MONO, 64, 48), [])
+        for i in range(count):
+            writer.write_frame(file_handle, RavfFrameType.LIGHT, frame, int(timestamps[i]), int(exposures[i]), 5 + i % 3, int(almanac_status[i]), 0, int(fix_status[i]), int(sequences[i]))
+        writer.finish(file_handle)
+
+    with open(file_name, 'rb') as file_handle:
+        analyzer = RavfTimingAnalyzer.for_reader(RavfReader(file_handle), file_handle)
+
+    gaps = analyzer.dropped_frames()
+    assert gaps.tolist() == [(10, 12, 2), (25, 0, -27)]
+    assert analyzer.nominal_interval() == FRAME_INTERVAL
+
+    jitter = analyzer.jitter()
+    assert jitter[9] == 0		# The interval over the dropped frames is as expected
+    assert (jitter[14], jitter[15]) == (FRAME_INTERVAL // 4, -(FRAME_INTERVAL // 4))
+    assert np.isnan(jitter[24])
+    assert list(analyzer.jitter_frames()) == [15, 16]
+    assert list(analyzer.jitter_frames(tolerance = FRAME_INTERVAL)) == []
+
+    assert list(analyzer.exposure_anomalies()) == [18]
+    assert analyzer.fix_losses().tolist() == [(20, 23)]
+    assert analyzer.almanac_uncertain().tolist() == [(3, 5)]
+
+    report = analyzer.report()
+    assert (report['frames'], report['dropped_frames'], report['sequence_gaps'], report['sequence_resets']) == (count, 2, 1, 1)
+    assert (report['jitter_max_ns'], report['jitter_frames'], report['frames_without_fix'], report['min_satellites']) == (FRAME_INTERVAL // 4, 2, 3, 5)
+
+
+def test_timing_of_empty_recording():
+    analyzer = RavfTimingAnalyzer(np.empty(0, RavfFrame.HEADER_DTYPE))
+    report = analyzer.report()
+    assert (report['frames'], report['dropped_frames'], report['jitter_rms_ns']) == (0, 0, 0.0)
@@ -0,0 +1,19 @@
+import pytest
+from ravf import RavfReader, RavfTranscoder, RavfCompressionType, RavfColorType, RavfImageFormat
+from conftest import check_round_trip
+
+
+@pytest.mark.parametrize('compression_type', [RavfCompressionType.ZLIB, RavfCompressionType.LZMA])
+@pytest.mark.parametrize('processes', [1, 2])
+def test_transcode_round_trip(recording, tmp_path, compression_type, processes):
+    (file_name, frames) = recording(RavfImageFormat.FORMAT_UNPACKED_12BIT, RavfColorType.BAYER_BGGR, count = 10)
+    compressed = str(tmp_path / 'compressed.ravf')
+    stats = RavfTranscoder.transcode(file_name, compressed, compression_type, processes = processes, batch_frames = 3)
+    assert stats['frames'] == len(frames)
+    with open(compressed, 'rb') as file_handle:
+        assert RavfReader(file_handle).compression is not None
+    check_round_trip(compressed, frames, False)
+
+    restored = str(tmp_path / 'restored.ravf')
+    RavfTranscoder.transcode(compressed, restored, RavfCompressionType.NONE, processes = processes, batch_frames = 4)
+    check_round_trip(restored, frames, True)